@@ -0,0 +1,188 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import TICK_INTERVAL, CARBON_KG_PER_KWH
+from report_service import percent_change
+from rollup_service import floor_time, get_watermark, query_usage
+from tariff_service import CURRENCY_SYMBOLS
+
+# Range name -> (span, consumption/cost series bucketing)
+ANALYTICS_RANGES = {
+    '24h': (timedelta(hours=24), 'hour'),
+    '7d': (timedelta(days=7), 'day'),
+    '30d': (timedelta(days=30), 'day'),
+    '90d': (timedelta(days=90), 'day')
+}
+ANALYTICS_CACHE_ENTRIES = 4096
+COMPARISON_PARTS = 4
+TREND_THRESHOLD = 5  # percent change before an appliance counts as trending
+
+class AnalyticsEngine:
+    """Analytics page payload computed in one pass over hourly rollups.
+
+    The current range and the previous range of the same length are read in
+    a single query_usage call, up to the rollup watermark, so a cached result
+    stays exact until the next rollup flush.
+    """
+
+    def __init__(self, tariff_engine, usage=query_usage, max_entries=ANALYTICS_CACHE_ENTRIES):
+        self.tariff_engine = tariff_engine
+        self.usage = usage  # query_usage or an engine's drop-in replacement
+        self.max_entries = max_entries
+        self.cache = OrderedDict()  # (user_id, range) -> (validity key, payload)
+        self.lock = threading.Lock()
+
+    def get_analytics(self, conn, user_id, range_name):
+        span, series_bucket = ANALYTICS_RANGES[range_name]
+        watermark = get_watermark(conn)
+        tariff = self.tariff_engine.get_user_tariff(conn, user_id, watermark)
+        goal = conn.execute('SELECT energy_goal FROM user_preferences WHERE user_id = ?', (user_id,)).fetchone()
+        energy_goal = float(goal[0] or 0) if goal else 0.0
+
+        cache_key = (user_id, range_name)
+        validity = (watermark, tariff.id, energy_goal)
+        with self.lock:
+            cached = self.cache.get(cache_key)
+            if cached is not None and cached[0] == validity:
+                self.cache.move_to_end(cache_key)
+                return cached[1]
+
+        payload = self._compute(conn, user_id, range_name, span, series_bucket,
+                                watermark or datetime.now(), tariff, energy_goal)
+        if watermark is not None:
+            with self.lock:
+                self.cache[cache_key] = (validity, payload)
+                self.cache.move_to_end(cache_key)
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+        return payload
+
+    def _compute(self, conn, user_id, range_name, span, series_bucket, end, tariff, energy_goal):
+        start = floor_time(end - span, 3600)
+        prev_start = start - span
+        span_hours = int(span.total_seconds() // 3600)
+
+        usage = self.usage(conn, user_id, prev_start, end, 'hour', by_appliance=True)
+        labels = np.array([entry['bucket'] for entry in usage], dtype=object)
+        appliance_ids = np.array([entry['appliance_id'] for entry in usage], dtype=np.int64)
+        kwh = np.array([entry['energy_kwh'] for entry in usage], dtype=np.float64)
+        on_hours = np.array([entry['on_count'] for entry in usage], dtype=np.float64) * TICK_INTERVAL / 3600.0
+
+        # Household totals per hour, in chronological order
+        hour_labels, hour_index = np.unique(labels, return_inverse=True) if len(labels) else (
+            np.array([], dtype=object), np.array([], dtype=np.int64))
+        household_kwh = np.bincount(hour_index, weights=kwh, minlength=len(hour_labels))
+        times = np.array([label.replace(' ', 'T') for label in hour_labels], dtype='datetime64[h]')
+        offsets = (times - np.datetime64(prev_start, 'h')).astype(np.int64)
+        hour_of_day = np.array([int(label[11:13]) for label in hour_labels], dtype=np.int64)
+
+        # Slab position restarts each billing month; within the range it is
+        # counted from the first hour read, not from the start of the month
+        hour_cost = np.zeros(len(hour_labels))
+        months = np.array([label[:7] for label in hour_labels], dtype=object)
+        for month in np.unique(months):
+            in_month = months == month
+            hour_cost[in_month] = tariff.energy_costs(household_kwh[in_month], hour_of_day[in_month])
+
+        current_hours = offsets >= span_hours
+        previous_hours = ~current_hours
+
+        def totals(mask):
+            # Efficiency is the load factor: average over peak hourly demand
+            energy = float(household_kwh[mask].sum())
+            cost = float(hour_cost[mask].sum())
+            used = household_kwh[mask]
+            load_factor = float(used.mean() / used.max() * 100) if len(used) and used.max() > 0 else 0.0
+            return energy, cost, load_factor
+
+        energy, cost, efficiency = totals(current_hours)
+        prev_energy, prev_cost, prev_efficiency = totals(previous_hours)
+
+        # Consumption and cost series for the current range
+        if series_bucket == 'hour':
+            series_labels = np.array([label.replace(' ', 'T') for label in hour_labels[current_hours]], dtype=object)
+        else:
+            series_labels = np.array([label[:10] for label in hour_labels[current_hours]], dtype=object)
+        if len(series_labels):
+            dates, series_index = np.unique(series_labels, return_inverse=True)
+        else:
+            dates, series_index = np.array([], dtype=object), np.array([], dtype=np.int64)
+        series_kwh = np.bincount(series_index, weights=household_kwh[current_hours], minlength=len(dates))
+        series_cost = np.bincount(series_index, weights=hour_cost[current_hours], minlength=len(dates))
+
+        # Per-appliance breakdown; each hour's cost is shared by energy used
+        row_current = current_hours[hour_index] if len(hour_index) else np.zeros(0, dtype=bool)
+        row_cost = np.divide(kwh * hour_cost[hour_index], household_kwh[hour_index],
+                             out=np.zeros(len(kwh)), where=household_kwh[hour_index] > 0) if len(kwh) else kwh
+        names = {row['id']: (row['name'], row['type']) for row in conn.execute(
+            'SELECT id, name, type FROM appliances WHERE user_id = ?', (user_id,))}
+        appliances = []
+        for appliance_id in np.unique(appliance_ids):
+            rows = appliance_ids == appliance_id
+            current = rows & row_current
+            previous = rows & ~row_current
+            appliance_kwh = float(kwh[current].sum())
+            change = percent_change(appliance_kwh, float(kwh[previous].sum()))
+            name, appliance_type = names.get(int(appliance_id), (f'Appliance {appliance_id}', 'unknown'))
+            hours = float(on_hours[current].sum())
+            appliances.append({
+                'appliance_id': int(appliance_id),
+                'name': name,
+                'type': appliance_type,
+                'consumption': round(appliance_kwh, 3),
+                'cost': round(float(row_cost[current].sum()), 2),
+                'hours': round(hours, 1),
+                'share': round(appliance_kwh / energy * 100, 1) if energy else 0,
+                'trend': ('stable' if change is None or abs(change) < TREND_THRESHOLD
+                          else 'up' if change > 0 else 'down')
+            })
+        appliances.sort(key=lambda item: -item['consumption'])
+
+        # Average kWh per hour of day over the current range
+        profile_sum = np.bincount(hour_of_day[current_hours], weights=household_kwh[current_hours], minlength=24)
+        profile_count = np.bincount(hour_of_day[current_hours], minlength=24)
+        profile = np.divide(profile_sum, profile_count, out=np.zeros(24), where=profile_count > 0)
+
+        # Current vs previous range in equal parts, with the monthly goal pro-rated
+        part = np.minimum((offsets % span_hours) * COMPARISON_PARTS // span_hours, COMPARISON_PARTS - 1)
+        current_parts = np.bincount(part[current_hours], weights=household_kwh[current_hours], minlength=COMPARISON_PARTS)
+        previous_parts = np.bincount(part[previous_hours], weights=household_kwh[previous_hours], minlength=COMPARISON_PARTS)
+        target = energy_goal * span.total_seconds() / (30 * 86400) / COMPARISON_PARTS
+
+        return {
+            'range': range_name,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'currency': tariff.currency,
+            'currency_symbol': CURRENCY_SYMBOLS.get(tariff.currency, tariff.currency),
+            'overview': {
+                'total_energy': round(energy, 2),
+                'total_cost': round(cost, 2),
+                'efficiency_score': round(efficiency),
+                'carbon_footprint': round(energy * CARBON_KG_PER_KWH, 1),
+                'changes': {
+                    'energy': percent_change(energy, prev_energy),
+                    'cost': percent_change(cost, prev_cost),
+                    'efficiency': round(efficiency - prev_efficiency, 1) if prev_energy else None,
+                    'carbon': percent_change(energy, prev_energy)
+                }
+            },
+            'consumption': [
+                {'date': label, 'consumption': round(float(value), 3)}
+                for label, value in zip(dates, series_kwh)
+            ],
+            'cost': [
+                {'date': label, 'cost': round(float(value), 2)}
+                for label, value in zip(dates, series_cost)
+            ],
+            'appliances': appliances,
+            'hourly_profile': [round(float(value), 3) for value in profile],
+            'comparison': {
+                'current': [round(float(value), 2) for value in current_parts],
+                'previous': [round(float(value), 2) for value in previous_parts],
+                'target': [round(target, 2)] * COMPARISON_PARTS
+            }
+        }
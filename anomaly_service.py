@@ -0,0 +1,172 @@
+import threading
+
+import numpy as np
+
+from config import ANOMALY_Z_THRESHOLD
+
+# Streaming detection of appliances drawing far more than usual. Each
+# appliance has an exponentially weighted mean and variance of its on-state
+# power for every hour of the day, held in fixed-width NumPy arrays indexed
+# by a per-appliance row; a tick's readings are scored and folded in with a
+# handful of vectorized operations and no database reads. A reading is
+# flagged when it sits more than ANOMALY_Z_THRESHOLD deviations above its
+# slot's mean. Until an hour's slot has seen enough readings the
+# appliance's all-hours profile (the last column) stands in for it. Standby
+# readings are not scored, so a detector only learns what an appliance draws
+# while it runs.
+
+HOURS = 24
+ALL_HOURS = HOURS           # column holding the appliance's profile across all hours
+EWMA_ALPHA = 0.002          # weight of each reading; ~500 readings (a day or two of one hour) of memory
+MIN_SAMPLES = 60            # readings a slot needs before it can flag anything
+MIN_STD_FRACTION = 0.05     # deviation floor as a share of the mean, so steady loads don't flag noise
+MIN_STD_WATTS = 5.0
+COOLDOWN_SECONDS = 3600     # an appliance is flagged at most once per this much reading time
+INITIAL_ROWS = 256
+
+class AnomalyDetector:
+    """Per-appliance, per-hour-of-day EWMA power profiles that flag outliers as they arrive"""
+
+    def __init__(self, threshold=ANOMALY_Z_THRESHOLD, alpha=EWMA_ALPHA):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.rows = {}  # appliance_id -> row in the arrays
+        self._allocate(INITIAL_ROWS)
+        self.flagged = 0
+
+    def _allocate(self, capacity):
+        self.count = np.zeros((capacity, HOURS + 1), dtype=np.int32)
+        self.mean = np.zeros((capacity, HOURS + 1), dtype=np.float64)
+        self.var = np.zeros((capacity, HOURS + 1), dtype=np.float64)
+        self.last_flagged = np.full(capacity, -np.inf, dtype=np.float64)  # epoch seconds
+
+    def _grow(self, needed):
+        capacity = len(self.count)
+        if needed <= capacity:
+            return
+        old = (self.count, self.mean, self.var, self.last_flagged)
+        self._allocate(max(needed, 2 * capacity))
+        for new, previous in zip((self.count, self.mean, self.var, self.last_flagged), old):
+            new[:capacity] = previous
+
+    def _row(self, appliance_id):
+        row = self.rows.get(appliance_id)
+        if row is None:
+            row = self.rows[appliance_id] = len(self.rows)
+            self._grow(row + 1)
+        return row
+
+    def observe(self, data_list):
+        """Score and learn a batch of readings; returns the anomalous ones, each with its baseline"""
+        readings = [data for data in data_list if data['is_on']]
+        if not readings:
+            return []
+        with self.lock:
+            rows = np.fromiter((self._row(data['appliance_id']) for data in readings), np.int64, len(readings))
+            if len(np.unique(rows)) == len(rows):
+                return self._observe(readings, rows)
+            # An appliance appears more than once (e.g. a replayed backlog):
+            # fold its readings in order, one per pass
+            passes = {}
+            for index, row in enumerate(rows):
+                passes.setdefault(row, []).append(index)
+            anomalies = []
+            for depth in range(max(len(indexes) for indexes in passes.values())):
+                picked = [indexes[depth] for indexes in passes.values() if len(indexes) > depth]
+                anomalies += self._observe([readings[index] for index in picked], rows[picked])
+            return anomalies
+
+    def _observe(self, readings, rows):
+        """One vectorized step over readings whose rows are distinct"""
+        hours = np.fromiter((data['timestamp'].hour for data in readings), np.int64, len(readings))
+        power = np.fromiter((data['power_consumption'] for data in readings), np.float64, len(readings))
+        seconds = np.fromiter((data['timestamp'].timestamp() for data in readings), np.float64, len(readings))
+
+        # Score against the profile as it stood before this reading
+        columns = np.where(self.count[rows, hours] >= MIN_SAMPLES, hours, ALL_HOURS)
+        count = self.count[rows, columns]
+        mean = self.mean[rows, columns]
+        std = np.maximum(np.sqrt(self.var[rows, columns]),
+                         np.maximum(mean * MIN_STD_FRACTION, MIN_STD_WATTS))
+        z = (power - mean) / std
+        flagged = np.flatnonzero((count >= MIN_SAMPLES) & (z > self.threshold)
+                                 & (seconds - self.last_flagged[rows] >= COOLDOWN_SECONDS))
+
+        for column in (hours, ALL_HOURS):
+            self._update(rows, column, power)
+
+        if not len(flagged):
+            return []
+        self.last_flagged[rows[flagged]] = seconds[flagged]
+        self.flagged += len(flagged)
+        return [dict(readings[index],
+                     expected_power=round(float(mean[index]), 2),
+                     std_dev=round(float(std[index]), 2),
+                     z_score=round(float(z[index]), 2))
+                for index in flagged]
+
+    def _update(self, rows, columns, power):
+        """Fold readings into their slots: a plain running mean and variance
+        (Welford) while warming up, an exponentially weighted one afterwards"""
+        count = self.count[rows, columns]
+        mean = self.mean[rows, columns]
+        weight = np.maximum(self.alpha, 1.0 / (count + 1))
+        diff = power - mean
+        increment = weight * diff
+        self.mean[rows, columns] = mean + increment
+        self.var[rows, columns] = (1 - weight) * (self.var[rows, columns] + diff * increment)
+        self.count[rows, columns] = np.minimum(count + 1, np.iinfo(np.int32).max)
+
+    def record(self, conn, anomalies):
+        """Insert flagged readings into the anomalies table"""
+        conn.executemany('''
+            INSERT INTO anomalies
+            (user_id, appliance_id, timestamp, power_consumption, expected_power, std_dev, z_score)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (data['user_id'], data['appliance_id'], data['timestamp'], data['power_consumption'],
+             data['expected_power'], data['std_dev'], data['z_score'])
+            for data in anomalies
+        ])
+
+    def forget(self, appliance_id):
+        """Reset a removed appliance's profile; its row is reused if the id returns"""
+        with self.lock:
+            row = self.rows.get(appliance_id)
+            if row is not None:
+                self.count[row] = 0
+                self.mean[row] = 0
+                self.var[row] = 0
+                self.last_flagged[row] = -np.inf
+
+    def state(self):
+        """Profiles for the simulator checkpoint"""
+        with self.lock:
+            used = len(self.rows)
+            return {
+                'rows': dict(self.rows),
+                'count': self.count[:used].copy(),
+                'mean': self.mean[:used].copy(),
+                'var': self.var[:used].copy(),
+                'last_flagged': self.last_flagged[:used].copy()
+            }
+
+    def restore(self, state):
+        with self.lock:
+            self.rows = dict(state['rows'])
+            self._allocate(max(INITIAL_ROWS, len(self.rows)))
+            used = len(self.rows)
+            self.count[:used] = state['count']
+            self.mean[:used] = state['mean']
+            self.var[:used] = state['var']
+            self.last_flagged[:used] = state['last_flagged']
+
+    def status(self):
+        with self.lock:
+            return {
+                'appliances': len(self.rows),
+                'threshold': self.threshold,
+                'flagged': self.flagged,
+                'profile_bytes': self.count.nbytes + self.mean.nbytes + self.var.nbytes + self.last_flagged.nbytes
+            }
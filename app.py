@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash
+from flask import Flask, render_template, request, redirect, url_for, jsonify, session, flash, Response
 import sqlite3
 import hashlib
 import secrets
@@ -6,9 +6,27 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import atexit
+import threading
+import time
 from datetime import datetime, timedelta
 from functools import wraps
 from simulation_service import simulator
+from rollup_service import get_watermark
+from latest_readings import LatestReadingsTable, table_path
+from tariff_service import TariffEngine, CURRENCY_SYMBOLS
+import scheduling_service
+import export_service
+import report_service
+import forecast_service
+from analytics_service import AnalyticsEngine, ANALYTICS_RANGES
+from duckdb_engine import UsageEngine
+import data_generations
+import change_log
+import migrations
+import response_encoding
+import ipc
+from read_replica import ConnectionRouter
+from config import LIVE_MAX_WAITERS, LIVE_POLL_SECONDS, TICK_INTERVAL
 import os
 import re
 
@@ -31,12 +49,92 @@ EMAIL_CONFIG = {
     'from_name': 'HaVoC-EcoWATT'
 }
 
+# Analytics, export and report reads go to the snapshot replica when fresh
+db_router = ConnectionRouter(DATABASE)
+
 def get_db_connection():
     """Get database connection with row factory and datetime parsing"""
     conn = sqlite3.connect(DATABASE, detect_types=sqlite3.PARSE_DECLTYPES)
     conn.row_factory = sqlite3.Row
     return conn
 
+def get_analytics_connection():
+    """Read-only connection for heavy queries: the replica if fresh enough, else the primary"""
+    conn = db_router.connect(analytics=True, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+# Latest readings published by the simulator; opened lazily per worker
+latest_readings = LatestReadingsTable(table_path(DATABASE))
+
+# Live long polls waiting in this worker process, and how often they check
+# the latest-readings publish counter (seconds)
+live_waiters = threading.BoundedSemaphore(LIVE_MAX_WAITERS)
+LIVE_POLL_STEP = 0.2
+LIVE_SECTIONS = ('totals', 'cost', 'appliances')
+
+def current_time():
+    """The simulator's clock as last published, or wall time when it isn't running"""
+    return latest_readings.simulated_now() or datetime.now()
+
+# Tariff engine with per-user bill cache
+tariff_engine = TariffEngine()
+
+# Heavy usage aggregations on SQLite or DuckDB (config ANALYTICS_ENGINE)
+usage_engine = UsageEngine(DATABASE)
+analytics_engine = AnalyticsEngine(tariff_engine, usage_engine.query_usage)
+
+def get_appliances_with_latest_data(cursor, user_id, since=None):
+    """Active appliances for a user with their latest reading.
+    
+    With `since`, only appliances whose configuration or stored readings
+    changed after that change generation are returned, including deactivated
+    ones so the caller can drop them.
+    
+    Readings come from the shared latest-readings table when the simulator
+    publishes one; otherwise fall back to the latest-row join.
+    """
+    if since is None:
+        scope, params = 'a.user_id = ? AND a.is_active = 1', (user_id,)
+    else:
+        scope = '''a.user_id = ? AND a.id IN (
+            SELECT appliance_id FROM appliance_changes
+            WHERE user_id = ? AND (config_generation > ? OR reading_generation > ?)
+        )'''
+        params = (user_id, user_id, since, since)
+    
+    if latest_readings.available():
+        cursor.execute(f'''
+            SELECT a.* FROM appliances a
+            WHERE {scope}
+            ORDER BY a.name
+        ''', params)
+        
+        appliances = []
+        for row in cursor.fetchall():
+            appliance = dict(row)
+            latest = latest_readings.get(row['id']) or {}
+            appliance['is_on'] = latest.get('is_on')
+            appliance['temperature'] = latest.get('temperature')
+            appliance['power_consumption'] = latest.get('power_consumption')
+            appliance['timestamp'] = latest.get('timestamp')
+            appliances.append(appliance)
+        return appliances
+    
+    cursor.execute(f'''
+        SELECT a.*, 
+               ad.is_on, ad.temperature, ad.power_consumption, ad.timestamp
+        FROM appliances a
+        LEFT JOIN appliance_data ad ON a.id = ad.appliance_id
+        WHERE {scope}
+        AND (ad.id IS NULL OR ad.id = (
+            SELECT MAX(id) FROM appliance_data 
+            WHERE appliance_id = a.id
+        ))
+        ORDER BY a.name
+    ''', params)
+    return [dict(row) for row in cursor.fetchall()]
+
 def hash_password(password):
     """Hash password with salt"""
     salt = secrets.token_hex(16)
@@ -101,104 +199,6 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def init_database():
-    """Initialize the database with all required tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username VARCHAR(50) UNIQUE NOT NULL,
-            email VARCHAR(100) UNIQUE NOT NULL,
-            password VARCHAR(255) NOT NULL,
-            first_name VARCHAR(50),
-            last_name VARCHAR(50),
-            phone VARCHAR(20),
-            address TEXT,
-            city VARCHAR(50),
-            state VARCHAR(50),
-            zip_code VARCHAR(10),
-            is_active BOOLEAN DEFAULT 1,
-            email_verified BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP,
-            failed_login_attempts INTEGER DEFAULT 0,
-            locked_until TIMESTAMP
-        )
-    ''')
-    
-    # Create password reset tokens table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS password_reset_tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            token VARCHAR(255) UNIQUE NOT NULL,
-            expires_at TIMESTAMP NOT NULL,
-            used BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Create user sessions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            session_token VARCHAR(255) UNIQUE NOT NULL,
-            ip_address VARCHAR(45),
-            user_agent TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expires_at TIMESTAMP NOT NULL,
-            is_active BOOLEAN DEFAULT 1,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Create email verification tokens table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS email_verification_tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            token VARCHAR(255) UNIQUE NOT NULL,
-            expires_at TIMESTAMP NOT NULL,
-            used BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Create user preferences table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_preferences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            theme VARCHAR(20) DEFAULT 'light',
-            notifications_enabled BOOLEAN DEFAULT 1,
-            email_notifications BOOLEAN DEFAULT 1,
-            energy_goal DECIMAL(10,2) DEFAULT 0,
-            cost_goal DECIMAL(10,2) DEFAULT 0,
-            carbon_goal DECIMAL(10,2) DEFAULT 0,
-            currency VARCHAR(10) DEFAULT 'INR',
-            timezone VARCHAR(50) DEFAULT 'Asia/Kolkata',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    print("Database tables initialized successfully")
-
-# Initialize database and start simulation
-def startup():
-    init_database()
-    simulator.start()
-    print("Application started with IoT simulation")
-
 # Stop simulation when app shuts down
 def cleanup():
     simulator.stop()
@@ -618,7 +618,7 @@ def verify_email(token):
         # Mark email as verified
         cursor.execute('''
             UPDATE users 
-            SET email_verified = 1 
+            SET is_verified = 1 
             WHERE id = ?
         ''', (token_data['user_id'],))
         
@@ -727,6 +727,9 @@ def update_user_profile():
     """Update user profile information"""
     data = request.json
     
+    if data.get('currency') is not None and data['currency'] not in CURRENCY_SYMBOLS:
+        return jsonify({'success': False, 'error': 'Unsupported currency'}), 400
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -756,6 +759,7 @@ def update_user_profile():
             session['user_id']
         ))
         
+        data_generations.bump(conn, [session['user_id']])
         conn.commit()
         conn.close()
         
@@ -766,6 +770,94 @@ def update_user_profile():
         conn.close()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+DASHBOARD_SECTIONS = ('appliances', 'totals', 'hourly', 'daily', 'cost')
+
+def user_data_etag(conn, user_id, live=False):
+    """ETag for a user's response: their data generation, the rollup watermark and the request.
+    
+    Responses showing live readings (`live`) also change with every publish
+    to the latest-readings table, since deadband-dropped readings still
+    change what they display without bumping the stored generation.
+    """
+    parts = [data_generations.get_generation(conn, user_id), get_watermark(conn), request.full_path]
+    if live:
+        parts.append(latest_readings.publish_count())
+    return response_encoding.make_etag(*parts)
+
+def format_appliance(row):
+    """API representation of an appliance with its latest reading"""
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'type': row['type'],
+        'power_rating': row['power_rating'],
+        'is_on': row['is_on'] if row['is_on'] is not None else False,
+        'temperature': row['temperature'],
+        'power_consumption': row['power_consumption'] if row['power_consumption'] is not None else 0,
+        'last_updated': row['timestamp']
+    }
+
+def build_dashboard(conn, user_id, sections, now=None):
+    """Requested dashboard sections for a user.
+    
+    Sections that share a query (appliances and totals both need the latest
+    readings) are planned together so it runs once, and everything uses the
+    caller's connection.
+    """
+    now = now or current_time()
+    data = {}
+    
+    if 'appliances' in sections or 'totals' in sections:
+        appliances = [format_appliance(row) for row in get_appliances_with_latest_data(conn.cursor(), user_id)]
+        if 'appliances' in sections:
+            data['appliances'] = appliances
+        if 'totals' in sections:
+            data['total_power'] = round(sum(app['power_consumption'] for app in appliances), 2)
+            data['active_count'] = sum(1 for app in appliances if app['is_on'])
+            data['total_count'] = len(appliances)
+    
+    if 'hourly' in sections:
+        # Hourly usage for the last 24 hours and last-hour metrics, from the
+        # in-process buffer when the simulator feeds it; web-only workers and
+        # users the buffer has nothing for are read from rollups and raw spans
+        hourly = last_hour = None
+        if simulator.usage_buffer.is_fed():
+            hourly = simulator.usage_buffer.hourly_usage(conn, user_id, now)
+            last_hour = simulator.usage_buffer.last_hour(conn, user_id, now)
+        if not hourly:
+            hourly = [
+                {'hour': entry['bucket'], 'avg_power': entry['avg_power']}
+                for entry in usage_engine.query_usage(conn, user_id, now - timedelta(days=1), now,
+                                                      'hour_of_day', now=now)
+            ]
+        if not last_hour or not last_hour['data_points']:
+            usage = usage_engine.query_usage(conn, user_id, now - timedelta(hours=1), now, now=now)
+            count = usage[0]['sample_count'] if usage else 0
+            last_hour = {
+                'avg_power': round(usage[0]['avg_power'], 2) if count else 0,
+                'energy_kwh': round(usage[0]['energy_kwh'], 4) if usage else 0,
+                'data_points': round(count)
+            }
+        data['hourly_usage'] = hourly
+        data['last_hour'] = last_hour
+    
+    if 'daily' in sections:
+        data['daily_usage'] = [
+            {'date': entry['bucket'], 'daily_kwh': entry['energy_kwh']}
+            for entry in usage_engine.query_usage(conn, user_id, now - timedelta(days=7), now, 'day', now=now)
+        ]
+    
+    if 'cost' in sections:
+        # Monthly cost estimate from the user's tariff
+        bill = tariff_engine.get_bill(conn, user_id, now)
+        data['estimated_monthly_cost'] = bill['projected']['total']
+        data['currency'] = bill['currency']
+        data['currency_symbol'] = bill['currency_symbol']
+        data['bill'] = bill
+    
+    data['timestamp'] = now.isoformat()
+    return data
+
 @app.route('/api/appliances/<int:user_id>')
 @login_required
 def get_user_appliances(user_id):
@@ -774,37 +866,27 @@ def get_user_appliances(user_id):
     if user_id != session['user_id']:
         return jsonify({'error': 'Unauthorized'}), 403
     
+    since = request.args.get('since', type=int)
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT a.*, 
-               ad.is_on, ad.temperature, ad.power_consumption, ad.timestamp
-        FROM appliances a
-        LEFT JOIN appliance_data ad ON a.id = ad.appliance_id
-        WHERE a.user_id = ? AND a.is_active = 1
-        AND (ad.id IS NULL OR ad.id = (
-            SELECT MAX(id) FROM appliance_data 
-            WHERE appliance_id = a.id
-        ))
-        ORDER BY a.name
-    ''', (user_id,))
-    
-    appliances = []
-    for row in cursor.fetchall():
-        appliances.append({
-            'id': row['id'],
-            'name': row['name'],
-            'type': row['type'],
-            'power_rating': row['power_rating'],
-            'is_on': row['is_on'] if row['is_on'] is not None else False,
-            'temperature': row['temperature'],
-            'power_consumption': row['power_consumption'] if row['power_consumption'] is not None else 0,
-            'last_updated': row['timestamp']
-        })
+    if since is None:
+        appliances = [format_appliance(row) for row in get_appliances_with_latest_data(cursor, user_id)]
+        conn.close()
+        return jsonify(appliances)
     
+    # Incremental sync: read the generation first so no change is missed;
+    # since=0 returns the full list along with the current generation
+    generation = change_log.current_generation(conn)
+    changed = get_appliances_with_latest_data(cursor, user_id, since if since > 0 else None)
     conn.close()
-    return jsonify(appliances)
+    
+    return jsonify({
+        'generation': generation,
+        'appliances': [format_appliance(row) for row in changed if row['is_active']],
+        'removed': [row['id'] for row in changed if not row['is_active']]
+    })
 
 @app.route('/api/dashboard-data/<int:user_id>')
 @login_required
@@ -815,81 +897,42 @@ def get_dashboard_data(user_id):
         return jsonify({'error': 'Unauthorized'}), 403
     
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get latest appliance data
-    cursor.execute('''
-        SELECT a.id, a.name, a.type,
-               ad.is_on, ad.temperature, ad.power_consumption
-        FROM appliances a
-        LEFT JOIN appliance_data ad ON a.id = ad.appliance_id
-        WHERE a.user_id = ? AND a.is_active = 1
-        AND (ad.id IS NULL OR ad.id = (
-            SELECT MAX(id) FROM appliance_data 
-            WHERE appliance_id = a.id
-        ))
-    ''', (user_id,))
-    
-    appliances = [dict(row) for row in cursor.fetchall()]
-    
-    # Calculate total power consumption
-    total_power = sum(app.get('power_consumption', 0) for app in appliances)
-    
-    # Count active appliances
-    active_count = sum(1 for app in appliances if app.get('is_on'))
-    
-    # Get hourly usage for the last 24 hours
-    cursor.execute('''
-        SELECT strftime('%H', timestamp) as hour,
-               AVG(power_consumption) as avg_power
-        FROM appliance_data
-        WHERE user_id = ? 
-        AND timestamp >= datetime('now', '-24 hours')
-        GROUP BY strftime('%H', timestamp)
-        ORDER BY hour
-    ''', (user_id,))
-    
-    hourly_usage = [dict(row) for row in cursor.fetchall()]
-    
-    # Get daily usage for the last 7 days
-    cursor.execute('''
-        SELECT DATE(timestamp) as date,
-               SUM(power_consumption) / 1000.0 as daily_kwh
-        FROM appliance_data
-        WHERE user_id = ? 
-        AND timestamp >= datetime('now', '-7 days')
-        GROUP BY DATE(timestamp)
-        ORDER BY date
-    ''', (user_id,))
+    etag = user_data_etag(conn, user_id, live=True)
+    cached = response_encoding.not_modified(etag)
+    if cached:
+        conn.close()
+        return cached
     
-    daily_usage = [dict(row) for row in cursor.fetchall()]
+    data = build_dashboard(conn, user_id, DASHBOARD_SECTIONS)
+    conn.close()
     
-    # Get monthly cost estimate (simplified calculation)
-    cursor.execute('''
-        SELECT AVG(power_consumption) as avg_power
-        FROM appliance_data
-        WHERE user_id = ? 
-        AND timestamp >= datetime('now', '-30 days')
-    ''', (user_id,))
+    return response_encoding.json_response(data, etag)
+
+@app.route('/api/dashboard/<int:user_id>')
+@login_required
+def get_dashboard_sections(user_id):
+    """Get only the dashboard sections listed in ?sections= in one response"""
+    # Ensure user can only access their own data
+    if user_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
     
-    avg_power_result = cursor.fetchone()
-    avg_power = avg_power_result['avg_power'] if avg_power_result['avg_power'] else 0
+    requested = request.args.get('sections')
+    sections = set(requested.split(',')) if requested else set(DASHBOARD_SECTIONS)
+    unknown = sections - set(DASHBOARD_SECTIONS)
+    if unknown:
+        return jsonify({'error': f'Unknown sections: {", ".join(sorted(unknown))}'}), 400
     
-    # Calculate estimated monthly cost (avg_power * 24 hours * 30 days * rate per kWh)
-    estimated_monthly_cost = (avg_power * 24 * 30 / 1000) * 5.8  # 5.8 INR per kWh
+    conn = get_db_connection()
+    etag = user_data_etag(conn, user_id, live=bool(sections & {'appliances', 'totals'}))
+    cached = response_encoding.not_modified(etag)
+    if cached:
+        conn.close()
+        return cached
     
+    data = build_dashboard(conn, user_id, sections)
     conn.close()
     
-    return jsonify({
-        'appliances': appliances,
-        'total_power': round(total_power, 2),
-        'active_count': active_count,
-        'total_count': len(appliances),
-        'hourly_usage': hourly_usage,
-        'daily_usage': daily_usage,
-        'estimated_monthly_cost': round(estimated_monthly_cost, 2),
-        'timestamp': datetime.now().isoformat()
-    })
+    return response_encoding.json_response(data, etag)
 
 @app.route('/api/add-appliance', methods=['POST'])
 @login_required
@@ -920,6 +963,7 @@ def add_appliance():
         ''', (user_id, name, appliance_type, power_rating))
         
         appliance_id = cursor.lastrowid
+        data_generations.bump(conn, [user_id])
         conn.commit()
         conn.close()
         
@@ -958,6 +1002,7 @@ def delete_appliance(appliance_id):
             WHERE id = ?
         ''', (appliance_id,))
         
+        data_generations.bump(conn, [session['user_id']])
         conn.commit()
         conn.close()
         
@@ -996,6 +1041,7 @@ def update_appliance(appliance_id):
             WHERE id = ?
         ''', (data.get('name'), data.get('power_rating'), appliance_id))
         
+        data_generations.bump(conn, [session['user_id']])
         conn.commit()
         conn.close()
         
@@ -1008,6 +1054,134 @@ def update_appliance(appliance_id):
         conn.close()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/appliance/<int:appliance_id>/toggle', methods=['POST'])
+@login_required
+def toggle_appliance(appliance_id):
+    """Switch an appliance on or off through the simulator daemon"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    # Verify appliance belongs to current user
+    cursor.execute('''
+        SELECT id FROM appliances 
+        WHERE id = ? AND user_id = ? AND is_active = 1
+    ''', (appliance_id, session['user_id']))
+    
+    if not cursor.fetchone():
+        conn.close()
+        return jsonify({'error': 'Appliance not found or unauthorized'}), 404
+    
+    latest = latest_readings.get(appliance_id)
+    if latest is None:
+        cursor.execute('''
+            SELECT is_on FROM appliance_data 
+            WHERE appliance_id = ? 
+            ORDER BY timestamp DESC LIMIT 1
+        ''', (appliance_id,))
+        row = cursor.fetchone()
+        is_on = bool(row['is_on']) if row else False
+    else:
+        is_on = latest['is_on']
+    conn.close()
+    
+    # An explicit is_on (or null to hand control back) overrides the flip
+    data = request.get_json(silent=True) or {}
+    target = data['is_on'] if 'is_on' in data else not is_on
+    if target is not None and not isinstance(target, bool):
+        return jsonify({'error': 'is_on must be true, false or null'}), 400
+    
+    try:
+        state = ipc.send_command('set_override', appliance_id=appliance_id, is_on=target)
+    except ipc.SimulatorUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    except ipc.CommandError as e:
+        return jsonify({'error': f'Simulator rejected the change: {e}'}), 400
+    
+    return jsonify({
+        'success': True,
+        'appliance_id': appliance_id,
+        'is_on': state
+    })
+
+@app.route('/api/live/<int:user_id>')
+@login_required
+def live_updates(user_id):
+    """Long poll for the next simulation tick: the live dashboard sections once
+    the simulator publishes past ?tick=, or none after LIVE_POLL_SECONDS,
+    along with any anomalies recorded after the ?anomaly= id.
+    
+    Waiting only watches the shared latest-readings publish counter, so it
+    reads nothing from the database and never involves the simulator. When
+    every waiting slot is taken the poll answers at once with retry_after.
+    """
+    # Ensure user can only access their own data
+    if user_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    tick = request.args.get('tick', type=int)
+    since_anomaly = request.args.get('anomaly', type=int)
+    retry_after = None
+    if tick is not None:
+        if live_waiters.acquire(blocking=False):
+            try:
+                deadline = time.monotonic() + LIVE_POLL_SECONDS
+                while (latest_readings.publish_count() or 0) <= tick and time.monotonic() < deadline:
+                    time.sleep(LIVE_POLL_STEP)
+            finally:
+                live_waiters.release()
+        else:
+            retry_after = TICK_INTERVAL
+    
+    current = latest_readings.publish_count() or 0
+    data = {'tick': current, 'dashboard': None, 'anomaly': since_anomaly, 'anomalies': [],
+            'retry_after': retry_after}
+    if tick is None or current > tick:
+        conn = get_db_connection()
+        data['dashboard'] = build_dashboard(conn, user_id, LIVE_SECTIONS)
+        if since_anomaly is None:
+            # First poll: start from the newest anomaly rather than replaying history
+            data['anomaly'] = conn.execute('SELECT COALESCE(MAX(id), 0) FROM anomalies WHERE user_id = ?',
+                                           (user_id,)).fetchone()[0]
+        else:
+            rows = conn.execute('''
+                SELECT an.id, an.appliance_id, a.name AS appliance_name, an.timestamp,
+                       an.power_consumption, an.expected_power, an.std_dev, an.z_score
+                FROM anomalies an
+                JOIN appliances a ON a.id = an.appliance_id
+                WHERE an.user_id = ? AND an.id > ?
+                ORDER BY an.id
+                LIMIT 100
+            ''', (user_id, since_anomaly)).fetchall()
+            data['anomalies'] = [dict(row, timestamp=row['timestamp'].isoformat()) for row in rows]
+            if rows:
+                data['anomaly'] = rows[-1]['id']
+        conn.close()
+    return response_encoding.json_response(data)
+
+@app.route('/api/anomalies/<int:user_id>')
+@login_required
+def get_anomalies(user_id):
+    """Readings the simulator flagged as unusually high for the appliance and hour"""
+    # Ensure user can only access their own data
+    if user_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+
+    days = request.args.get('days', 7, type=int)
+
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT an.appliance_id, a.name AS appliance_name, an.timestamp, an.power_consumption,
+               an.expected_power, an.std_dev, an.z_score
+        FROM anomalies an
+        JOIN appliances a ON a.id = an.appliance_id
+        WHERE an.user_id = ? AND an.timestamp >= ?
+        ORDER BY an.timestamp DESC
+        LIMIT 500
+    ''', (user_id, current_time() - timedelta(days=days))).fetchall()
+    conn.close()
+
+    return jsonify([dict(row, timestamp=row['timestamp'].isoformat()) for row in rows])
+
 @app.route('/api/energy-usage/<int:user_id>')
 @login_required
 def get_energy_usage(user_id):
@@ -1018,77 +1192,317 @@ def get_energy_usage(user_id):
     
     period = request.args.get('period', 'week')  # day, week, month
     
-    conn = get_db_connection()
+    conn = get_analytics_connection()
     cursor = conn.cursor()
     
-    if period == 'day':
-        # Hourly data for today
-        cursor.execute('''
-            SELECT strftime('%H:00', timestamp) as time_label,
-                   AVG(power_consumption) as avg_power,
-                   COUNT(*) as data_points
-            FROM appliance_data
-            WHERE user_id = ? 
-            AND DATE(timestamp) = DATE('now')
-            GROUP BY strftime('%H', timestamp)
-            ORDER BY time_label
-        ''', (user_id,))
-    elif period == 'week':
-        # Daily data for this week
-        cursor.execute('''
-            SELECT strftime('%Y-%m-%d', timestamp) as time_label,
-                   AVG(power_consumption) as avg_power,
-                   COUNT(*) as data_points
-            FROM appliance_data
-            WHERE user_id = ? 
-            AND timestamp >= datetime('now', '-7 days')
-            GROUP BY DATE(timestamp)
-            ORDER BY time_label
-        ''', (user_id,))
-    else:  # month
-        # Daily data for this month
-        cursor.execute('''
-            SELECT strftime('%Y-%m-%d', timestamp) as time_label,
-                   AVG(power_consumption) as avg_power,
-                   COUNT(*) as data_points
-            FROM appliance_data
-            WHERE user_id = ? 
-            AND timestamp >= datetime('now', '-30 days')
-            GROUP BY DATE(timestamp)
-            ORDER BY time_label
-        ''', (user_id,))
+    etag = user_data_etag(conn, user_id)
+    cached = response_encoding.not_modified(etag)
+    if cached:
+        conn.close()
+        return cached
     
-    usage_data = [dict(row) for row in cursor.fetchall()]
+    now = current_time()
     
-    # Get appliance-wise breakdown
+    if period == 'day':
+        # Hourly data for today
+        start, bucket = now.replace(hour=0, minute=0, second=0, microsecond=0), 'hour_of_day'
+    else:
+        # Daily data for this week or month
+        start, bucket = now - timedelta(days=7 if period == 'week' else 30), 'day'
+    
+    usage_data = [
+        {
+            'time_label': f"{entry['bucket']}:00" if bucket == 'hour_of_day' else entry['bucket'],
+            'avg_power': entry['avg_power'],
+            'data_points': round(entry['sample_count'])
+        }
+        for entry in usage_engine.query_usage(conn, user_id, start, now, bucket, now=now)
+    ]
+    
+    # Get appliance-wise breakdown (on/total counts are in simulation ticks)
     cursor.execute('''
-        SELECT a.type, a.name,
-               AVG(ad.power_consumption) as avg_power,
-               SUM(CASE WHEN ad.is_on = 1 THEN 1 ELSE 0 END) as on_count,
-               COUNT(*) as total_count
-        FROM appliances a
-        LEFT JOIN appliance_data ad ON a.id = ad.appliance_id
-        WHERE a.user_id = ? AND a.is_active = 1
-        AND ad.timestamp >= datetime('now', '-7 days')
-        GROUP BY a.id, a.type, a.name
-        ORDER BY avg_power DESC
+        SELECT id, type, name FROM appliances
+        WHERE user_id = ? AND is_active = 1
     ''', (user_id,))
     
-    appliance_breakdown = [dict(row) for row in cursor.fetchall()]
+    appliance_rows = {row['id']: row for row in cursor.fetchall()}
+    appliance_breakdown = []
+    for entry in usage_engine.query_usage(conn, user_id, now - timedelta(days=7), now, by_appliance=True, now=now):
+        row = appliance_rows.get(entry['appliance_id'])
+        if row is None:
+            continue
+        appliance_breakdown.append({
+            'type': row['type'],
+            'name': row['name'],
+            'avg_power': entry['avg_power'],
+            'on_count': round(entry['on_count']),
+            'total_count': round(entry['sample_count'])
+        })
+    appliance_breakdown.sort(key=lambda item: item['avg_power'], reverse=True)
     
     conn.close()
     
-    return jsonify({
+    return response_encoding.json_response({
         'usage_data': usage_data,
         'appliance_breakdown': appliance_breakdown,
         'period': period
-    })
+    }, etag)
+
+@app.route('/api/analytics/<int:user_id>')
+@login_required
+def get_analytics(user_id):
+    """Get overview, series, appliance breakdown and comparisons for the analytics page"""
+    # Ensure user can only access their own data
+    if user_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    range_name = request.args.get('range', '30d')
+    if range_name not in ANALYTICS_RANGES:
+        return jsonify({'error': 'Invalid range'}), 400
+    
+    conn = get_analytics_connection()
+    analytics = analytics_engine.get_analytics(conn, user_id, range_name)
+    conn.close()
+    
+    return jsonify(analytics)
+
+@app.route('/api/bill/<int:user_id>')
+@login_required
+def get_bill(user_id):
+    """Get the current billing period's cost under the user's tariff"""
+    # Ensure user can only access their own data
+    if user_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    conn = get_db_connection()
+    bill = tariff_engine.get_bill(conn, user_id, current_time())
+    conn.close()
+    
+    return jsonify(bill)
+
+@app.route('/api/forecast/<int:user_id>')
+@login_required
+def get_forecast(user_id):
+    """Expected consumption and cost for the next 24 hours from the cached forecasts"""
+    # Ensure user can only access their own data
+    if user_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    conn = get_db_connection()
+    now = current_time()
+    bill = tariff_engine.get_bill(conn, user_id, now)
+    tariff = tariff_engine.get_user_tariff(conn, user_id, now)
+    forecast = forecast_service.user_forecast(conn, user_id, tariff, bill['to_date']['energy_kwh'])
+    conn.close()
+    
+    if forecast is None:
+        return jsonify({'error': 'No forecast available yet'}), 404
+    return jsonify(forecast)
+
+@app.route('/api/user/tariff', methods=['POST'])
+@login_required
+def set_user_tariff():
+    """Assign a tariff to the current user"""
+    data = request.json
+    tariff_name = data.get('tariff')
+    
+    if not tariff_name:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    conn = get_db_connection()
+    
+    try:
+        if not tariff_engine.set_user_tariff(conn, session['user_id'], tariff_name):
+            conn.close()
+            return jsonify({'error': 'Unknown tariff for your currency'}), 404
+        
+        data_generations.bump(conn, [session['user_id']])
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'success': True, 'message': f'Tariff set to "{tariff_name}"'})
+        
+    except Exception as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+def format_schedule(result):
+    """API representation of a household schedule"""
+    result = dict(result, schedule=[
+        dict(item, start=item['start'].isoformat(), end=item['end'].isoformat())
+        for item in result['schedule']
+    ])
+    if 'solved_at' in result:
+        result['solved_at'] = result['solved_at'].isoformat()
+    return result
+
+@app.route('/api/schedule/<int:user_id>')
+@login_required
+def get_schedule(user_id):
+    """The user's stored schedule from the nightly batch or their last recompute"""
+    # Ensure user can only access their own data
+    if user_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    conn = get_db_connection()
+    result = scheduling_service.load_schedule(conn, user_id)
+    conn.close()
+    
+    if result is None:
+        return jsonify({'error': 'No schedule yet'}), 404
+    return jsonify(format_schedule(result))
+
+@app.route('/api/schedule/<int:user_id>', methods=['POST'])
+@login_required
+def recompute_schedule(user_id):
+    """Solve and store the cheapest start times for the user's deferrable appliances now"""
+    # Ensure user can only access their own data
+    if user_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    conn = get_db_connection()
+    
+    try:
+        result = scheduling_service.solve_user(conn, user_id, current_time())
+        conn.commit()
+        conn.close()
+        
+        if result is None:
+            return jsonify({'error': 'No deferrable appliances to schedule'}), 404
+        return jsonify(format_schedule(result))
+        
+    except Exception as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/schedule/preferences', methods=['POST'])
+@login_required
+def set_schedule_preferences():
+    """Set an appliance's run window/duration and/or the household peak limit"""
+    data = request.json
+    appliance_id = data.get('appliance_id')
+    peak_power_w = data.get('peak_power_w')
+    
+    if appliance_id is None and peak_power_w is None:
+        return jsonify({'error': 'Missing required fields'}), 400
+    
+    for field in ('earliest_start', 'deadline'):
+        if data.get(field) and not re.match(r'^([01]\d|2[0-3]):[0-5]\d$', data[field]):
+            return jsonify({'error': f'{field} must be HH:MM'}), 400
+    
+    conn = get_db_connection()
+    
+    try:
+        if appliance_id is not None:
+            appliance = conn.execute('''
+                SELECT type FROM appliances WHERE id = ? AND user_id = ?
+            ''', (appliance_id, session['user_id'])).fetchone()
+            
+            if not appliance:
+                conn.close()
+                return jsonify({'error': 'Appliance not found'}), 404
+            if appliance['type'] not in scheduling_service.DEFERRABLE_DEFAULTS:
+                conn.close()
+                return jsonify({'error': 'Appliance cannot be scheduled'}), 400
+            
+            conn.execute('''
+                INSERT INTO appliance_schedules (appliance_id, user_id, duration_minutes, earliest_start, deadline)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (appliance_id) DO UPDATE SET
+                    duration_minutes = COALESCE(excluded.duration_minutes, duration_minutes),
+                    earliest_start = COALESCE(excluded.earliest_start, earliest_start),
+                    deadline = COALESCE(excluded.deadline, deadline)
+            ''', (appliance_id, session['user_id'], data.get('duration_minutes'),
+                  data.get('earliest_start'), data.get('deadline')))
+        
+        if peak_power_w is not None:
+            conn.execute('''
+                INSERT INTO scheduling_settings (user_id, peak_power_w) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET peak_power_w = excluded.peak_power_w
+            ''', (session['user_id'], float(peak_power_w)))
+        
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'success': True, 'message': 'Scheduling preferences updated'})
+        
+    except Exception as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/reports/<int:user_id>')
+@login_required
+def get_report(user_id):
+    """Get the user's precomputed report for the current billing period"""
+    # Ensure user can only access their own data
+    if user_id != session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    conn = get_analytics_connection()
+    
+    try:
+        report = report_service.get_report(conn, user_id)
+        conn.close()
+        if report is None:
+            # Not covered by a nightly run yet (or not in the snapshot yet)
+            conn = get_db_connection()
+            report = report_service.get_report(conn, user_id) or report_service.generate_user(conn, user_id)
+            conn.commit()
+            conn.close()
+        
+        if report is None:
+            return jsonify({'error': 'User not found'}), 404
+        return jsonify(report)
+        
+    except Exception as e:
+        conn.close()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/reports/export')
+@login_required
+def export_report():
+    """Stream the current user's readings or rollups as CSV or Parquet"""
+    fmt = request.args.get('format', 'csv')
+    resolution = request.args.get('resolution', 'raw')
+    
+    if fmt not in export_service.available_formats():
+        return jsonify({'error': f'Unsupported format, use one of: {", ".join(export_service.available_formats())}'}), 400
+    if resolution not in export_service.RESOLUTIONS:
+        return jsonify({'error': 'Invalid resolution'}), 400
+    
+    try:
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else current_time()
+        if request.args.get('start'):
+            start = datetime.fromisoformat(request.args['start'])
+        else:
+            start = end - timedelta(days=int(request.args.get('days', 30)))
+        appliance_id = request.args.get('appliance_id', type=int)
+    except ValueError:
+        return jsonify({'error': 'Invalid date range'}), 400
+    
+    if start >= end:
+        return jsonify({'error': 'Invalid date range'}), 400
+    
+    mimetype, extension = export_service.FORMATS[fmt]
+    filename = f"ecowatt_{resolution}_{start:%Y%m%d}_{end:%Y%m%d}.{extension}"
+    stream = export_service.stream_export(lambda: db_router.connect(analytics=True),
+                                          session['user_id'], resolution, start, end,
+                                          appliance_id, fmt)
+    return Response(stream, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 @app.route('/api/simulation-stats')
 @login_required
 def get_simulation_stats():
     """Get overall simulation statistics"""
-    stats = simulator.get_user_stats()
+    try:
+        stats = ipc.send_command('stats')
+    except ipc.SimulatorUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    except ipc.CommandError as e:
+        return jsonify({'error': f'Simulator could not report stats: {e}'}), 502
+    stats['read_replica'] = db_router.status()
+    stats['analytics_engine'] = usage_engine.status()
     return jsonify(stats)
 
 @app.route('/api/change-password', methods=['POST'])
@@ -1149,169 +1563,17 @@ def change_password():
 # ============= DATABASE INITIALIZATION =============
 
 def init_db():
-    """Initialize database with all required tables"""
+    """Apply pending schema migrations and seed demo users into an empty database"""
+    migrations.migrate(DATABASE)
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        # Check if users table exists and get its structure
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        table_exists = cursor.fetchone()
-        
-        if table_exists:
-            # Check current columns
-            cursor.execute("PRAGMA table_info(users)")
-            columns = [row[1] for row in cursor.fetchall()]
-            
-            # Add missing columns if needed
-            expected_columns = [
-                ('first_name', 'VARCHAR(50)'),
-                ('last_name', 'VARCHAR(50)'),
-                ('phone', 'VARCHAR(20)'),
-                ('address', 'TEXT'),
-                ('city', 'VARCHAR(50)'),
-                ('state', 'VARCHAR(50)'),
-                ('zip_code', 'VARCHAR(10)'),
-                ('is_verified', 'BOOLEAN DEFAULT 0'),
-                ('is_active', 'BOOLEAN DEFAULT 1'),
-                ('failed_login_attempts', 'INTEGER DEFAULT 0'),
-                ('locked_until', 'DATETIME'),
-                ('last_login', 'DATETIME')
-            ]
-            
-            for col_name, col_type in expected_columns:
-                if col_name not in columns:
-                    try:
-                        cursor.execute(f'ALTER TABLE users ADD COLUMN {col_name} {col_type}')
-                        print(f"Added column {col_name} to users table")
-                    except Exception as e:
-                        print(f"Could not add column {col_name}: {e}")
-        else:
-            # Create users table from scratch
-            cursor.execute('''
-                CREATE TABLE users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username VARCHAR(50) UNIQUE NOT NULL,
-                    email VARCHAR(100) UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    first_name VARCHAR(50),
-                    last_name VARCHAR(50),
-                    phone VARCHAR(20),
-                    address TEXT,
-                    city VARCHAR(50),
-                    state VARCHAR(50),
-                    zip_code VARCHAR(10),
-                    is_verified BOOLEAN DEFAULT 0,
-                    is_active BOOLEAN DEFAULT 1,
-                    failed_login_attempts INTEGER DEFAULT 0,
-                    locked_until DATETIME,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    last_login DATETIME
-                )
-            ''')
-        
-        # User preferences
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_preferences (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                theme VARCHAR(10) DEFAULT 'light',
-                notifications_enabled BOOLEAN DEFAULT 1,
-                email_notifications BOOLEAN DEFAULT 1,
-                energy_goal REAL DEFAULT 1000.0,
-                cost_goal REAL DEFAULT 5000.0,
-                carbon_goal REAL DEFAULT 500.0,
-                currency VARCHAR(10) DEFAULT 'INR',
-                timezone VARCHAR(50) DEFAULT 'Asia/Kolkata',
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Appliances table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS appliances (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                name VARCHAR(100) NOT NULL,
-                type VARCHAR(50) NOT NULL,
-                power_rating REAL DEFAULT 0,
-                is_active BOOLEAN DEFAULT 1,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Appliance data table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS appliance_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                appliance_id INTEGER NOT NULL,
-                is_on BOOLEAN DEFAULT 0,
-                power_consumption REAL DEFAULT 0,
-                temperature REAL,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                FOREIGN KEY (appliance_id) REFERENCES appliances (id)
-            )
-        ''')
-        
-        # User sessions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                session_token TEXT UNIQUE NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                expires_at DATETIME NOT NULL,
-                is_active BOOLEAN DEFAULT 1,
-                ip_address TEXT,
-                user_agent TEXT,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Password reset tokens
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS password_reset_tokens (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                token TEXT UNIQUE NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                expires_at DATETIME NOT NULL,
-                used BOOLEAN DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Email verification tokens
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS email_verification_tokens (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                token TEXT UNIQUE NOT NULL,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                expires_at DATETIME NOT NULL,
-                used BOOLEAN DEFAULT 0,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # Create indexes for better performance
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_appliance_data_user_id ON appliance_data (user_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_appliance_data_timestamp ON appliance_data (timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_token ON user_sessions (session_token)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON user_sessions (expires_at)')
-        
         # Create demo users if they don't exist
-        cursor.execute('SELECT COUNT(*) FROM users')
-        user_count = cursor.fetchone()[0]
+        cursor.execute('SELECT 1 FROM users LIMIT 1')
         
-        if user_count == 0:
+        if cursor.fetchone() is None:
             # Create demo users
             demo_users = [
                 ('demo1', 'demo1@havoc.com', 'Demo', 'User', '+91-9876543210'),
@@ -1360,65 +1622,19 @@ def init_db():
     finally:
         conn.close()
 
-# ============= CLEANUP AND UTILITIES =============
+# ============= STARTUP =============
 
-def cleanup_expired_sessions():
-    """Clean up expired sessions and tokens"""
+def warm_usage_buffers():
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Clean up expired sessions
-        cursor.execute('''
-            UPDATE user_sessions 
-            SET is_active = 0 
-            WHERE expires_at < ?
-        ''', (datetime.now(),))
-        
-        # Clean up expired password reset tokens
-        cursor.execute('''
-            DELETE FROM password_reset_tokens 
-            WHERE expires_at < ?
-        ''', (datetime.now(),))
-        
-        # Clean up expired email verification tokens
-        cursor.execute('''
-            DELETE FROM email_verification_tokens 
-            WHERE expires_at < ?
-        ''', (datetime.now(),))
-        
-        # Clean up old appliance data (keep last 30 days)
-        cursor.execute('''
-            DELETE FROM appliance_data 
-            WHERE timestamp < datetime('now', '-30 days')
-        ''', )
-        
-        conn.commit()
-        print(f"Cleanup completed at {datetime.now()}")
-        
+        warmed = simulator.usage_buffer.warm(conn)
+        print(f"📈 Usage buffers loaded for {warmed} active users")
     except Exception as e:
-        print(f"Cleanup error: {e}")
-        conn.rollback()
+        print(f"Usage buffer warm-up error: {e}")
     finally:
         conn.close()
 
-def schedule_cleanup():
-    """Schedule periodic cleanup tasks"""
-    import threading
-    import time
-    
-    def cleanup_worker():
-        while True:
-            try:
-                time.sleep(3600)  # Run every hour
-                cleanup_expired_sessions()
-            except Exception as e:
-                print(f"Cleanup worker error: {e}")
-    
-    cleanup_thread = threading.Thread(target=cleanup_worker, daemon=True)
-    cleanup_thread.start()
-
-def enhanced_startup():
+def enhanced_startup(with_simulator=True):
     """Enhanced startup with all initializations"""
     try:
         print("🔧 Initializing HaVoC-EcoWATT Backend...")
@@ -1427,23 +1643,23 @@ def enhanced_startup():
         print("📂 Setting up database...")
         init_db()
         
-        # Start the IoT simulation service
-        print("🤖 Starting IoT simulation...")
-        simulator.start()
-        
-        # Schedule cleanup tasks
-        print("🧹 Setting up cleanup tasks...")
-        schedule_cleanup()
-        
-        # Run initial cleanup
-        cleanup_expired_sessions()
+        if with_simulator:
+            # Start the IoT simulation service in this process
+            print("🤖 Starting IoT simulation...")
+            simulator.start()
+            
+            # Rebuild 24-hour usage buffers for recently active users in the
+            # background; dashboards fall back to rollups until they are loaded
+            threading.Thread(target=warm_usage_buffers, daemon=True).start()
+        else:
+            print("🤖 Using the simulator daemon (python simulation_service.py)")
         
         print("✅ Startup completed successfully!")
         print("🚀 HaVoC-EcoWATT Backend Server Starting...")
-        print("📊 IoT Simulation Service: ACTIVE")
+        print(f"📊 IoT Simulation Service: {'ACTIVE' if with_simulator else 'EXTERNAL'}")
         print("🔐 Authentication System: ENABLED") 
         print("📧 Email Service: CONFIGURED")
-        print("🧹 Cleanup Tasks: SCHEDULED")
+        print(f"🧹 Background Jobs: {'SCHEDULED' if with_simulator else 'RUN BY THE SIMULATOR DAEMON'}")
         print("=" * 50)
         print("🌐 Server will be available at:")
         print("   - Local: http://127.0.0.1:5000")
@@ -1455,17 +1671,25 @@ def enhanced_startup():
         print("Attempting to continue with basic setup...")
         try:
             init_db()
-            simulator.start()
+            if with_simulator:
+                simulator.start()
         except Exception as inner_e:
             print(f"❌ Critical startup failure: {inner_e}")
 
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Run the HaVoC-EcoWATT web app')
+    parser.add_argument('--web-only', action='store_true',
+                        help='Serve the web app only; the simulator runs as its own daemon')
+    args = parser.parse_args()
+    
     # Enhanced startup sequence
-    enhanced_startup()
+    enhanced_startup(with_simulator=not args.web_only)
     
-    # Run Flask app with reloader disabled to prevent duplicate simulation
+    # Run Flask app; the reloader is only safe without an in-process simulation
     try:
-        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
+        app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=args.web_only)
     except KeyboardInterrupt:
         print("\n👋 Shutting down gracefully...")
     except Exception as e:
@@ -0,0 +1,302 @@
+import os
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import ARCHIVE_DIR, HEARTBEAT_INTERVAL, READ_REPLICA_MAX_STALENESS, TICK_INTERVAL
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Cold tier for readings past retention: one zstd Parquet file per day,
+# sorted by (user_id, appliance_id, timestamp) so row-group min/max
+# statistics let a per-user read skip most of a file. The reading_archives
+# table catalogs each file with its own min/max user and timestamp for
+# pruning whole files. A day's file is written first and its catalog row is
+# committed in the same transaction that deletes the day's hot rows, so any
+# snapshot of the database sees each reading exactly once, hot or archived.
+# Catalogued files are never rewritten: late readings for an archived day
+# go into a new version of its file and the catalog row is pointed at it in
+# that same transaction. The read replica can list the old file for up to
+# READ_REPLICA_MAX_STALENESS, so superseded files are queued and removed by
+# a later archive pass once SUPERSEDED_GRACE_SECONDS have passed.
+
+ARCHIVE_ROW_GROUP_ROWS = 65536
+SUPERSEDED_GRACE_SECONDS = 2 * READ_REPLICA_MAX_STALENESS
+EPOCH = datetime(1970, 1, 1)
+
+ARCHIVE_COLUMNS = ['id', 'user_id', 'appliance_id', 'is_on', 'power_consumption', 'temperature', 'timestamp']
+
+def enabled():
+    return bool(ARCHIVE_DIR) and pa is not None
+
+def archive_schema():
+    return pa.schema([
+        ('id', pa.int64()),
+        ('user_id', pa.int32()),
+        ('appliance_id', pa.int32()),
+        ('is_on', pa.bool_()),
+        ('power_consumption', pa.float64()),
+        ('temperature', pa.float64()),
+        ('timestamp', pa.timestamp('us'))
+    ])
+
+def _to_table(rows, schema):
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    arrays = []
+    for values, field in zip(columns, schema):
+        if pa.types.is_timestamp(field.type):
+            arrays.append(pa.array(values, pa.string()).cast(field.type))
+        elif pa.types.is_boolean(field.type):
+            arrays.append(pa.array(values, pa.int8()).cast(field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+def _stats(table):
+    users = pc.min_max(table['user_id'])
+    times = pc.min_max(table['timestamp'])
+    return {
+        'min_user_id': users['min'].as_py(),
+        'max_user_id': users['max'].as_py(),
+        'min_timestamp': times['min'].as_py().isoformat(),
+        'max_timestamp': times['max'].as_py().isoformat()
+    }
+
+def _version_path(archive_dir, day, previous=None):
+    """Path for a day's first file, or the version after the catalogued `previous`"""
+    if previous is None:
+        return os.path.join(archive_dir, f'readings-{day.isoformat()}.parquet')
+    match = re.search(r'\.v(\d+)\.parquet$', previous)
+    version = int(match.group(1)) + 1 if match else 2
+    return os.path.join(archive_dir, f'readings-{day.isoformat()}.v{version}.parquet')
+
+def archive_day(conn, day, archive_dir=ARCHIVE_DIR):
+    """Move one day's hot readings into its Parquet file; returns rows archived.
+
+    The file is written outside the transaction; the catalog row, the
+    deletion of the day's hot rows and the queueing of any superseded file
+    are left for the caller to commit. Until then readers keep using the
+    committed catalog row and its file.
+    """
+    start = datetime(day.year, day.month, day.day)
+    end = start + timedelta(days=1)
+    cursor = conn.execute(f'''
+        SELECT {', '.join(ARCHIVE_COLUMNS)} FROM appliance_data
+        WHERE timestamp >= ? AND timestamp < ?
+        ORDER BY user_id, appliance_id, timestamp
+    ''', (start, end))
+
+    schema = archive_schema()
+    os.makedirs(archive_dir, exist_ok=True)
+    row = conn.execute('SELECT path FROM reading_archives WHERE day = ?', (day.isoformat(),)).fetchone()
+    previous = row[0] if row else None
+    # Not catalogued yet, so a leftover from an interrupted run is overwritten
+    path = _version_path(archive_dir, day, previous)
+
+    if previous is not None:
+        # Late readings for an archived day: merge them into a new version of its file
+        added = _to_table(cursor.fetchall(), schema)
+        if not added.num_rows:
+            return 0
+        table = pa.concat_tables([pq.read_table(previous, schema=schema), added])
+        _, first = np.unique(table['id'].to_numpy(), return_index=True)
+        table = table.take(first).sort_by([('user_id', 'ascending'), ('appliance_id', 'ascending'),
+                                           ('timestamp', 'ascending')])
+        pq.write_table(table, path, compression='zstd', row_group_size=ARCHIVE_ROW_GROUP_ROWS)
+        stats, archived, total = _stats(table), added.num_rows, table.num_rows
+    else:
+        stats, archived = None, 0
+        writer = pq.ParquetWriter(path, schema, compression='zstd')
+        try:
+            while True:
+                rows = cursor.fetchmany(ARCHIVE_ROW_GROUP_ROWS)
+                if not rows:
+                    break
+                batch = _to_table(rows, schema)
+                writer.write_table(batch)
+                archived += batch.num_rows
+                batch_stats = _stats(batch)
+                if stats is None:
+                    stats = batch_stats
+                else:
+                    stats['min_user_id'] = min(stats['min_user_id'], batch_stats['min_user_id'])
+                    stats['max_user_id'] = max(stats['max_user_id'], batch_stats['max_user_id'])
+                    stats['min_timestamp'] = min(stats['min_timestamp'], batch_stats['min_timestamp'])
+                    stats['max_timestamp'] = max(stats['max_timestamp'], batch_stats['max_timestamp'])
+        finally:
+            writer.close()
+        if not archived:
+            os.remove(path)
+            return 0
+        total = archived
+
+    conn.execute('''
+        INSERT INTO reading_archives (day, path, row_count, bytes, min_user_id, max_user_id,
+                                      min_timestamp, max_timestamp, archived_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (day) DO UPDATE SET
+            path = excluded.path, row_count = excluded.row_count, bytes = excluded.bytes,
+            min_user_id = excluded.min_user_id, max_user_id = excluded.max_user_id,
+            min_timestamp = excluded.min_timestamp, max_timestamp = excluded.max_timestamp,
+            archived_at = excluded.archived_at
+    ''', (day.isoformat(), path, total, os.path.getsize(path), stats['min_user_id'], stats['max_user_id'],
+          stats['min_timestamp'], stats['max_timestamp'], datetime.now()))
+    conn.execute('DELETE FROM appliance_data WHERE timestamp >= ? AND timestamp < ?', (start, end))
+    if previous is not None:
+        conn.execute('INSERT OR REPLACE INTO superseded_archives (path, superseded_at) VALUES (?, ?)',
+                     (previous, datetime.now()))
+    return archived
+
+def remove_superseded(conn, now=None):
+    """Delete superseded files older than the grace period; returns files removed"""
+    cutoff = (now or datetime.now()) - timedelta(seconds=SUPERSEDED_GRACE_SECONDS)
+    paths = [row[0] for row in conn.execute('SELECT path FROM superseded_archives WHERE superseded_at < ?',
+                                            (cutoff,))]
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    # Files go first: a crash in between leaves a row whose removal is retried
+    conn.executemany('DELETE FROM superseded_archives WHERE path = ?', [(path,) for path in paths])
+    conn.commit()
+    return len(paths)
+
+def archive_before(conn, cutoff, archive_dir=ARCHIVE_DIR):
+    """Archive every whole day of hot readings before cutoff (a midnight), committing
+    each day on its own, then clear out expired superseded files; returns rows archived"""
+    oldest = conn.execute('SELECT MIN(timestamp) FROM appliance_data').fetchone()[0]
+    archived = 0
+    if oldest is not None:
+        day = datetime.fromisoformat(oldest).date()
+        while day < cutoff.date():
+            archived += archive_day(conn, day, archive_dir)
+            conn.commit()
+            day += timedelta(days=1)
+    remove_superseded(conn)
+    return archived
+
+def archive_files(conn, user_id, start, end):
+    """Catalogued files that may hold user_id's readings in [start, end)"""
+    return [row[0] for row in conn.execute('''
+        SELECT path FROM reading_archives
+        WHERE max_timestamp >= ? AND min_timestamp < ?
+          AND min_user_id <= ? AND max_user_id >= ?
+        ORDER BY day
+    ''', (start.isoformat(), end.isoformat(), user_id, user_id))]
+
+def _filters(user_id, start, end, appliance_id=None):
+    filters = [('user_id', '=', user_id),
+               ('timestamp', '>=', pa.scalar(start, pa.timestamp('us'))),
+               ('timestamp', '<', pa.scalar(end, pa.timestamp('us')))]
+    if appliance_id is not None:
+        filters.append(('appliance_id', '=', appliance_id))
+    return filters
+
+def read_archived(conn, user_id, start, end, appliance_id=None, columns=None):
+    """A user's archived readings in [start, end) as one Arrow table (file, then row-group pruned)"""
+    columns = columns or ARCHIVE_COLUMNS
+    filters = _filters(user_id, start, end, appliance_id)
+    tables = [pq.read_table(path, columns=columns, filters=filters)
+              for path in archive_files(conn, user_id, start, end)]
+    if not tables:
+        return archive_schema().empty_table().select(columns)
+    return pa.concat_tables(tables)
+
+def _seconds(dt):
+    return (dt - EPOCH).total_seconds()
+
+def _bucket_keys(t_start, bucket):
+    """Bucket labels matching rollup_service.BUCKETS for span start times (epoch seconds)"""
+    if bucket is None:
+        return np.full(len(t_start), 'total')
+    if bucket == 'hour_of_day':
+        return np.char.zfill(((t_start // 3600) % 24).astype(int).astype(str), 2)
+    unit = 'h' if bucket == 'hour' else 'D'
+    labels = np.datetime_as_string(t_start.astype('datetime64[s]').astype(f'datetime64[{unit}]'))
+    return np.char.add(np.char.replace(labels, 'T', ' '), ':00') if bucket == 'hour' else labels
+
+def aggregate_archived(conn, user_id, start, end, bucket=None, by_appliance=False):
+    """Span-weighted aggregates of archived readings, shaped like READING_SPANS_CTE rows.
+
+    Returns (bucket, appliance_id, sample_count, power_sum, power_min,
+    power_max, on_count) tuples so rollup_service.query_usage can merge them
+    with hot and rollup rows.
+    """
+    table = read_archived(conn, user_id, start - timedelta(seconds=HEARTBEAT_INTERVAL), end,
+                          columns=['appliance_id', 'is_on', 'power_consumption', 'timestamp'])
+    if not table.num_rows:
+        return []
+    table = table.sort_by([('appliance_id', 'ascending'), ('timestamp', 'ascending')])
+    appliance = table['appliance_id'].to_numpy()
+    is_on = table['is_on'].to_numpy(zero_copy_only=False)
+    power = table['power_consumption'].fill_null(0).to_numpy()
+    t_start = table['timestamp'].cast(pa.int64()).to_numpy() / 1e6
+
+    # Each reading holds until the appliance's next one, capped at the heartbeat
+    t_end = t_start + HEARTBEAT_INTERVAL
+    same = appliance[:-1] == appliance[1:]
+    t_end[:-1] = np.where(same, np.minimum(t_start[1:], t_end[:-1]), t_end[:-1])
+
+    lo, hi = _seconds(start), _seconds(end)
+    keep = t_end > lo
+    clipped_start = np.maximum(t_start[keep], lo)
+    duration = np.minimum(t_end[keep], hi) - clipped_start
+    appliance, is_on, power = appliance[keep], is_on[keep], power[keep]
+
+    labels, label_index = np.unique(_bucket_keys(clipped_start, bucket), return_inverse=True)
+    width = int(appliance.max()) + 1 if by_appliance else 1
+    groups, inverse = np.unique(label_index * width + (appliance if by_appliance else 0), return_inverse=True)
+    sample_count = np.bincount(inverse, weights=duration) / TICK_INTERVAL
+    power_sum = np.bincount(inverse, weights=power * duration) / TICK_INTERVAL
+    on_count = np.bincount(inverse, weights=np.where(is_on, duration, 0.0)) / TICK_INTERVAL
+    power_min = np.full(len(groups), np.inf)
+    power_max = np.full(len(groups), -np.inf)
+    np.minimum.at(power_min, inverse, power)
+    np.maximum.at(power_max, inverse, power)
+    return [(str(labels[group // width]), int(group % width) if by_appliance else None,
+             sample_count[i], power_sum[i], power_min[i], power_max[i], on_count[i])
+            for i, group in enumerate(groups)]
+
+def archive_rows(conn, user_id, start, end, appliance_id=None):
+    """Archived readings, one list per file in timestamp order, as (timestamp, appliance_id,
+    is_on, temperature, power_consumption) tuples formatted like appliance_data rows"""
+    columns = ['timestamp', 'appliance_id', 'is_on', 'temperature', 'power_consumption']
+    filters = _filters(user_id, start, end, appliance_id)
+    for path in archive_files(conn, user_id, start, end):
+        table = pq.read_table(path, columns=columns, filters=filters)
+        table = table.sort_by([('timestamp', 'ascending'), ('appliance_id', 'ascending')])
+        yield [(row[0].isoformat(), row[1], int(row[2]), row[3], row[4])
+               for row in zip(*(column.to_pylist() for column in table.columns))]
+
+def summary(conn):
+    row = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(row_count), 0), COALESCE(SUM(bytes), 0), MIN(day), MAX(day)
+        FROM reading_archives
+    ''').fetchone()
+    return {'files': row[0], 'rows': row[1], 'bytes': row[2], 'first_day': row[3], 'last_day': row[4]}
+
+if __name__ == '__main__':
+    import argparse
+    import sqlite3
+
+    parser = argparse.ArgumentParser(description='Inspect or query the reading archive')
+    parser.add_argument('--db', default='havoc_ecowatt.db')
+    parser.add_argument('--user', type=int)
+    parser.add_argument('--start', type=datetime.fromisoformat)
+    parser.add_argument('--end', type=datetime.fromisoformat)
+    parser.add_argument('--bucket', choices=['hour', 'hour_of_day', 'day'])
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    print(summary(conn))
+    if args.user is not None and args.start and args.end:
+        for row in aggregate_archived(conn, args.user, args.start, args.end, args.bucket):
+            print(row)
+    conn.close()
@@ -0,0 +1,20 @@
+# Monotonic change generations for appliances. A single counter is advanced
+# once per change batch; appliance_changes keeps, per appliance, the
+# generation of its last configuration change (maintained by triggers, so
+# every writer is covered) and of its last displayed reading change (stamped
+# by the simulator on ticks where some appliance's reading moved past its
+# deadbands, stored or not). Readers remember the generation they last saw
+# and ask only for appliances whose generations are newer.
+
+def current_generation(conn):
+    return conn.execute('SELECT value FROM change_generation WHERE id = 1').fetchone()[0]
+
+def record_readings(conn, data_list):
+    """Stamp the appliances in data_list with one new reading generation"""
+    conn.execute('UPDATE change_generation SET value = value + 1 WHERE id = 1')
+    generation = current_generation(conn)
+    conn.executemany('''
+        INSERT INTO appliance_changes (appliance_id, user_id, reading_generation) VALUES (?, ?, ?)
+        ON CONFLICT (appliance_id) DO UPDATE SET reading_generation = excluded.reading_generation
+    ''', [(data['appliance_id'], data['user_id'], generation) for data in data_list])
+    return generation
@@ -0,0 +1,105 @@
+import mmap
+import os
+import pickle
+import struct
+import zlib
+
+# File layout: a header followed by two equally sized slots. Checkpoints
+# alternate between slots, so a crash mid-write always leaves the previous
+# checkpoint intact; the slot with the highest valid generation wins.
+SNAPSHOT_MAGIC = b'EWCK'
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct('<4sHI')        # magic, version, slot size
+SLOT_HEADER = struct.Struct('<QII')    # generation, payload length, crc32
+MIN_SLOT_SIZE = 64 * 1024
+
+def snapshot_path(db_path):
+    """Snapshot file kept next to its database, so simulators on different databases don't collide"""
+    return f'{os.path.abspath(db_path)}.snapshot'
+
+class SnapshotFile:
+    """Double-buffered, memory-mapped snapshot of simulator state"""
+
+    def __init__(self, path):
+        self.path = path
+        self.generation = 0
+
+    def _slot_offset(self, slot, slot_size):
+        return HEADER.size + slot * slot_size
+
+    def _open(self, slot_size, path=None):
+        """Map the snapshot file, (re)creating it when missing or too small"""
+        size = HEADER.size + 2 * slot_size
+        fd = os.open(path or self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+                os.pwrite(fd, HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, slot_size), 0)
+            return mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _current_slot_size(self):
+        try:
+            with open(self.path, 'rb') as f:
+                magic, version, slot_size = HEADER.unpack(f.read(HEADER.size))
+        except (OSError, struct.error):
+            return None
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            return None
+        return slot_size
+
+    def write(self, state):
+        """Write state into the older slot"""
+        payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        needed = SLOT_HEADER.size + len(payload)
+        slot_size = self._current_slot_size()
+
+        self.generation += 1
+        if slot_size is None or slot_size < needed:
+            # Grow (or replace an unreadable file) with headroom for fleet
+            # growth. The new file is written in full and renamed over the old
+            # one, so a crash in between still leaves the old checkpoints.
+            slot_size = max(MIN_SLOT_SIZE, needed * 2)
+            staging = self.path + '.tmp'
+            if os.path.exists(staging):
+                os.remove(staging)
+            self._write_slot(staging, slot_size, payload)
+            os.replace(staging, self.path)
+        else:
+            self._write_slot(self.path, slot_size, payload)
+
+    def _write_slot(self, path, slot_size, payload):
+        """Write the payload into the slot for the current generation and flush it"""
+        offset = self._slot_offset(self.generation % 2, slot_size)
+        end = offset + SLOT_HEADER.size + len(payload)
+        with self._open(slot_size, path) as mapped:
+            mapped[offset + SLOT_HEADER.size:end] = payload
+            mapped[offset:offset + SLOT_HEADER.size] = SLOT_HEADER.pack(
+                self.generation, len(payload), zlib.crc32(payload))
+            mapped.flush()
+
+    def read(self):
+        """Return the newest intact state, or None if there is no usable snapshot"""
+        slot_size = self._current_slot_size()
+        if slot_size is None:
+            return None
+
+        best = None
+        with self._open(slot_size) as mapped:
+            for slot in (0, 1):
+                offset = self._slot_offset(slot, slot_size)
+                generation, length, crc = SLOT_HEADER.unpack_from(mapped, offset)
+                if generation == 0 or length > slot_size - SLOT_HEADER.size:
+                    continue
+                start = offset + SLOT_HEADER.size
+                payload = mapped[start:start + length]
+                if zlib.crc32(payload) != crc:
+                    continue
+                if best is None or generation > best[0]:
+                    best = (generation, payload)
+
+        if best is None:
+            return None
+        self.generation = best[0]
+        return pickle.loads(best[1])
@@ -0,0 +1,38 @@
+import time
+from datetime import datetime, timedelta
+
+class SystemClock:
+    """Wall-clock time"""
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def finished(self):
+        return False
+
+class VirtualClock:
+    """Simulated time that advances on every sleep.
+
+    With a speed the clock is paced at `speed` x real time; without one it
+    runs as fast as the caller can go. Once `end` is reached the clock
+    reports finished.
+    """
+
+    def __init__(self, start, end=None, speed=None):
+        self.current = start
+        self.end = end
+        self.speed = speed
+
+    def now(self):
+        return self.current
+
+    def sleep(self, seconds):
+        if self.speed:
+            time.sleep(seconds / self.speed)
+        self.current += timedelta(seconds=seconds)
+
+    def finished(self):
+        return self.end is not None and self.current >= self.end
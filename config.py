@@ -0,0 +1,65 @@
+# Shared settings for the web app, simulator and background services
+
+import os
+
+# Seconds between simulation ticks
+TICK_INTERVAL = 10
+
+# With deadband recording enabled, an unchanged appliance still gets a
+# heartbeat row at least this often (seconds)
+HEARTBEAT_INTERVAL = 300
+
+# Ticks between simulator state checkpoints
+CHECKPOINT_INTERVAL = 6
+
+# Memory-mapped table of the latest reading per appliance, shared by the
+# simulator (writer) and every web worker (readers); the database path's
+# digest is appended so each database gets its own table
+LATEST_READINGS_PATH = ('/dev/shm/havoc_ecowatt_latest' if os.path.isdir('/dev/shm')
+                        else 'latest_readings.shm')
+
+# Memory budget for the per-user 24-hour usage ring buffers
+USAGE_BUFFER_BUDGET_BYTES = 64 * 1024 * 1024
+
+# Household peak-power limit used by the scheduler when a user hasn't set one (W)
+DEFAULT_PEAK_POWER_W = 5000
+
+# Grid emission factor for carbon estimates (kg CO2 per kWh)
+CARBON_KG_PER_KWH = 0.82
+
+# API responses at least this large are gzip/brotli compressed (bytes)
+COMPRESS_MIN_BYTES = 1024
+
+# Unix socket the simulator daemon listens on for commands
+SIMULATOR_SOCKET_PATH = 'simulation.sock'
+
+# Live dashboard updates are long polls that wait up to LIVE_POLL_SECONDS
+# for the simulator's next tick. At most LIVE_MAX_WAITERS polls wait at once
+# in each web worker process (keep it below gunicorn's --threads); past
+# that, polls answer at once and the browser retries after a tick
+LIVE_POLL_SECONDS = 25
+LIVE_MAX_WAITERS = 8
+
+# Raw appliance_data rows are kept this long; rollup tiers have their own retention
+READING_RETENTION_DAYS = 30
+
+# Readings past retention are moved to daily Parquet files here (needs
+# pyarrow; None deletes them instead)
+ARCHIVE_DIR = 'archive'
+
+# Read-only snapshot that analytics, export and report endpoints read from
+# (None disables it). The simulator refreshes it every half of the staleness
+# bound; older snapshots are bypassed in favour of the primary (seconds)
+READ_REPLICA_PATH = 'havoc_ecowatt_replica.db'
+READ_REPLICA_MAX_STALENESS = 300
+
+# Engine for the usage aggregations behind the energy-usage, dashboard and
+# analytics endpoints: 'sqlite' or 'duckdb' (needs the duckdb package). With
+# ANALYTICS_COMPARE both engines run and mismatches and timings are reported
+ANALYTICS_ENGINE = 'sqlite'
+ANALYTICS_COMPARE = False
+
+# Readings this many standard deviations above an appliance's usual on-state
+# power for the hour of day are recorded as anomalies; open dashboards get
+# them with their next live poll (/api/live)
+ANOMALY_Z_THRESHOLD = 4.0
@@ -0,0 +1,15 @@
+# Per-user data generation numbers. Every write that changes what a user's
+# API responses contain (stored readings, appliance configuration, tariff or
+# preferences) bumps the user's generation in the same transaction, so the
+# generation plus the rollup watermark identifies a version of their data.
+
+def bump(conn, user_ids):
+    """Advance the generation of each user in user_ids"""
+    conn.executemany('''
+        INSERT INTO user_data_generations (user_id, generation) VALUES (?, 1)
+        ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1
+    ''', [(user_id,) for user_id in set(user_ids)])
+
+def get_generation(conn, user_id):
+    row = conn.execute('SELECT generation FROM user_data_generations WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
@@ -0,0 +1,252 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from config import ANALYTICS_ENGINE, ANALYTICS_COMPARE, HEARTBEAT_INTERVAL
+from rollup_service import BUCKET_FORMAT, get_watermark, merge_usage, plan_query, query_usage, reading_span_params
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Optional DuckDB engine for the usage aggregations behind the energy-usage,
+# dashboard and analytics endpoints. It attaches the SQLite file read-only
+# through DuckDB's sqlite extension, reads archived days straight from their
+# Parquet files, and evaluates the same segment plan as
+# rollup_service.query_usage with vectorized, multi-threaded scans. Raw
+# segments are one window query over hot and archived readings together.
+
+# DuckDB spellings of rollup_service.BUCKETS
+DUCKDB_BUCKETS = {
+    'hour': "strftime({col}, '%Y-%m-%d %H:00')",
+    'hour_of_day': "strftime({col}, '%H')",
+    'day': "strftime({col}, '%Y-%m-%d')",
+    None: "'total'"
+}
+
+# Relative difference above which compare mode reports a mismatch; SQLite's
+# julianday arithmetic alone accounts for about 1e-6
+COMPARE_TOLERANCE = 1e-4
+
+def _quote(text):
+    return "'" + text.replace("'", "''") + "'"
+
+class DuckDBUsage:
+    """query_usage evaluated by an embedded DuckDB over the attached SQLite file"""
+
+    def __init__(self, db_path, threads=None):
+        self.db_path = db_path
+        self.threads = threads
+        self.database = None
+        self.lock = threading.Lock()
+
+    def cursor(self):
+        """A connection to the shared in-memory DuckDB; one per call, as they aren't thread-safe"""
+        with self.lock:
+            if self.database is None:
+                database = duckdb.connect(':memory:')
+                if self.threads:
+                    database.execute(f'SET threads = {int(self.threads)}')
+                database.execute(f'ATTACH {_quote(self.db_path)} AS hot (TYPE sqlite, READ_ONLY)')
+                self.database = database
+        return self.database.cursor()
+
+    def watermark(self, cursor):
+        row = cursor.execute("SELECT value FROM hot.rollup_state WHERE name = 'watermark'").fetchone()
+        return datetime.strptime(row[0], BUCKET_FORMAT) if row else None
+
+    def archive_files(self, cursor, user_id, start, end):
+        return [row[0] for row in cursor.execute('''
+            SELECT path FROM hot.reading_archives
+            WHERE max_timestamp >= ? AND min_timestamp < ?
+              AND min_user_id <= ? AND max_user_id >= ?
+            ORDER BY day
+        ''', [start.isoformat(), end.isoformat(), user_id, user_id]).fetchall()]
+
+    def query_usage(self, user_id, start, end=None, bucket=None, by_appliance=False, plan=None, now=None):
+        """Same contract and result as rollup_service.query_usage"""
+        now = now or datetime.now()
+        end = end or now
+        key_expr = DUCKDB_BUCKETS[bucket]
+        appliance_col = 'appliance_id' if by_appliance else 'NULL'
+        group_cols = 'bucket, appliance_id' if by_appliance else 'bucket'
+        cursor = self.cursor()
+        rows = []
+        try:
+            if plan is None:
+                plan = plan_query(start, end, bucket, self.watermark(cursor))
+            for table, seg_start, seg_end in plan:
+                if table is None:
+                    rows += self._raw_segment(cursor, user_id, seg_start, seg_end, now, key_expr,
+                                              appliance_col, group_cols)
+                else:
+                    rows += cursor.execute(f'''
+                        SELECT {key_expr.format(col='CAST(bucket_start AS TIMESTAMP)')} AS bucket,
+                               {appliance_col} AS appliance_id,
+                               SUM(sample_count), SUM(power_sum), MIN(power_min), MAX(power_max),
+                               SUM(on_count)
+                        FROM hot.{table}
+                        WHERE user_id = ? AND bucket_start >= ? AND bucket_start < ?
+                        GROUP BY {group_cols}
+                    ''', [user_id, seg_start.strftime(BUCKET_FORMAT), seg_end.strftime(BUCKET_FORMAT)]).fetchall()
+        finally:
+            cursor.close()
+        return merge_usage(rows, by_appliance)
+
+    def _raw_segment(self, cursor, user_id, start, end, now, key_expr, appliance_col, group_cols):
+        """Span-weighted aggregates of hot and archived readings, as READING_SPANS_CTE computes them"""
+        params = reading_span_params(user_id, start, end, now)
+        sources = [f'''
+            SELECT appliance_id, CAST(is_on AS INTEGER) AS is_on, power_consumption,
+                   CAST(timestamp AS TIMESTAMP) AS ts
+            FROM hot.appliance_data WHERE user_id = $user_id
+        ''']
+        files = self.archive_files(cursor, user_id, params['lookback'], end)
+        if files:
+            sources.append(f'''
+                SELECT appliance_id, CAST(is_on AS INTEGER), power_consumption, timestamp
+                FROM read_parquet([{', '.join(_quote(path) for path in files)}]) WHERE user_id = $user_id
+            ''')
+        return cursor.execute(f'''
+            WITH source AS ({' UNION ALL '.join(sources)}),
+            spans AS (
+                SELECT appliance_id, is_on, power_consumption, ts AS t_start,
+                       LEAST(COALESCE(LEAD(ts) OVER w, $now), ts + INTERVAL {int(HEARTBEAT_INTERVAL)} SECOND) AS t_end
+                FROM source
+                WHERE ts >= $lookback AND ts < $end
+                WINDOW w AS (PARTITION BY appliance_id ORDER BY ts)
+            ),
+            readings AS (
+                SELECT appliance_id, is_on, power_consumption,
+                       GREATEST(t_start, $start) AS t_start,
+                       (epoch_us(LEAST(t_end, $end)) - epoch_us(GREATEST(t_start, $start))) / 1e6 AS duration_s
+                FROM spans
+                WHERE t_end > $start
+            )
+            SELECT {key_expr.format(col='t_start')} AS bucket, {appliance_col} AS appliance_id,
+                   SUM(duration_s) / $tick,
+                   SUM(power_consumption * duration_s) / $tick,
+                   MIN(power_consumption), MAX(power_consumption),
+                   SUM(CASE WHEN is_on = 1 THEN duration_s ELSE 0 END) / $tick
+            FROM readings
+            GROUP BY {group_cols}
+        ''', {name: params[name] for name in ('user_id', 'start', 'end', 'lookback', 'now', 'tick')}).fetchall()
+
+def usage_difference(expected, actual):
+    """Largest relative difference between two query_usage results (inf if the buckets differ)"""
+    if [(entry['bucket'], entry['appliance_id']) for entry in expected] != \
+            [(entry['bucket'], entry['appliance_id']) for entry in actual]:
+        return float('inf')
+    worst = 0.0
+    for left, right in zip(expected, actual):
+        for field in ('sample_count', 'power_sum', 'on_count', 'power_min', 'power_max'):
+            a, b = left[field] or 0, right[field] or 0
+            worst = max(worst, abs(a - b) / max(abs(a), abs(b), 1.0))
+    return worst
+
+class UsageEngine:
+    """Runs query_usage on SQLite or DuckDB (ANALYTICS_ENGINE), or on both with
+    ANALYTICS_COMPARE to check DuckDB's results and time the two"""
+
+    def __init__(self, db_path, engine=ANALYTICS_ENGINE, compare=ANALYTICS_COMPARE):
+        self.db_path = db_path
+        wanted = engine == 'duckdb' or compare
+        if wanted and duckdb is None:
+            print("DuckDB analytics requested but the duckdb package is not installed; using SQLite")
+        self.duckdb = DuckDBUsage(db_path) if wanted and duckdb is not None else None
+        self.engine = engine if self.duckdb is not None else 'sqlite'
+        self.compare = compare and self.duckdb is not None
+        self.lock = threading.Lock()
+        self.calls = {'sqlite': 0, 'duckdb': 0}
+        self.seconds = {'sqlite': 0.0, 'duckdb': 0.0}
+        self.mismatches = 0
+        self.failures = 0
+
+    def _failed(self, error):
+        with self.lock:
+            self.failures += 1
+            if self.duckdb.database is None:
+                # Attaching failed (e.g. the sqlite extension can't be installed): stop retrying
+                self.engine, self.compare = 'sqlite', False
+        print(f"DuckDB usage query failed, using SQLite: {error}")
+
+    def _timed(self, engine, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.calls[engine] += 1
+            self.seconds[engine] += elapsed
+        return result, elapsed
+
+    def query_usage(self, conn, user_id, start, end=None, bucket=None, by_appliance=False, now=None):
+        """Drop-in for rollup_service.query_usage"""
+        now = now or datetime.now()  # both engines must cover the same window
+        end = end or now
+        if not self.compare:
+            if self.engine == 'duckdb':
+                try:
+                    return self._timed('duckdb', self.duckdb.query_usage, user_id, start, end, bucket,
+                                       by_appliance, None, now)[0]
+                except duckdb.Error as e:
+                    self._failed(e)
+            return self._timed('sqlite', query_usage, conn, user_id, start, end, bucket, by_appliance, None, now)[0]
+
+        # DuckDB reads the primary, so the SQLite side does too (not the replica).
+        # The watermark is read once so a rollup flush between the two runs
+        # can't give them different segment plans.
+        primary = sqlite3.connect(self.db_path)
+        try:
+            plan = plan_query(start, end, bucket, get_watermark(primary))
+            expected, sqlite_seconds = self._timed('sqlite', query_usage, primary, user_id, start, end,
+                                                   bucket, by_appliance, plan, now)
+        finally:
+            primary.close()
+        try:
+            actual, duckdb_seconds = self._timed('duckdb', self.duckdb.query_usage, user_id, start, end,
+                                                 bucket, by_appliance, plan, now)
+        except duckdb.Error as e:
+            self._failed(e)
+            return expected
+
+        difference = usage_difference(expected, actual)
+        if difference > COMPARE_TOLERANCE:
+            with self.lock:
+                self.mismatches += 1
+            print(f"Engine mismatch for user {user_id} {start:%Y-%m-%d %H:%M}..{end:%Y-%m-%d %H:%M} "
+                  f"({bucket}, by_appliance={by_appliance}): relative difference {difference:.3g}; "
+                  f"sqlite {sqlite_seconds * 1000:.1f}ms, duckdb {duckdb_seconds * 1000:.1f}ms")
+        return actual if self.engine == 'duckdb' else expected
+
+    def status(self):
+        with self.lock:
+            return {
+                'engine': self.engine,
+                'compare': self.compare,
+                'calls': dict(self.calls),
+                'avg_ms': {engine: round(self.seconds[engine] / self.calls[engine] * 1000, 2)
+                           for engine in self.calls if self.calls[engine]},
+                'mismatches': self.mismatches,
+                'duckdb_failures': self.failures
+            }
+
+if __name__ == '__main__':
+    import argparse
+    from datetime import timedelta
+
+    parser = argparse.ArgumentParser(description='Compare the SQLite and DuckDB usage engines')
+    parser.add_argument('--db', default='havoc_ecowatt.db')
+    parser.add_argument('--user', type=int, required=True)
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--bucket', choices=['hour', 'hour_of_day', 'day'])
+    parser.add_argument('--by-appliance', action='store_true')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = UsageEngine(args.db, 'duckdb', compare=True)
+    end = datetime.now()
+    for _ in range(args.repeat):
+        engine.query_usage(None, args.user, end - timedelta(days=args.days), end, args.bucket, args.by_appliance)
+    print(engine.status())
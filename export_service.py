@@ -0,0 +1,201 @@
+import csv
+import io
+import itertools
+import time
+
+import archive_service
+from config import TICK_INTERVAL
+from rollup_service import BUCKET_FORMAT
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Rows fetched from the cursor per CSV chunk / Parquet row group
+EXPORT_CHUNK_ROWS = 10000
+
+READING_COLUMNS = ['timestamp', 'appliance_id', 'appliance_name', 'appliance_type',
+                   'is_on', 'temperature', 'power_consumption']
+ROLLUP_COLUMNS = ['bucket_start', 'appliance_id', 'appliance_name', 'appliance_type',
+                  'sample_count', 'on_count', 'avg_power', 'power_min', 'power_max', 'energy_kwh']
+
+# Export resolution -> rollup tier (None = stored readings)
+RESOLUTIONS = {'raw': None, 'minute': 'rollup_1m', 'hour': 'rollup_1h', 'day': 'rollup_1d'}
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet')
+}
+
+def available_formats():
+    return [name for name in FORMATS if name != 'parquet' or pa is not None]
+
+def export_query(user_id, resolution, start, end, appliance_id=None):
+    """SQL, parameters and column names for one export"""
+    table = RESOLUTIONS[resolution]
+    appliance_filter = ' AND a.id = ?' if appliance_id is not None else ''
+    if table is None:
+        # Readings are stored with ISO 'T' timestamps
+        sql = f'''
+            SELECT ad.timestamp, ad.appliance_id, a.name, a.type,
+                   ad.is_on, ad.temperature, ad.power_consumption
+            FROM appliance_data ad
+            JOIN appliances a ON a.id = ad.appliance_id
+            WHERE ad.user_id = ? AND ad.timestamp >= ? AND ad.timestamp < ?{appliance_filter}
+            ORDER BY ad.timestamp, ad.appliance_id
+        '''
+        params = [user_id, start.isoformat(), end.isoformat()]
+        columns = READING_COLUMNS
+    else:
+        sql = f'''
+            SELECT r.bucket_start, r.appliance_id, a.name, a.type,
+                   r.sample_count, r.on_count,
+                   r.power_sum / r.sample_count AS avg_power,
+                   r.power_min, r.power_max,
+                   r.power_sum * {TICK_INTERVAL} / 3600000.0 AS energy_kwh
+            FROM {table} r
+            JOIN appliances a ON a.id = r.appliance_id
+            WHERE r.user_id = ? AND r.bucket_start >= ? AND r.bucket_start < ?{appliance_filter}
+            ORDER BY r.bucket_start, r.appliance_id
+        '''
+        params = [user_id, start.strftime(BUCKET_FORMAT), end.strftime(BUCKET_FORMAT)]
+        columns = ROLLUP_COLUMNS
+    if appliance_id is not None:
+        params.append(appliance_id)
+    return sql, params, columns
+
+def iter_chunks(conn, sql, params):
+    """Yield lists of rows from a cursor without materializing the result"""
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+        if not rows:
+            break
+        yield rows
+
+def archived_chunks(conn, user_id, start, end, appliance_id=None):
+    """Archived readings in READING_COLUMNS order, one chunk per archive file"""
+    appliances = {row[0]: (row[1], row[2]) for row in
+                  conn.execute('SELECT id, name, type FROM appliances WHERE user_id = ?', (user_id,))}
+    for rows in archive_service.archive_rows(conn, user_id, start, end, appliance_id):
+        chunk = [(timestamp, appliance, *appliances[appliance], is_on, temperature, power)
+                 for timestamp, appliance, is_on, temperature, power in rows if appliance in appliances]
+        if chunk:
+            yield chunk
+
+def csv_chunks(chunks, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+class _DrainableSink:
+    """Write-only file object handed to ParquetWriter; drained after each row group"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def parquet_schema(columns):
+    types = {
+        'timestamp': pa.timestamp('us'),
+        'bucket_start': pa.timestamp('s'),
+        'appliance_id': pa.int32(),
+        'appliance_name': pa.string(),
+        'appliance_type': pa.string(),
+        'is_on': pa.bool_(),
+        'temperature': pa.float64(),
+        'power_consumption': pa.float64(),
+        'sample_count': pa.int64(),
+        'on_count': pa.int64(),
+        'avg_power': pa.float64(),
+        'power_min': pa.float64(),
+        'power_max': pa.float64(),
+        'energy_kwh': pa.float64()
+    }
+    return pa.schema([(name, types[name]) for name in columns])
+
+def parquet_chunks(chunks, columns):
+    schema = parquet_schema(columns)
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for rows in chunks:
+            arrays = []
+            for index, field in enumerate(schema):
+                values = [row[index] for row in rows]
+                if pa.types.is_timestamp(field.type):
+                    arrays.append(pa.array(values, pa.string()).cast(field.type))
+                elif pa.types.is_boolean(field.type):
+                    arrays.append(pa.array(values, pa.int8()).cast(field.type))
+                else:
+                    arrays.append(pa.array(values, field.type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def stream_export(connect, user_id, resolution, start, end, appliance_id=None, fmt='csv'):
+    """Generator of encoded export bytes in constant memory.
+
+    Opens its own connection with connect() so the response can keep
+    streaming after the request handler has returned, and logs row/byte
+    throughput when done.
+    """
+    sql, params, columns = export_query(user_id, resolution, start, end, appliance_id)
+    encode = parquet_chunks if fmt == 'parquet' else csv_chunks
+
+    conn = connect()
+    chunks = iter_chunks(conn, sql, params)
+    if resolution == 'raw' and archive_service.enabled():
+        # Archived days precede every hot reading
+        chunks = itertools.chain(archived_chunks(conn, user_id, start, end, appliance_id), chunks)
+    started = time.time()
+    counter = {'rows': 0}
+
+    def counted(chunks):
+        for rows in chunks:
+            counter['rows'] += len(rows)
+            yield rows
+
+    total_bytes = 0
+    try:
+        for data in encode(counted(chunks), columns):
+            if data:
+                total_bytes += len(data)
+                yield data
+    finally:
+        conn.close()
+        elapsed = max(time.time() - started, 1e-6)
+        print(f"Export user {user_id} ({resolution}, {fmt}): {counter['rows']} rows, "
+              f"{total_bytes} bytes in {elapsed:.2f}s "
+              f"({counter['rows'] / elapsed:.0f} rows/s, {total_bytes / elapsed / 1e6:.2f} MB/s)")
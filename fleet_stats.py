@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+# Window over which readings per second are measured (seconds)
+RATE_WINDOW = 60
+
+class FleetStats:
+    """In-memory fleet counters behind get_user_stats and /api/simulation-stats.
+
+    Seeded from the appliances table once, kept current by appliance
+    add/update/remove events and by the readings the simulator ingests, and
+    periodically reconciled against the database to correct any drift.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seeded = False
+        self.appliances = {}            # appliance_id -> (user_id, type)
+        self.user_counts = Counter()    # user_id -> active appliances
+        self.type_counts = Counter()    # type -> active appliances
+        self.live = {}                  # appliance_id -> (is_on, power) from the latest reading
+        self.on_count = 0
+        self.power_by_type = Counter()
+        self.rate_samples = deque()     # (monotonic time, readings)
+        self.reconciled_at = None
+        self.last_drift = 0
+
+    def _add(self, appliance_id, user_id, appliance_type):
+        self.appliances[appliance_id] = (user_id, appliance_type)
+        self.user_counts[user_id] += 1
+        self.type_counts[appliance_type] += 1
+
+    def _remove(self, appliance_id):
+        entry = self.appliances.pop(appliance_id, None)
+        if entry is None:
+            return
+        user_id, appliance_type = entry
+        self.user_counts[user_id] -= 1
+        if self.user_counts[user_id] <= 0:
+            del self.user_counts[user_id]
+        self.type_counts[appliance_type] -= 1
+        if self.type_counts[appliance_type] <= 0:
+            del self.type_counts[appliance_type]
+
+        is_on, power = self.live.pop(appliance_id, (False, 0.0))
+        self.on_count -= 1 if is_on else 0
+        self.power_by_type[appliance_type] -= power
+
+    def seed(self, appliances):
+        """Rebuild counters from active appliance rows (id, user_id, type)"""
+        with self.lock:
+            self.appliances = {}
+            self.user_counts = Counter()
+            self.type_counts = Counter()
+            for appliance in appliances:
+                self._add(appliance['id'], appliance['user_id'], appliance['type'])
+            self.live = {appliance_id: live for appliance_id, live in self.live.items()
+                         if appliance_id in self.appliances}
+            self.on_count = sum(1 for is_on, _ in self.live.values() if is_on)
+            self.power_by_type = Counter()
+            for appliance_id, (_, power) in self.live.items():
+                self.power_by_type[self.appliances[appliance_id][1]] += power
+            self.seeded = True
+
+    def on_added(self, appliance):
+        """Appliance added or changed (upsert)"""
+        with self.lock:
+            live = self.live.get(appliance['id'])
+            self._remove(appliance['id'])
+            self._add(appliance['id'], appliance['user_id'], appliance['type'])
+            if live is not None:
+                # Keep the latest reading, now counted under the current type
+                self.live[appliance['id']] = live
+                self.on_count += 1 if live[0] else 0
+                self.power_by_type[appliance['type']] += live[1]
+
+    on_updated = on_added
+
+    def on_removed(self, appliance_id):
+        with self.lock:
+            self._remove(appliance_id)
+
+    def observe_readings(self, data_list):
+        """Fold a tick's readings into the live on-count, power and rate"""
+        now = time.monotonic()
+        with self.lock:
+            for data in data_list:
+                entry = self.appliances.get(data['appliance_id'])
+                if entry is None:
+                    continue
+                appliance_type = entry[1]
+                was_on, old_power = self.live.get(data['appliance_id'], (False, 0.0))
+                is_on = bool(data['is_on'])
+                power = data['power_consumption'] or 0.0
+                self.live[data['appliance_id']] = (is_on, power)
+                self.on_count += int(is_on) - int(was_on)
+                self.power_by_type[appliance_type] += power - old_power
+
+            self.rate_samples.append((now, len(data_list)))
+            while self.rate_samples and self.rate_samples[0][0] < now - RATE_WINDOW:
+                self.rate_samples.popleft()
+
+    def reconcile(self, conn):
+        """Recount active appliances from the database; returns how many counters were off"""
+        rows = conn.execute('''
+            SELECT id, user_id, type FROM appliances
+            WHERE is_active = 1
+        ''').fetchall()
+        with self.lock:
+            expected_types = Counter(row['type'] for row in rows)
+            expected_users = Counter(row['user_id'] for row in rows)
+            drift = sum(((expected_types - self.type_counts) + (self.type_counts - expected_types)).values())
+            drift += sum(((expected_users - self.user_counts) + (self.user_counts - expected_users)).values())
+        self.seed(rows)
+        with self.lock:
+            self.reconciled_at = datetime.now()
+            self.last_drift = drift
+        if drift:
+            print(f"Fleet stats reconciled: corrected {drift} counter(s)")
+        return drift
+
+    def readings_per_second(self):
+        if len(self.rate_samples) < 2:
+            return 0.0
+        elapsed = self.rate_samples[-1][0] - self.rate_samples[0][0]
+        # The first sample only opens the window
+        readings = sum(count for _, count in self.rate_samples) - self.rate_samples[0][1]
+        return readings / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self):
+        """Current fleet statistics"""
+        with self.lock:
+            return {
+                'users': len(self.user_counts),
+                'appliances': len(self.appliances),
+                'by_type': dict(self.type_counts),
+                'appliances_on': self.on_count,
+                'power_by_type': {key: round(value, 2) for key, value in self.power_by_type.items()
+                                  if key in self.type_counts},
+                'total_power': round(sum(self.power_by_type.values()), 2),
+                'readings_per_second': round(self.readings_per_second(), 2),
+                'reconciled_at': self.reconciled_at.isoformat() if self.reconciled_at else None
+            }
@@ -0,0 +1,250 @@
+import itertools
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import TICK_INTERVAL
+from rollup_service import BUCKET_FORMAT, get_watermark
+from tariff_service import CURRENCY_SYMBOLS
+
+# 24-hour consumption forecasts per appliance from the rollup_1h tier. Each
+# appliance has an hour-of-day profile of kWh and a multiplicative
+# day-of-week factor, both exponentially smoothed: every closed hour updates
+# its hour-of-day slot with the day-adjusted reading, and every complete day
+# updates that weekday's factor with the day's total over the profile's.
+# State lives in fixed-width NumPy arrays with one row per appliance, and
+# each closed hour is one vectorized step across the whole fleet. The
+# simulator daemon folds in new hours every hour and writes the forecasts to
+# appliance_forecasts, where web workers read them; a restart (or a gap
+# longer than the fit window) refits from FIT_DAYS of history.
+
+FIT_DAYS = 28
+HORIZON_HOURS = 24
+HOUR_ALPHA = 0.2            # weight of each new reading in its hour-of-day slot
+DAY_ALPHA = 0.3             # weight of each complete day in its weekday factor
+MIN_DAY_FACTOR = 0.05       # floor when adjusting readings by a weekday factor
+INITIAL_ROWS = 256
+
+def floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+class Forecaster:
+    """Smoothed hour-of-day and day-of-week profiles for every appliance"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rows = {}                  # appliance_id -> row in the arrays
+        self.users = {}                 # appliance_id -> user_id
+        self.fitted_until = None        # hours before this have been folded in
+        self._allocate(INITIAL_ROWS)
+        self.last_refresh = None        # (hours folded in, seconds) of the last refresh
+
+    def _allocate(self, capacity):
+        self.hour_kwh = np.zeros((capacity, 24), dtype=np.float64)
+        self.hour_count = np.zeros((capacity, 24), dtype=np.int32)
+        self.day_factor = np.ones((capacity, 7), dtype=np.float64)
+        self.day_count = np.zeros((capacity, 7), dtype=np.int32)
+        self.day_sum = np.zeros(capacity, dtype=np.float64)    # kWh so far in the current day
+        self.day_hours = np.zeros(capacity, dtype=np.int32)    # hours seen so far in the current day
+
+    def _grow(self, needed):
+        capacity = len(self.hour_kwh)
+        if needed <= capacity:
+            return
+        arrays = ('hour_kwh', 'hour_count', 'day_factor', 'day_count', 'day_sum', 'day_hours')
+        old = [getattr(self, name) for name in arrays]
+        self._allocate(max(needed, 2 * capacity))
+        for name, previous in zip(arrays, old):
+            getattr(self, name)[:capacity] = previous
+
+    def _load(self, conn, start, end):
+        """Closed hours in [start, end) as (appliance rows, hour offsets, kWh)"""
+        # Streamed straight into one array: a month of a large fleet is
+        # millions of rows, and per-row Python objects would dominate the fit
+        cursor = conn.execute('''
+            SELECT appliance_id,
+                   CAST(ROUND((julianday(bucket_start) - julianday(?)) * 24) AS INTEGER),
+                   power_sum
+            FROM rollup_1h
+            WHERE bucket_start >= ? AND bucket_start < ?
+        ''', (start.strftime(BUCKET_FORMAT), start.strftime(BUCKET_FORMAT), end.strftime(BUCKET_FORMAT)))
+        data = np.fromiter(itertools.chain.from_iterable(cursor), np.float64).reshape(-1, 3)
+        appliance_ids = data[:, 0].astype(np.int64)
+
+        # Map ids to rows once per distinct appliance, not per reading
+        distinct, inverse = np.unique(appliance_ids, return_inverse=True)
+        distinct = distinct.tolist()
+        new = [appliance_id for appliance_id in distinct if appliance_id not in self.rows]
+        if new:
+            for appliance_id in new:
+                self.rows[appliance_id] = len(self.rows)
+            self._grow(len(self.rows))
+            self.users.update(conn.execute('SELECT id, user_id FROM appliances'))
+        rows = np.array([self.rows[appliance_id] for appliance_id in distinct], dtype=np.int64)[inverse]
+        return rows, data[:, 1].astype(np.int64), data[:, 2] * TICK_INTERVAL / 3600000.0
+
+    def _fold(self, start, hours, rows, offsets, kwh):
+        """Fold `hours` closed hours from `start` into the profiles, one fleet-wide step per hour"""
+        capacity = len(self.hour_kwh)
+        readings = np.full((hours, capacity), np.nan, dtype=np.float32)
+        readings[offsets, rows] = kwh
+
+        for offset in range(hours):
+            moment = start + timedelta(hours=offset)
+            hour, weekday = moment.hour, moment.weekday()
+            values = readings[offset]
+            seen = ~np.isnan(values)
+
+            # Hour-of-day slot: a plain mean while warming up, smoothed afterwards
+            count = self.hour_count[seen, hour]
+            weight = np.maximum(HOUR_ALPHA, 1.0 / (count + 1))
+            adjusted = values[seen] / np.maximum(self.day_factor[seen, weekday], MIN_DAY_FACTOR)
+            self.hour_kwh[seen, hour] += weight * (adjusted - self.hour_kwh[seen, hour])
+            self.hour_count[seen, hour] = count + 1
+            self.day_sum[seen] += values[seen]
+            self.day_hours[seen] += 1
+
+            if hour == 23:
+                # Weekday factor from days observed in full
+                profile = self.hour_kwh.sum(axis=1)
+                complete = (self.day_hours == 24) & (profile > 0)
+                count = self.day_count[complete, weekday]
+                weight = np.maximum(DAY_ALPHA, 1.0 / (count + 1))
+                ratio = self.day_sum[complete] / profile[complete]
+                self.day_factor[complete, weekday] += weight * (ratio - self.day_factor[complete, weekday])
+                self.day_count[complete, weekday] = count + 1
+                self.day_sum[:] = 0
+                self.day_hours[:] = 0
+
+    def forecast(self, start, hours=HORIZON_HOURS):
+        """kWh per appliance row for each of `hours` hours from `start`, shape (appliances, hours)"""
+        moments = [start + timedelta(hours=offset) for offset in range(hours)]
+        hour_index = np.array([moment.hour for moment in moments])
+        day_index = np.array([moment.weekday() for moment in moments])
+        used = len(self.rows)
+        return self.hour_kwh[:used][:, hour_index] * self.day_factor[:used][:, day_index]
+
+    def refresh(self, conn, now=None):
+        """Fold in the hours closed since the last refresh and rewrite the forecasts; returns hours folded"""
+        started = time.perf_counter()
+        watermark = get_watermark(conn)
+        if watermark is None:
+            return 0
+        closed_until = floor_hour(min(now or datetime.now(), watermark))
+
+        with self.lock:
+            full = self.fitted_until is None or closed_until - self.fitted_until > timedelta(days=FIT_DAYS)
+            if full:
+                # Start at midnight so the first day counts towards the weekday factors
+                start = (closed_until - timedelta(days=FIT_DAYS)).replace(hour=0)
+                self.rows, self.users = {}, {}
+                self._allocate(INITIAL_ROWS)
+            else:
+                start = self.fitted_until
+            hours = int((closed_until - start).total_seconds() // 3600)
+            if hours <= 0:
+                return 0
+
+            rows, offsets, kwh = self._load(conn, start, closed_until)
+            self._fold(start, hours, rows, offsets, kwh)
+            self.fitted_until = closed_until
+            forecasts = self.forecast(closed_until)
+            users = dict(self.users)
+            appliance_rows = dict(self.rows)
+
+        generated_at = datetime.now()
+        if full:
+            conn.execute('DELETE FROM appliance_forecasts')
+        conn.executemany('''
+            INSERT INTO appliance_forecasts (appliance_id, user_id, forecast_start, hourly_kwh, generated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (appliance_id) DO UPDATE SET
+                user_id = excluded.user_id,
+                forecast_start = excluded.forecast_start,
+                hourly_kwh = excluded.hourly_kwh,
+                generated_at = excluded.generated_at
+        ''', [
+            (appliance_id, users[appliance_id], closed_until,
+             json.dumps([round(value, 5) for value in forecasts[row].tolist()]), generated_at)
+            for appliance_id, row in appliance_rows.items()
+            if appliance_id in users  # rollups can outlive a deleted appliance
+        ])
+
+        elapsed = time.perf_counter() - started
+        self.last_refresh = (hours, elapsed)
+        if full:
+            print(f"Forecasts refitted for {len(appliance_rows)} appliances from {hours} hours in {elapsed:.2f}s")
+        return hours
+
+    def refresh_db(self, db_path, now=None):
+        conn = sqlite3.connect(db_path, timeout=30)
+        try:
+            hours = self.refresh(conn, now)
+            conn.commit()
+            return hours
+        finally:
+            conn.close()
+
+    def status(self):
+        with self.lock:
+            return {
+                'appliances': len(self.rows),
+                'fitted_until': self.fitted_until.isoformat() if self.fitted_until else None,
+                'last_refresh_hours': self.last_refresh[0] if self.last_refresh else None,
+                'last_refresh_seconds': round(self.last_refresh[1], 3) if self.last_refresh else None
+            }
+
+def user_forecast(conn, user_id, tariff, kwh_to_date):
+    """The user's cached forecast summed over appliances, priced after kwh_to_date
+    units of the current billing period; None before the first refresh"""
+    rows = conn.execute('''
+        SELECT f.appliance_id, a.name, a.type, f.forecast_start, f.hourly_kwh, f.generated_at
+        FROM appliance_forecasts f
+        JOIN appliances a ON a.id = f.appliance_id
+        WHERE f.user_id = ? AND a.is_active = 1
+        ORDER BY f.appliance_id
+    ''', (user_id,)).fetchall()
+    if not rows:
+        return None
+
+    start = max(row['forecast_start'] for row in rows)
+    hourly = np.array([json.loads(row['hourly_kwh']) for row in rows])
+    total = hourly.sum(axis=0)
+    hours = np.array([(start + timedelta(hours=offset)).hour for offset in range(len(total))])
+    # The period's earlier units go first so slab rates continue from them
+    costs = tariff.energy_costs(np.concatenate(([kwh_to_date], total)),
+                                np.concatenate(([0], hours)))[1:]
+
+    return {
+        'forecast_start': start.isoformat(),
+        'generated_at': max(row['generated_at'] for row in rows).isoformat(),
+        'currency': tariff.currency,
+        'currency_symbol': CURRENCY_SYMBOLS.get(tariff.currency, tariff.currency),
+        'total_kwh': round(float(total.sum()), 3),
+        'total_cost': round(float(costs.sum()), 2),
+        'hours': [
+            {'hour': (start + timedelta(hours=offset)).isoformat(),
+             'energy_kwh': round(float(kwh), 4), 'cost': round(float(cost), 2)}
+            for offset, (kwh, cost) in enumerate(zip(total, costs))
+        ],
+        'appliances': [
+            {'appliance_id': row['appliance_id'], 'name': row['name'], 'type': row['type'],
+             'energy_kwh': round(float(kwh), 3)}
+            for row, kwh in zip(rows, hourly.sum(axis=1))
+        ]
+    }
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Refit every appliance forecast')
+    parser.add_argument('--db', default='havoc_ecowatt.db')
+    args = parser.parse_args()
+
+    forecaster = Forecaster()
+    hours = forecaster.refresh_db(args.db)
+    print(f"{hours} hours folded in; {forecaster.status()}")
@@ -0,0 +1,107 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+
+from config import SIMULATOR_SOCKET_PATH
+
+# Newline-delimited JSON over a Unix socket between the simulator daemon and
+# web workers. A client sends one request line, {"cmd": name, ...args}; a
+# command gets one reply line, {"ok": true, "result": ...} or
+# {"ok": false, "error": ...}, and the connection closes. Every exchange is
+# short. Live updates reach web workers through the shared latest-readings
+# table instead: each tick's publish wakes the browsers' long polls.
+
+COMMAND_TIMEOUT = 2.0         # seconds a web worker waits for the daemon
+MAX_REQUEST_BYTES = 65536
+
+class SimulatorUnavailable(Exception):
+    """The simulator daemon is not running or not answering"""
+
+class CommandError(Exception):
+    """The daemon rejected a command"""
+
+class _ChannelHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        channel = self.server.channel
+        try:
+            request = json.loads(self.rfile.readline(MAX_REQUEST_BYTES))
+            command = request.pop('cmd')
+        except (ValueError, KeyError, AttributeError):
+            self.send({'ok': False, 'error': 'Malformed request'})
+            return
+
+        handler = channel.commands.get(command)
+        if handler is None:
+            self.send({'ok': False, 'error': f'Unknown command: {command}'})
+            return
+        try:
+            self.send({'ok': True, 'result': handler(**request)})
+        except (TypeError, ValueError, KeyError) as e:
+            self.send({'ok': False, 'error': str(e)})
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message, default=str).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+class _ChannelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class SimulatorChannel:
+    """Command endpoint hosted by the simulator process"""
+
+    def __init__(self, path=SIMULATOR_SOCKET_PATH):
+        self.path = path
+        self.commands = {}
+        self.server = None
+
+    def register(self, name, handler):
+        self.commands[name] = handler
+
+    def start(self):
+        # A socket file left by a crashed daemon would make bind fail
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = _ChannelServer(self.path, _ChannelHandler)
+        self.server.channel = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def _connect(path, timeout):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except OSError as e:
+        sock.close()
+        raise SimulatorUnavailable(f'Simulator not reachable at {path}: {e}') from e
+    return sock
+
+def send_command(command, path=SIMULATOR_SOCKET_PATH, timeout=COMMAND_TIMEOUT, **args):
+    """Run a command in the simulator daemon and return its result"""
+    sock = _connect(path, timeout)
+    try:
+        sock.sendall(json.dumps({'cmd': command, **args}).encode('utf-8') + b'\n')
+        reply = sock.makefile('rb').readline()
+    except OSError as e:
+        raise SimulatorUnavailable(f'Simulator did not answer: {e}') from e
+    finally:
+        sock.close()
+
+    if not reply:
+        raise SimulatorUnavailable('Simulator closed the connection')
+    reply = json.loads(reply)
+    if not reply['ok']:
+        raise CommandError(reply['error'])
+    return reply['result']
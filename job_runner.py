@@ -0,0 +1,236 @@
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+# Periodic background jobs with a shared schedule in the database. A run is
+# claimed by atomically stamping job_runs.last_started under a lease, so
+# however many processes register the same job it runs once per interval;
+# the others see the fresh stamp and wait for the next slot. Leases and
+# stamps are always wall time. A runner on a simulated clock keeps its
+# jobs' schedule in memory instead, since that timeline is its own, and
+# only takes the lease so a run never overlaps a wall-clock one.
+
+POLL_SECONDS = 1.0
+SLOW_JOB_SECONDS = 1.0  # runs at least this long are logged
+MAX_LEASE_SECONDS = 1800  # default lease: how long a run may take before another process may start one
+
+def _stamp(dt):
+    return dt.isoformat(sep=' ', timespec='seconds')
+
+class Job:
+    def __init__(self, name, interval, func, jitter=0.1, catch_up=True, lease=None, clock=None):
+        self.name = name
+        self.interval = interval    # seconds between runs
+        self.func = func
+        self.jitter = jitter        # up to this share of the interval is added per attempt
+        self.catch_up = catch_up    # after downtime, run once now rather than waiting for the next slot
+        self.lease = lease or min(interval, MAX_LEASE_SECONDS)
+        self.clock = clock          # overrides the runner's clock, e.g. wall time in a simulated run
+        self.next_attempt = None
+        self.last_started = None    # simulated schedule only
+        self.metrics = {'runs': 0, 'failures': 0, 'skipped': 0, 'total_seconds': 0.0,
+                        'last_seconds': None, 'max_seconds': 0.0, 'last_error': None}
+
+class JobRunner:
+    """Runs registered jobs one at a time on a background thread"""
+
+    def __init__(self, db_path, now=None, simulated=None):
+        self.db_path = db_path
+        self.now = now or datetime.now
+        self.simulated = simulated or (lambda: False)  # whether `now` is a simulated clock
+        self.jobs = {}
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.current = None
+
+    def register(self, name, interval, func, **options):
+        self.jobs[name] = Job(name, interval, func, **options)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=30):
+        """Stop taking new runs and wait for the one in progress"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                print(f"Job {self.current} still running at shutdown; its lease will expire")
+            self.thread = None
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            try:
+                self.run_pending()
+            except sqlite3.Error as e:
+                print(f"Job runner error: {e}")
+            self.stop_event.wait(POLL_SECONDS)
+
+    def run_pending(self):
+        """Attempt every job whose next attempt is due; returns how many ran here"""
+        ran = 0
+        for job in list(self.jobs.values()):
+            if self.stop_event.is_set():
+                break
+            now = (job.clock or self.now)()
+            if job.next_attempt is not None and now < job.next_attempt:
+                continue
+            if self._claim(job, now):
+                self._run(job, now)
+                ran += 1
+        return ran
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+
+    def _simulated(self, job):
+        return job.clock is None and self.simulated()
+
+    def _claim(self, job, now):
+        """Take the run for this interval, or schedule the next attempt if it isn't ours"""
+        conn = self._connect()
+        try:
+            conn.execute('INSERT OR IGNORE INTO job_runs (name) VALUES (?)', (job.name,))
+            if self._simulated(job):
+                return self._claim_lease(conn, job, now)
+            last_started = conn.execute('SELECT last_started FROM job_runs WHERE name = ?',
+                                        (job.name,)).fetchone()[0]
+            interval = timedelta(seconds=job.interval)
+            if last_started is not None:
+                last_started = datetime.fromisoformat(last_started)
+                if not job.catch_up and now >= last_started + 2 * interval:
+                    # Missed slots are dropped: move the schedule to now without running
+                    conn.execute('UPDATE job_runs SET last_started = ? WHERE name = ?', (_stamp(now), job.name))
+                    job.metrics['skipped'] += 1
+                    self._schedule(job, now)
+                    return False
+
+            claimed = conn.execute('''
+                UPDATE job_runs SET owner = ?, lease_until = ?, last_started = ?
+                WHERE name = ?
+                  AND (lease_until IS NULL OR lease_until < ?)
+                  AND (last_started IS NULL OR last_started <= ?)
+            ''', (self.owner, _stamp(now + timedelta(seconds=job.lease)), _stamp(now),
+                  job.name, _stamp(now), _stamp(now - interval))).rowcount == 1
+            if not claimed:
+                row = conn.execute('SELECT last_started FROM job_runs WHERE name = ?', (job.name,)).fetchone()
+                self._schedule(job, datetime.fromisoformat(row[0]) if row[0] else now)
+            return claimed
+        finally:
+            conn.close()
+
+    def _claim_lease(self, conn, job, now):
+        """Simulated schedule: due by this runner's own last start, exclusive by the wall-time lease"""
+        interval = timedelta(seconds=job.interval)
+        if not job.catch_up and job.last_started is not None and now >= job.last_started + 2 * interval:
+            job.metrics['skipped'] += 1
+            job.last_started = now
+            self._schedule(job, now)
+            return False
+        wall = datetime.now()
+        claimed = conn.execute('''
+            UPDATE job_runs SET owner = ?, lease_until = ?
+            WHERE name = ? AND (lease_until IS NULL OR lease_until < ?)
+        ''', (self.owner, _stamp(wall + timedelta(seconds=job.lease)), job.name, _stamp(wall))).rowcount == 1
+        if claimed:
+            job.last_started = now
+        return claimed
+
+    def _schedule(self, job, last_started):
+        # Jitter spreads processes (and jobs sharing an interval) apart
+        delay = job.interval * (1 + random.uniform(0, job.jitter))
+        job.next_attempt = last_started + timedelta(seconds=delay)
+
+    def _run(self, job, started_at):
+        self.current = job.name
+        started = time.monotonic()
+        status = 'ok'
+        try:
+            job.func()
+        except Exception as e:
+            status = f'failed: {e}'
+            job.metrics['failures'] += 1
+            job.metrics['last_error'] = str(e)
+            print(f"Job {job.name} failed: {e}")
+        duration = time.monotonic() - started
+        self.current = None
+
+        metrics = job.metrics
+        metrics['runs'] += 1
+        metrics['total_seconds'] += duration
+        metrics['last_seconds'] = duration
+        metrics['max_seconds'] = max(metrics['max_seconds'], duration)
+        if duration >= SLOW_JOB_SECONDS:
+            print(f"Job {job.name} took {duration:.2f}s")
+
+        conn = self._connect()
+        try:
+            conn.execute('''
+                UPDATE job_runs
+                SET lease_until = NULL, last_finished = ?, last_duration = ?, last_status = ?,
+                    run_count = run_count + 1
+                WHERE name = ? AND owner = ?
+            ''', (_stamp(datetime.now()), round(duration, 3), status, job.name, self.owner))
+        finally:
+            conn.close()
+        self._schedule(job, started_at)
+
+    def metrics(self):
+        """Per-job run counts and durations in this process"""
+        return {
+            name: {
+                'interval': job.interval,
+                'runs': job.metrics['runs'],
+                'failures': job.metrics['failures'],
+                'skipped': job.metrics['skipped'],
+                'last_seconds': round(job.metrics['last_seconds'], 3) if job.metrics['last_seconds'] is not None else None,
+                'avg_seconds': round(job.metrics['total_seconds'] / job.metrics['runs'], 3) if job.metrics['runs'] else None,
+                'max_seconds': round(job.metrics['max_seconds'], 3),
+                'last_error': job.metrics['last_error'],
+                'next_attempt': job.next_attempt.isoformat() if job.next_attempt else None,
+                'running': self.current == name
+            }
+            for name, job in self.jobs.items()
+        }
+
+def _run_range(db_path, func, low_id, high_id, now, options):
+    """Process-pool worker: one id range per transaction"""
+    conn = sqlite3.connect(db_path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    try:
+        results = func(conn, low_id, high_id, now, **options)
+        conn.commit()
+        return len(results)
+    finally:
+        conn.close()
+
+def run_in_chunks(db_path, func, ids, chunk_size, now, workers=None, **options):
+    """Batch jobs: call func(conn, low_id, high_id, now, **options) on contiguous
+    ranges of the sorted ids across a process pool; returns the total results.
+
+    func must be a module-level function so it can be sent to the workers.
+    """
+    chunks = [(ids[i], ids[min(i + chunk_size, len(ids)) - 1])
+              for i in range(0, len(ids), chunk_size)]
+    total = 0
+    if chunks:
+        # Spawned workers: the simulator daemon runs batches from its job thread,
+        # and forking a process with other threads running can deadlock the child
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(_run_range, db_path, func, low, high, now, options)
+                       for low, high in chunks]
+            for future in futures:
+                total += future.result()
+    return total
@@ -0,0 +1,174 @@
+import hashlib
+import math
+import mmap
+import os
+import struct
+import time
+from datetime import datetime, timedelta
+
+from config import LATEST_READINGS_PATH, TICK_INTERVAL
+
+# Fixed-layout table of the latest reading per appliance, shared through a
+# memory-mapped file. Appliance ids are dense autoincrement integers, so the
+# slot for an appliance is simply its id. Each slot is guarded by a seqlock:
+# the writer makes the sequence odd while it updates a slot and even again
+# afterwards, and readers retry until they see the same even value on both
+# sides of their read. The header also carries a publish counter, the
+# wall-clock time of the last publish, so readers can tell a table left
+# behind by a stopped simulator from a live one, and the simulator's own
+# (possibly virtual) time at that publish.
+TABLE_MAGIC = b'EWLR'
+TABLE_VERSION = 3
+HEADER = struct.Struct('<4sHxxI')           # magic, version, capacity
+PUBLISHED = struct.Struct('<Qdd')           # publish counter, wall-clock and simulated seconds of the last publish
+PUBLISHED_OFFSET = 16
+SLOTS_OFFSET = 48
+SEQ = struct.Struct('<I')
+SLOT_DATA = struct.Struct('<IIBxxxddd')     # appliance_id, user_id, is_on, temperature, power, timestamp
+SLOT_SIZE = SEQ.size + SLOT_DATA.size
+INITIAL_CAPACITY = 1024
+MAX_READ_RETRIES = 100
+
+# A table not published to for this many wall-clock seconds is stale
+MAX_PUBLISH_AGE = 3 * TICK_INTERVAL
+
+EPOCH = datetime(2000, 1, 1)
+
+def table_path(db_path, base=LATEST_READINGS_PATH):
+    """Shared table path for a database, so simulators on different databases don't collide"""
+    digest = hashlib.sha1(os.path.abspath(db_path).encode()).hexdigest()[:12]
+    return f'{base}-{digest}'
+
+class LatestReadingsTable:
+    """Latest is_on/temperature/power/timestamp per appliance in shared memory"""
+
+    def __init__(self, path):
+        self.path = path
+        self.mapped = None
+        self.capacity = 0
+
+    def _map(self, create=False):
+        """(Re)map the file at its current size; returns False if it doesn't exist"""
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+        if create:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if (os.fstat(fd).st_size < SLOTS_OFFSET
+                    or HEADER.unpack(os.pread(fd, HEADER.size, 0))[:2] != (TABLE_MAGIC, TABLE_VERSION)):
+                # New file, or one left by an older layout: start afresh
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, SLOTS_OFFSET + INITIAL_CAPACITY * SLOT_SIZE)
+                os.pwrite(fd, HEADER.pack(TABLE_MAGIC, TABLE_VERSION, INITIAL_CAPACITY), 0)
+        else:
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except OSError:
+                return False
+
+        try:
+            access = mmap.ACCESS_WRITE if create else mmap.ACCESS_READ
+            self.mapped = mmap.mmap(fd, 0, access=access)
+        finally:
+            os.close(fd)
+
+        magic, version, capacity = HEADER.unpack_from(self.mapped, 0)
+        if magic != TABLE_MAGIC or version != TABLE_VERSION:
+            self.mapped.close()
+            self.mapped = None
+            return False
+        self.capacity = capacity
+        return True
+
+    def _grow(self, min_capacity):
+        """Extend the file so slot `min_capacity - 1` exists (writer only)"""
+        capacity = max(self.capacity * 2, min_capacity)
+        with open(self.path, 'r+b') as f:
+            f.truncate(SLOTS_OFFSET + capacity * SLOT_SIZE)
+        self._map(create=True)
+        HEADER.pack_into(self.mapped, 0, TABLE_MAGIC, TABLE_VERSION, capacity)
+        self.capacity = capacity
+
+    def publish(self, data_list):
+        """Write the latest reading for each appliance in data_list"""
+        if self.mapped is None:
+            self._map(create=True)
+
+        highest = max((data['appliance_id'] for data in data_list), default=0)
+        if highest >= self.capacity:
+            self._grow(highest + 1)
+
+        mapped = self.mapped
+        for data in data_list:
+            offset = SLOTS_OFFSET + data['appliance_id'] * SLOT_SIZE
+            seq = SEQ.unpack_from(mapped, offset)[0]
+            SEQ.pack_into(mapped, offset, (seq + 1) & 0xFFFFFFFF)
+            temperature = data['temperature']
+            SLOT_DATA.pack_into(
+                mapped, offset + SEQ.size,
+                data['appliance_id'], data['user_id'], 1 if data['is_on'] else 0,
+                math.nan if temperature is None else temperature,
+                data['power_consumption'],
+                (data['timestamp'] - EPOCH).total_seconds()
+            )
+            SEQ.pack_into(mapped, offset, (seq + 2) & 0xFFFFFFFF)
+
+        count, _, simulated = PUBLISHED.unpack_from(mapped, PUBLISHED_OFFSET)
+        if data_list:
+            simulated = (max(data['timestamp'] for data in data_list) - EPOCH).total_seconds()
+        PUBLISHED.pack_into(mapped, PUBLISHED_OFFSET, count + 1, time.time(), simulated)
+
+    def publish_count(self):
+        """Number of publishes so far, or None without a table"""
+        if self.mapped is None and not self._map():
+            return None
+        return PUBLISHED.unpack_from(self.mapped, PUBLISHED_OFFSET)[0]
+
+    def simulated_now(self):
+        """The simulator's time at its last publish, or None without a live table"""
+        if not self.available():
+            return None
+        return EPOCH + timedelta(seconds=PUBLISHED.unpack_from(self.mapped, PUBLISHED_OFFSET)[2])
+
+    def available(self):
+        """Whether a live simulator is publishing the table (readers fall back to SQL otherwise)"""
+        if self.mapped is None and not self._map():
+            return False
+        published_at = PUBLISHED.unpack_from(self.mapped, PUBLISHED_OFFSET)[1]
+        return time.time() - published_at <= MAX_PUBLISH_AGE
+
+    def get(self, appliance_id):
+        """Consistent latest reading for an appliance, or None if never published"""
+        if not self.available():
+            return None
+        if appliance_id >= self.capacity:
+            # The writer may have grown the table since we mapped it
+            if HEADER.unpack_from(self.mapped, 0)[2] > self.capacity:
+                self._map()
+            if appliance_id >= self.capacity:
+                return None
+
+        mapped = self.mapped
+        offset = SLOTS_OFFSET + appliance_id * SLOT_SIZE
+        for _ in range(MAX_READ_RETRIES):
+            before = SEQ.unpack_from(mapped, offset)[0]
+            if before & 1:
+                continue
+            slot = SLOT_DATA.unpack_from(mapped, offset + SEQ.size)
+            if SEQ.unpack_from(mapped, offset)[0] == before:
+                break
+        else:
+            return None
+
+        stored_id, user_id, is_on, temperature, power, timestamp = slot
+        if stored_id != appliance_id:
+            return None
+        return {
+            'appliance_id': stored_id,
+            'user_id': user_id,
+            'is_on': bool(is_on),
+            'temperature': None if math.isnan(temperature) else temperature,
+            'power_consumption': power,
+            'timestamp': EPOCH + timedelta(seconds=timestamp)
+        }
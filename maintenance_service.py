@@ -0,0 +1,240 @@
+import os
+import sqlite3
+import time
+from collections import deque
+from datetime import datetime
+
+# Maintenance runs in the gap after each simulator tick. The window it may
+# use is a share of the measured idle time between ticks, so it backs off
+# as ticks get heavier; every task works in small steps and stops at the
+# window's deadline, picking up where it left off after the next tick.
+# Finding stale tables and the periodic report are jobs on the simulator's
+# job runner, every ANALYZE_CHECK_INTERVAL and REPORT_INTERVAL seconds. A
+# busy simulator may leave no window big enough for ANALYZE, so once stale
+# tables have waited ANALYZE_STARVATION_CHECKS checks, one is analyzed
+# after the next tick regardless of the window.
+
+IDLE_FRACTION = 0.25        # share of the idle time between ticks maintenance may use
+MIN_WINDOW_SECONDS = 0.02   # window when ticks leave no idle time (passive checkpoints only)
+MAX_WINDOW_SECONDS = 2.0
+VACUUM_STEP_PAGES = 128     # free pages released per incremental_vacuum step
+ANALYZE_CHECK_INTERVAL = 300
+ANALYZE_DRIFT = 0.25        # row-count change since the last ANALYZE that makes stats stale
+ANALYZE_MIN_ROWS = 1000
+ANALYSIS_LIMIT = 1000       # rows sampled per index by ANALYZE
+ANALYZE_STARVATION_CHECKS = 3  # checks a stale queue may go unserved before one ANALYZE is forced
+WAL_CHECKPOINT_BYTES = 4 * 1024 * 1024
+WAL_TRUNCATE_BYTES = 64 * 1024 * 1024
+REPORT_INTERVAL = 3600
+
+TASKS = ('checkpoint', 'vacuum', 'analyze')
+
+class MaintenanceScheduler:
+    """Statistics, free-page and WAL upkeep fitted between simulator ticks"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.samples = deque(maxlen=30)   # (tick work, tick period) in wall seconds
+        self.last_tick = None
+        self.auto_vacuum = None
+        self.stale_tables = []
+        self.starved_checks = 0           # consecutive checks that found the previous queue unserved
+        self.forced_analyzes = 0
+        self.wal_position = (0, 0)        # (frames in WAL, frames checkpointed) after the last checkpoint
+        self.totals = {task: {'runs': 0, 'seconds': 0.0, 'pages': 0} for task in TASKS}
+        self.reported = {task: dict(values) for task, values in self.totals.items()}
+
+    def prepare(self, conn):
+        """Switch the database to WAL and check whether incremental vacuum is possible"""
+        conn.execute('PRAGMA journal_mode = WAL')
+        self.auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if self.auto_vacuum != 2:
+            print("Incremental vacuum unavailable (auto_vacuum is off); stop the simulator and run "
+                  "'python maintenance_service.py --enable-incremental-vacuum' once to convert the file")
+
+    def check_statistics(self, conn=None):
+        """Queue tables with stale statistics for ANALYZE in the next windows"""
+        own = conn is None
+        conn = conn or sqlite3.connect(self.db_path, timeout=5)
+        try:
+            stale = self.find_stale_tables(conn)
+        finally:
+            if own:
+                conn.close()
+        self.starved_checks = self.starved_checks + 1 if stale and self.stale_tables else 0
+        self.stale_tables = stale
+        return len(self.stale_tables)
+
+    def window(self):
+        """Seconds of maintenance the current tick load allows"""
+        if not self.samples:
+            return MIN_WINDOW_SECONDS
+        work = sum(sample[0] for sample in self.samples) / len(self.samples)
+        period = sum(sample[1] for sample in self.samples) / len(self.samples)
+        idle = max(0.0, period - work)
+        return min(MAX_WINDOW_SECONDS, max(MIN_WINDOW_SECONDS, idle * IDLE_FRACTION))
+
+    def after_tick(self, tick_started):
+        """Run whatever maintenance fits after a tick that began at tick_started (monotonic)"""
+        now = time.monotonic()
+        if self.last_tick is not None:
+            self.samples.append((now - tick_started, tick_started - self.last_tick))
+        self.last_tick = tick_started
+        deadline = now + self.window()
+
+        # A short busy timeout: if web workers hold the database, try next tick
+        conn = sqlite3.connect(self.db_path, timeout=0.1, isolation_level=None)
+        try:
+            self.checkpoint(conn, deadline)
+            self.vacuum(conn, deadline)
+            self.analyze(conn, deadline)
+        except sqlite3.OperationalError as e:
+            print(f"Maintenance deferred: {e}")
+        finally:
+            conn.close()
+
+    def _record(self, task, started, pages=0):
+        totals = self.totals[task]
+        totals['runs'] += 1
+        totals['seconds'] += time.monotonic() - started
+        totals['pages'] += pages
+
+    def checkpoint(self, conn, deadline):
+        """Passive WAL checkpoint once the log has grown; truncate a large log when there is time"""
+        try:
+            wal_bytes = os.path.getsize(self.db_path + '-wal')
+        except OSError:
+            return
+        if wal_bytes < WAL_CHECKPOINT_BYTES:
+            return
+
+        started = time.monotonic()
+        # TRUNCATE waits for readers, so it only runs with most of the window left
+        truncate = wal_bytes >= WAL_TRUNCATE_BYTES and deadline - started >= MAX_WINDOW_SECONDS / 2
+        busy, log_frames, done = conn.execute(
+            f"PRAGMA wal_checkpoint({'TRUNCATE' if truncate else 'PASSIVE'})").fetchone()
+        previous_log, previous_done = self.wal_position
+        if log_frames < previous_log:
+            previous_done = 0  # the WAL restarted from its first frame since the last checkpoint
+        copied = max(0, done - previous_done)
+        self.wal_position = (0, 0) if truncate and not busy else (log_frames, done)
+        self._record('checkpoint', started, copied)
+
+    def vacuum(self, conn, deadline):
+        """Release free pages to the filesystem in VACUUM_STEP_PAGES steps"""
+        if self.auto_vacuum != 2:
+            return
+        while time.monotonic() < deadline:
+            free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                return
+            started = time.monotonic()
+            # executescript steps the pragma to completion; execute frees one page
+            conn.executescript(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})')
+            reclaimed = free - conn.execute('PRAGMA freelist_count').fetchone()[0]
+            self._record('vacuum', started, reclaimed)
+
+    def find_stale_tables(self, conn):
+        """Tables whose row count has drifted since they were last analyzed"""
+        analyzed = dict(conn.execute('SELECT table_name, analyzed_rows FROM maintenance_state'))
+        stale = []
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        for table in tables:
+            rows = self.estimate_rows(conn, table)
+            if table not in analyzed:
+                if rows >= ANALYZE_MIN_ROWS:
+                    stale.append((table, rows))
+            elif abs(rows - analyzed[table]) > ANALYZE_DRIFT * max(analyzed[table], ANALYZE_MIN_ROWS):
+                stale.append((table, rows))
+        return stale
+
+    @staticmethod
+    def estimate_rows(conn, table):
+        # Rows are appended and expire oldest first, so the rowid span
+        # tracks the row count at the cost of two index probes
+        low, high = conn.execute(f'SELECT MIN(rowid), MAX(rowid) FROM "{table}"').fetchone()
+        return high - low + 1 if high is not None else 0
+
+    def analyze(self, conn, deadline):
+        """ANALYZE stale tables one at a time, then let PRAGMA optimize finish up"""
+        forced = self.starved_checks >= ANALYZE_STARVATION_CHECKS
+        if not self.stale_tables or (not forced and deadline - time.monotonic() < MIN_WINDOW_SECONDS):
+            return
+
+        # Sampled statistics keep ANALYZE of a large table within a window;
+        # the row estimate at analysis time is the baseline for drift
+        conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+        while self.stale_tables and (forced or time.monotonic() < deadline):
+            if forced:
+                forced = False
+                self.starved_checks = 0
+                self.forced_analyzes += 1
+            table, rows = self.stale_tables.pop()
+            started = time.monotonic()
+            conn.execute(f'ANALYZE "{table}"')
+            conn.execute('''
+                INSERT INTO maintenance_state (table_name, analyzed_rows, analyzed_at) VALUES (?, ?, ?)
+                ON CONFLICT (table_name) DO UPDATE SET
+                    analyzed_rows = excluded.analyzed_rows,
+                    analyzed_at = excluded.analyzed_at
+            ''', (table, rows, datetime.now().isoformat(sep=' ', timespec='seconds')))
+            self._record('analyze', started)
+        if not self.stale_tables:
+            conn.execute('PRAGMA optimize')
+
+    def report(self):
+        """Totals per task since start, plus the current window"""
+        return {
+            'window_seconds': round(self.window(), 3),
+            'incremental_vacuum': self.auto_vacuum == 2,
+            'stale_tables': len(self.stale_tables),
+            'forced_analyzes': self.forced_analyzes,
+            'tasks': {task: {'runs': totals['runs'], 'seconds': round(totals['seconds'], 3),
+                             'pages': totals['pages']}
+                      for task, totals in self.totals.items()}
+        }
+
+    def print_report(self):
+        delta = {task: {key: self.totals[task][key] - self.reported[task][key] for key in self.totals[task]}
+                 for task in TASKS}
+        self.reported = {task: dict(values) for task, values in self.totals.items()}
+        print(f"DB maintenance: analyzed {delta['analyze']['runs']} table(s) in {delta['analyze']['seconds']:.2f}s, "
+              f"reclaimed {delta['vacuum']['pages']} page(s) in {delta['vacuum']['seconds']:.2f}s, "
+              f"checkpointed {delta['checkpoint']['pages']} WAL page(s) in {delta['checkpoint']['seconds']:.2f}s "
+              f"(window {self.window():.3f}s)")
+
+def enable_incremental_vacuum(db_path):
+    """One-off full VACUUM that switches an existing file to auto_vacuum=INCREMENTAL"""
+    before = os.path.getsize(db_path)
+    started = time.monotonic()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+    finally:
+        conn.close()
+    print(f"auto_vacuum={mode}; {before} -> {os.path.getsize(db_path)} bytes in {time.monotonic() - started:.1f}s")
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Database maintenance')
+    parser.add_argument('--db', default='havoc_ecowatt.db')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help='Rewrite the file with auto_vacuum=INCREMENTAL (stop the simulator first)')
+    args = parser.parse_args()
+
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum(args.db)
+    else:
+        # One unhurried pass, e.g. from cron while the simulator is stopped
+        scheduler = MaintenanceScheduler(args.db)
+        conn = sqlite3.connect(args.db)
+        scheduler.prepare(conn)
+        conn.close()
+        scheduler.check_statistics()
+        scheduler.samples.append((0.0, MAX_WINDOW_SECONDS / IDLE_FRACTION))
+        scheduler.after_tick(time.monotonic())
+        scheduler.print_report()
@@ -0,0 +1,650 @@
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Ordered schema migrations. Each runs exactly once per database and is
+# recorded in schema_version; append new entries, never edit applied ones.
+# Databases created before schema_version existed replay them all, so every
+# step must tolerate tables and columns that are already there. The DDL is
+# written out here rather than taken from the services, so a later change
+# to a service can't alter what an old migration does.
+
+# Columns older users tables may lack
+USER_COLUMNS = [
+    ('first_name', 'VARCHAR(50)'),
+    ('last_name', 'VARCHAR(50)'),
+    ('phone', 'VARCHAR(20)'),
+    ('address', 'TEXT'),
+    ('city', 'VARCHAR(50)'),
+    ('state', 'VARCHAR(50)'),
+    ('zip_code', 'VARCHAR(10)'),
+    ('is_verified', 'BOOLEAN DEFAULT 0'),
+    ('is_active', 'BOOLEAN DEFAULT 1'),
+    ('failed_login_attempts', 'INTEGER DEFAULT 0'),
+    ('locked_until', 'DATETIME'),
+    ('last_login', 'DATETIME')
+]
+
+USER_PREFERENCES_COLUMNS = '''
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL UNIQUE,
+    theme VARCHAR(10) DEFAULT 'light',
+    notifications_enabled BOOLEAN DEFAULT 1,
+    email_notifications BOOLEAN DEFAULT 1,
+    energy_goal REAL DEFAULT 1000.0,
+    cost_goal REAL DEFAULT 5000.0,
+    carbon_goal REAL DEFAULT 500.0,
+    currency VARCHAR(10) DEFAULT 'INR',
+    timezone VARCHAR(50) DEFAULT 'Asia/Kolkata',
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+'''
+
+def base_schema(cursor):
+    """Users, preferences, appliances, readings, sessions and tokens"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(50) UNIQUE NOT NULL,
+            email VARCHAR(100) UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            first_name VARCHAR(50),
+            last_name VARCHAR(50),
+            phone VARCHAR(20),
+            address TEXT,
+            city VARCHAR(50),
+            state VARCHAR(50),
+            zip_code VARCHAR(10),
+            is_verified BOOLEAN DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            failed_login_attempts INTEGER DEFAULT 0,
+            locked_until DATETIME,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            last_login DATETIME
+        )
+    ''')
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(users)')}
+    for col_name, col_type in USER_COLUMNS:
+        if col_name not in columns:
+            cursor.execute(f'ALTER TABLE users ADD COLUMN {col_name} {col_type}')
+            print(f"Added column {col_name} to users table")
+
+    cursor.execute(f'CREATE TABLE IF NOT EXISTS user_preferences ({USER_PREFERENCES_COLUMNS})')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS appliances (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            type VARCHAR(50) NOT NULL,
+            power_rating REAL DEFAULT 0,
+            is_active BOOLEAN DEFAULT 1,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS appliance_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            appliance_id INTEGER NOT NULL,
+            is_on BOOLEAN DEFAULT 0,
+            power_consumption REAL DEFAULT 0,
+            temperature REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (appliance_id) REFERENCES appliances (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            session_token TEXT UNIQUE NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            expires_at DATETIME NOT NULL,
+            is_active BOOLEAN DEFAULT 1,
+            ip_address TEXT,
+            user_agent TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    for table in ('password_reset_tokens', 'email_verification_tokens'):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                token TEXT UNIQUE NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                expires_at DATETIME NOT NULL,
+                used BOOLEAN DEFAULT 0,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appliance_data_user_id ON appliance_data (user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appliance_data_timestamp ON appliance_data (timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appliance_data_appliance_time ON appliance_data (appliance_id, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_token ON user_sessions (session_token)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON user_sessions (expires_at)')
+
+# Tariffs seeded by migration 2; migration 10 moves effective_from to the
+# 'T' format and adds the other currencies' defaults
+SEED_TARIFFS = [
+    ('flat_inr', 'INR', '{"fixed_charge": 0, "slabs": [[null, 5.8]], "tou": []}'),
+    ('domestic_tou_inr', 'INR',
+     '{"fixed_charge": 50, "slabs": [[100, 3.0], [300, 4.5], [500, 6.5], [null, 8.0]], '
+     '"tou": [{"hours": [18, 19, 20, 21], "multiplier": 1.2}, '
+     '{"hours": [22, 23, 0, 1, 2, 3, 4, 5], "multiplier": 0.9}]}')
+]
+
+def service_tables(cursor):
+    """Rollups, change tracking, tariffs, schedules and reports"""
+    for table in ('rollup_1d', 'rollup_1h', 'rollup_1m'):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                appliance_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                bucket_start TEXT NOT NULL,
+                sample_count INTEGER NOT NULL,
+                power_sum REAL NOT NULL,
+                power_min REAL,
+                power_max REAL,
+                on_count INTEGER NOT NULL,
+                PRIMARY KEY (appliance_id, bucket_start)
+            )
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_user ON {table} (user_id, bucket_start)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_data_generations (
+            user_id INTEGER PRIMARY KEY,
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            value INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO change_generation (id, value) VALUES (1, 0)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS appliance_changes (
+            appliance_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            config_generation INTEGER NOT NULL DEFAULT 0,
+            reading_generation INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (appliance_id) REFERENCES appliances (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appliance_changes_config ON appliance_changes (config_generation)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appliance_changes_user ON appliance_changes (user_id)')
+    # Appliances that predate the log start at generation 0
+    cursor.execute('''
+        INSERT OR IGNORE INTO appliance_changes (appliance_id, user_id)
+        SELECT id, user_id FROM appliances
+    ''')
+    for event in ('INSERT', 'UPDATE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS appliances_change_{event.lower()}
+            AFTER {event} ON appliances
+            BEGIN
+                UPDATE change_generation SET value = value + 1 WHERE id = 1;
+                INSERT INTO appliance_changes (appliance_id, user_id, config_generation)
+                VALUES (NEW.id, NEW.user_id, (SELECT value FROM change_generation WHERE id = 1))
+                ON CONFLICT (appliance_id) DO UPDATE SET
+                    user_id = excluded.user_id,
+                    config_generation = excluded.config_generation;
+            END
+        ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tariffs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(50) NOT NULL,
+            version INTEGER NOT NULL,
+            currency VARCHAR(10) NOT NULL DEFAULT 'INR',
+            definition TEXT NOT NULL,
+            effective_from DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(name, version)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_tariffs (
+            user_id INTEGER PRIMARY KEY,
+            tariff_name VARCHAR(50) NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.executemany('''
+        INSERT OR IGNORE INTO tariffs (name, version, currency, definition, effective_from)
+        VALUES (?, 1, ?, ?, '2000-01-01 00:00:00')
+    ''', SEED_TARIFFS)
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS appliance_schedules (
+            appliance_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            duration_minutes INTEGER,
+            earliest_start VARCHAR(5),
+            deadline VARCHAR(5),
+            scheduled_start DATETIME,
+            scheduled_end DATETIME,
+            estimated_cost REAL,
+            estimated_savings REAL,
+            peak_exceeded BOOLEAN DEFAULT 0,
+            solved_at DATETIME,
+            FOREIGN KEY (appliance_id) REFERENCES appliances (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appliance_schedules_user ON appliance_schedules (user_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduling_settings (
+            user_id INTEGER PRIMARY KEY,
+            peak_power_w REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+    # One report per user and billing period; report_date doubles as the
+    # batch checkpoint for resumed runs
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_reports (
+            user_id INTEGER NOT NULL,
+            period_start DATETIME NOT NULL,
+            report_date DATE NOT NULL,
+            report TEXT NOT NULL,
+            generated_at DATETIME NOT NULL,
+            PRIMARY KEY (user_id, period_start),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_reports_date ON user_reports (report_date)')
+
+def unify_legacy_schema(cursor):
+    """One user_preferences row per user, and one meaning per index name"""
+    # Rebuild user_preferences with the canonical definition, keeping each
+    # user's most recent row and giving users without one the defaults
+    cursor.execute('ALTER TABLE user_preferences RENAME TO user_preferences_legacy')
+    cursor.execute(f'CREATE TABLE user_preferences ({USER_PREFERENCES_COLUMNS})')
+    canonical = {row[1] for row in cursor.execute('PRAGMA table_info(user_preferences)')}
+    legacy = [row[1] for row in cursor.execute('PRAGMA table_info(user_preferences_legacy)')]
+    shared = ', '.join(column for column in legacy if column in canonical and column != 'id')
+    cursor.execute(f'''
+        INSERT INTO user_preferences ({shared})
+        SELECT {shared} FROM user_preferences_legacy
+        WHERE id IN (SELECT MAX(id) FROM user_preferences_legacy GROUP BY user_id)
+    ''')
+    cursor.execute('DROP TABLE user_preferences_legacy')
+    cursor.execute('''
+        INSERT INTO user_preferences (user_id)
+        SELECT id FROM users
+        WHERE id NOT IN (SELECT user_id FROM user_preferences)
+    ''')
+
+    # The simulator used to create idx_appliance_data_timestamp on
+    # (appliance_id, timestamp); whichever process started first won
+    index = cursor.execute('''
+        SELECT sql FROM sqlite_master
+        WHERE type = 'index' AND name = 'idx_appliance_data_timestamp'
+    ''').fetchone()
+    if index is not None and 'appliance_id' in index[0]:
+        cursor.execute('DROP INDEX idx_appliance_data_timestamp')
+        cursor.execute('CREATE INDEX idx_appliance_data_timestamp ON appliance_data (timestamp)')
+
+def maintenance_state(cursor):
+    """Per-table ANALYZE bookkeeping"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS maintenance_state (
+            table_name TEXT PRIMARY KEY,
+            analyzed_rows INTEGER NOT NULL,
+            analyzed_at DATETIME NOT NULL
+        )
+    ''')
+
+def job_schedule(cursor):
+    """Shared job schedule and leases"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_runs (
+            name TEXT PRIMARY KEY,
+            owner TEXT,
+            lease_until DATETIME,
+            last_started DATETIME,
+            last_finished DATETIME,
+            last_duration REAL,
+            last_status TEXT,
+            run_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+def reading_archive_catalog(cursor):
+    """Catalog of archived daily reading files"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reading_archives (
+            day TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            min_user_id INTEGER,
+            max_user_id INTEGER,
+            min_timestamp TEXT,
+            max_timestamp TEXT,
+            archived_at DATETIME
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reading_archives_time ON reading_archives (max_timestamp, min_timestamp)')
+
+def anomalies(cursor):
+    """Flagged unusual readings"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS anomalies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            appliance_id INTEGER NOT NULL,
+            timestamp DATETIME NOT NULL,
+            power_consumption REAL NOT NULL,
+            expected_power REAL NOT NULL,
+            std_dev REAL NOT NULL,
+            z_score REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (appliance_id) REFERENCES appliances (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_anomalies_user_time ON anomalies (user_id, timestamp)')
+
+def appliance_forecasts(cursor):
+    """Cached 24-hour forecasts per appliance"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS appliance_forecasts (
+            appliance_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            forecast_start DATETIME NOT NULL,
+            hourly_kwh TEXT NOT NULL,
+            generated_at DATETIME NOT NULL,
+            FOREIGN KEY (appliance_id) REFERENCES appliances (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_appliance_forecasts_user ON appliance_forecasts (user_id)')
+
+# Rollup layout as of the backfill migration, so later changes to
+# rollup_service can't change what it writes
+BACKFILL_TIERS = [('rollup_1m', 60), ('rollup_1h', 3600), ('rollup_1d', 86400)]
+BACKFILL_EPOCH = datetime(2000, 1, 1)
+BACKFILL_FORMAT = '%Y-%m-%d %H:%M:%S'
+BACKFILL_TICK = 10
+BACKFILL_HEARTBEAT = 300
+BACKFILL_CHUNK_ROWS = 50000  # readings folded in per transaction
+
+def _backfill_until(cursor):
+    """First minute the rollups were fed live, or None before the first flush"""
+    first_minute = cursor.execute('SELECT MIN(bucket_start) FROM rollup_1m').fetchone()[0]
+    first_hour = cursor.execute('SELECT MIN(bucket_start) FROM rollup_1h').fetchone()[0]
+    if first_hour is None:
+        return None
+    first_hour = datetime.strptime(first_hour, BACKFILL_FORMAT)
+    if first_minute is not None:
+        first_minute = datetime.strptime(first_minute, BACKFILL_FORMAT)
+        # Within the first hour means rollup_1m hasn't been pruned past it
+        if first_minute - first_hour < timedelta(hours=1):
+            return first_minute
+    return first_hour
+
+def backfill_rollups(cursor):
+    """Schedule building the rollup tiers from raw readings stored before they were fed live.
+
+    The migration only records the cut-off; run_backfill then works through
+    the readings in bounded chunks, one transaction each, so startup isn't
+    held up and an interrupted backfill resumes where it stopped.
+    """
+    until = _backfill_until(cursor)
+    seed_watermark = until is None
+    if seed_watermark:
+        # Nothing flushed yet: cover everything so far and start the watermark there
+        until = datetime.now().replace(second=0, microsecond=0)
+    if cursor.execute('SELECT 1 FROM appliance_data WHERE timestamp < ? LIMIT 1',
+                      (until.isoformat(),)).fetchone() is None:
+        return
+    if seed_watermark:
+        cursor.execute("INSERT OR IGNORE INTO rollup_state (name, value) VALUES ('watermark', ?)",
+                       (until.strftime(BACKFILL_FORMAT),))
+    cursor.execute("INSERT OR REPLACE INTO rollup_state (name, value) VALUES ('backfill_until', ?)",
+                   (until.strftime(BACKFILL_FORMAT),))
+    print(f"Scheduled rollup backfill of readings before {until:%Y-%m-%d %H:%M}")
+
+def run_backfill(db_path, chunk_rows=BACKFILL_CHUNK_ROWS):
+    """Work through a scheduled rollup backfill, one chunk per transaction; returns readings processed"""
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    processed = 0
+    try:
+        while True:
+            # The chunk re-reads its position under the write lock, so
+            # concurrent runners never fold the same readings in twice
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows, done = _backfill_chunk(conn.cursor(), chunk_rows)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            processed += rows
+            if done:
+                break
+    finally:
+        conn.close()
+    if processed:
+        print(f"Backfilled rollups from {processed} readings")
+    return processed
+
+def _backfill_chunk(cursor, chunk_rows):
+    """Fold the next chunk_rows readings into the rollups and advance the position; returns (rows, done)"""
+    state = dict(cursor.execute(
+        "SELECT name, value FROM rollup_state WHERE name IN ('backfill_until', 'backfill_after')"))
+    if 'backfill_until' not in state:
+        return 0, True
+    until = datetime.strptime(state['backfill_until'], BACKFILL_FORMAT)
+
+    # Keyset pages in (appliance, time, id) order; one row past the page
+    # tells where the page's last span ends
+    columns = 'SELECT id, appliance_id, user_id, is_on, power_consumption, timestamp FROM appliance_data'
+    if 'backfill_after' in state:
+        rows = cursor.execute(f'''
+            {columns}
+            WHERE (appliance_id, timestamp, id) > (?, ?, ?) AND timestamp < ?
+            ORDER BY appliance_id, timestamp, id
+            LIMIT ?
+        ''', (*json.loads(state['backfill_after']), until.isoformat(), chunk_rows + 1)).fetchall()
+    else:
+        rows = cursor.execute(f'''
+            {columns}
+            WHERE timestamp < ?
+            ORDER BY appliance_id, timestamp, id
+            LIMIT ?
+        ''', (until.isoformat(), chunk_rows + 1)).fetchall()
+
+    page, lookahead = rows[:chunk_rows], rows[chunk_rows] if len(rows) > chunk_rows else None
+    if page:
+        _backfill_page(cursor, page, lookahead, until)
+    if lookahead is None:
+        cursor.execute("DELETE FROM rollup_state WHERE name IN ('backfill_until', 'backfill_after')")
+        return len(page), True
+    last = page[-1]
+    cursor.execute("INSERT OR REPLACE INTO rollup_state (name, value) VALUES ('backfill_after', ?)",
+                   (json.dumps([last[1], str(last[5]), last[0]]),))
+    return len(page), False
+
+def _backfill_page(cursor, rows, lookahead, until):
+    """Add one page of (id, appliance_id, user_id, is_on, power, timestamp) rows to every tier"""
+    appliance = np.array([row[1] for row in rows], dtype=np.int64)
+    user = np.array([row[2] for row in rows], dtype=np.int64)
+    is_on = np.array([1.0 if row[3] else 0.0 for row in rows])
+    power = np.array([row[4] or 0.0 for row in rows], dtype=np.float64)
+    start = np.array([(datetime.fromisoformat(str(row[5])) - BACKFILL_EPOCH).total_seconds() for row in rows])
+    limit = (until - BACKFILL_EPOCH).total_seconds()
+
+    # Each row holds until the appliance's next row, capped at the
+    # heartbeat, as READING_SPANS_CTE reconstructs it
+    following = np.append(start[1:], limit)
+    following[np.append(appliance[1:] != appliance[:-1], True)] = limit
+    if lookahead is not None and lookahead[1] == rows[-1][1]:
+        following[-1] = (datetime.fromisoformat(str(lookahead[5])) - BACKFILL_EPOCH).total_seconds()
+    end = np.minimum(np.minimum(following, start + BACKFILL_HEARTBEAT), limit)
+    keep = end > start
+    appliance, user, is_on, power, start, end = (array[keep] for array in (appliance, user, is_on, power, start, end))
+
+    # Split spans at minute boundaries
+    first = np.floor(start / 60).astype(np.int64)
+    pieces = np.ceil(end / 60).astype(np.int64) - first
+    span = np.repeat(np.arange(len(start)), pieces)
+    minute = first[span] + np.arange(len(span)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    seconds = np.minimum(end[span], (minute + 1) * 60.0) - np.maximum(start[span], minute * 60.0)
+
+    for table, size in BACKFILL_TIERS:
+        keys, first_piece, inverse = np.unique(np.stack((appliance[span], minute * 60 // size)), axis=1,
+                                               return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        count = np.bincount(inverse, weights=seconds) / BACKFILL_TICK
+        power_sum = np.bincount(inverse, weights=power[span] * seconds) / BACKFILL_TICK
+        on_count = np.bincount(inverse, weights=is_on[span] * seconds) / BACKFILL_TICK
+        power_min = np.full(len(count), np.inf)
+        power_max = np.full(len(count), -np.inf)
+        np.minimum.at(power_min, inverse, power[span])
+        np.maximum.at(power_max, inverse, power[span])
+        cursor.executemany(f'''
+            INSERT INTO {table}
+            (appliance_id, user_id, bucket_start, sample_count, power_sum, power_min, power_max, on_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (appliance_id, bucket_start) DO UPDATE SET
+                sample_count = sample_count + excluded.sample_count,
+                power_sum = power_sum + excluded.power_sum,
+                power_min = MIN(power_min, excluded.power_min),
+                power_max = MAX(power_max, excluded.power_max),
+                on_count = on_count + excluded.on_count
+        ''', [
+            (int(keys[0, index]), int(user[span[first_piece[index]]]),
+             (BACKFILL_EPOCH + timedelta(seconds=int(keys[1, index]) * size)).strftime(BACKFILL_FORMAT),
+             float(count[index]), float(power_sum[index]), float(power_min[index]),
+             float(power_max[index]), float(on_count[index]))
+            for index in range(len(count))
+        ])
+
+# Frozen copies of the per-currency default tariffs added with migration 10
+CURRENCY_DEFAULT_TARIFFS = [
+    ('flat_usd', 'USD', '{"fixed_charge": 0, "slabs": [[null, 0.16]], "tou": []}'),
+    ('flat_eur', 'EUR', '{"fixed_charge": 0, "slabs": [[null, 0.3]], "tou": []}'),
+    ('flat_gbp', 'GBP', '{"fixed_charge": 0, "slabs": [[null, 0.27]], "tou": []}')
+]
+
+def tariff_currency_defaults(cursor):
+    """Default tariff per currency, and effective_from in the adapter's ISO format"""
+    # Earlier seeds used SQLite's 'YYYY-MM-DD HH:MM:SS', which sorts before
+    # the 'T' the datetime adapter writes and so compared inconsistently
+    cursor.execute('''
+        UPDATE tariffs SET effective_from = REPLACE(effective_from, ' ', 'T')
+        WHERE effective_from LIKE '____-__-__ %'
+    ''')
+    cursor.executemany('''
+        INSERT OR IGNORE INTO tariffs (name, version, currency, definition, effective_from)
+        VALUES (?, 1, ?, ?, '2000-01-01T00:00:00')
+    ''', CURRENCY_DEFAULT_TARIFFS)
+
+def household_schedules(cursor):
+    """Household totals of the last solve, so reads don't re-solve"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS household_schedules (
+            user_id INTEGER PRIMARY KEY,
+            total_cost REAL NOT NULL,
+            lower_bound REAL NOT NULL,
+            optimal BOOLEAN NOT NULL,
+            currency VARCHAR(10) NOT NULL,
+            peak_power_w REAL NOT NULL,
+            solved_at DATETIME NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+def superseded_archives(cursor):
+    """Archive files replaced by a newer version, kept until readers can no longer list them"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS superseded_archives (
+            path TEXT PRIMARY KEY,
+            superseded_at DATETIME NOT NULL
+        )
+    ''')
+
+MIGRATIONS = [
+    (1, 'base schema', base_schema),
+    (2, 'service tables', service_tables),
+    (3, 'unify user_preferences and appliance_data indexes', unify_legacy_schema),
+    (4, 'maintenance state', maintenance_state),
+    (5, 'job schedule', job_schedule),
+    (6, 'reading archive catalog', reading_archive_catalog),
+    (7, 'anomalies', anomalies),
+    (8, 'appliance forecasts', appliance_forecasts),
+    (9, 'backfill rollups from raw readings', backfill_rollups),
+    (10, 'per-currency default tariffs', tariff_currency_defaults),
+    (11, 'household schedules', household_schedules),
+    (12, 'superseded archive files', superseded_archives)
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def current_version(conn):
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+def migrate(db_path):
+    """Bring the database up to LATEST_VERSION; returns how many migrations ran"""
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    try:
+        # New files get incremental vacuum; existing ones need a full VACUUM
+        # to switch (see maintenance_service)
+        if conn.execute('PRAGMA page_count').fetchone()[0] == 0:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        # Fast path: a single indexed read once the schema is current
+        if current_version(conn) >= LATEST_VERSION:
+            return 0
+
+        # Take the write lock before re-reading the version so concurrent
+        # workers wait here and then find nothing left to do
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            applied = 0
+            version = current_version(conn)
+            for number, description, step in MIGRATIONS:
+                if number <= version:
+                    continue
+                step(conn.cursor())
+                conn.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                             (number, description, datetime.now().isoformat(sep=' ', timespec='seconds')))
+                print(f"Applied schema migration {number}: {description}")
+                applied += 1
+            conn.execute('COMMIT')
+            return applied
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import time
+from urllib.parse import quote
+
+from config import READ_REPLICA_PATH, READ_REPLICA_MAX_STALENESS
+
+# A read-only snapshot of the database for analytics, exports and reports.
+# The simulator daemon rebuilds it with the online backup API in small page
+# steps, so the source is only ever read-locked for one step at a time and
+# writers get in between steps. Each copy is built beside the replica and
+# renamed over it, so readers always open a complete snapshot; connections
+# already open keep reading the previous one. The replica file's mtime is
+# the time its snapshot started.
+
+REPLICA_STEP_PAGES = 256      # pages copied per backup step
+REPLICA_BUSY_SLEEP = 0.05     # seconds to back off when a writer holds the source
+REPLICA_MAX_RESTARTS = 3      # a backup restarts when another connection writes the source
+
+class ReplicaRefreshError(Exception):
+    """The snapshot could not be completed; the previous replica stays in place"""
+
+def refresh(db_path, replica_path=READ_REPLICA_PATH, step_pages=REPLICA_STEP_PAGES):
+    """Copy db_path to replica_path as one consistent snapshot; returns pages copied"""
+    started = time.time()
+    building = replica_path + '.next'
+    if os.path.exists(building):
+        os.remove(building)
+
+    progress = {'steps': 0, 'restarts': 0, 'remaining': None, 'total': 0}
+
+    def on_step(status, remaining, total):
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1
+            if progress['restarts'] > REPLICA_MAX_RESTARTS:
+                raise ReplicaRefreshError(f'source changed {progress["restarts"]} times during the copy')
+        progress.update(steps=progress['steps'] + 1, remaining=remaining, total=total)
+
+    source = sqlite3.connect(db_path, timeout=5)
+    target = sqlite3.connect(building)
+    try:
+        try:
+            source.backup(target, pages=step_pages, progress=on_step, sleep=REPLICA_BUSY_SLEEP)
+        except ReplicaRefreshError:
+            # Under WAL a single step reads one snapshot without blocking
+            # writers, so finish that way rather than give up
+            if source.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+                raise
+            progress['remaining'] = None
+            source.backup(target, pages=-1, progress=on_step)
+        # The copy inherits WAL mode; a rollback-journal file can be opened read-only
+        target.execute('PRAGMA journal_mode = DELETE')
+    except Exception:
+        target.close()
+        os.remove(building)
+        raise
+    finally:
+        source.close()
+    target.close()
+
+    os.utime(building, (started, started))
+    os.replace(building, replica_path)
+    elapsed = time.time() - started
+    if elapsed >= 1.0 or progress['restarts']:
+        print(f"Read replica refreshed: {progress['total']} pages in {progress['steps']} steps, "
+              f"{elapsed:.2f}s, {progress['restarts']} restart(s)")
+    return progress['total']
+
+def replica_age(replica_path=READ_REPLICA_PATH):
+    """Seconds since the current snapshot was taken, or None without one"""
+    try:
+        return max(0.0, time.time() - os.path.getmtime(replica_path))
+    except OSError:
+        return None
+
+class ConnectionRouter:
+    """Sends heavy read-only work to the snapshot while it is fresh enough.
+
+    Analytics connections go to the replica when it is at most
+    max_staleness seconds old and to the primary otherwise, so a stopped
+    daemon degrades to the old behaviour rather than serving old data.
+    """
+
+    def __init__(self, db_path, replica_path=READ_REPLICA_PATH, max_staleness=READ_REPLICA_MAX_STALENESS):
+        self.db_path = db_path
+        self.replica_path = replica_path
+        self.max_staleness = max_staleness
+
+    def replica_fresh(self):
+        if not self.replica_path:
+            return False
+        age = replica_age(self.replica_path)
+        return age is not None and age <= self.max_staleness
+
+    def connect(self, analytics=False, **kwargs):
+        """Connection for OLTP work (always the primary) or analytics (the replica when fresh)"""
+        if analytics and self.replica_fresh():
+            return sqlite3.connect(f'file:{quote(os.path.abspath(self.replica_path))}?mode=ro',
+                                   uri=True, **kwargs)
+        return sqlite3.connect(self.db_path, **kwargs)
+
+    def status(self):
+        age = replica_age(self.replica_path) if self.replica_path else None
+        return {
+            'replica_path': self.replica_path,
+            'age_seconds': round(age, 1) if age is not None else None,
+            'max_staleness': self.max_staleness,
+            'serving_analytics': self.replica_fresh()
+        }
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Take a read-replica snapshot')
+    parser.add_argument('--db', default='havoc_ecowatt.db')
+    parser.add_argument('--replica', default=READ_REPLICA_PATH)
+    args = parser.parse_args()
+
+    pages = refresh(args.db, args.replica)
+    print(f"Snapshot of {args.db} written to {args.replica} ({pages} pages)")
@@ -0,0 +1,106 @@
+import struct
+import time
+from datetime import datetime, timedelta
+
+# Log layout: magic + version header, then one fixed-size record per reading.
+# Values are stored as exact integers (microseconds, hundredths) so replayed
+# readings are bit-identical to the recorded ones.
+LOG_MAGIC = b'EWRL'
+LOG_VERSION = 1
+HEADER = struct.Struct('<4sH')
+RECORD = struct.Struct('<qIIBii')  # timestamp_us, appliance_id, user_id, is_on, temp_x100, power_x100
+
+EPOCH = datetime(2000, 1, 1)
+NO_TEMPERATURE = -2 ** 31
+
+def encode_reading(data):
+    """Pack a reading dict into a log record"""
+    temperature = data['temperature']
+    return RECORD.pack(
+        (data['timestamp'] - EPOCH) // timedelta(microseconds=1),
+        data['appliance_id'],
+        data['user_id'],
+        1 if data['is_on'] else 0,
+        NO_TEMPERATURE if temperature is None else round(temperature * 100),
+        round(data['power_consumption'] * 100)
+    )
+
+def decode_reading(record):
+    """Unpack a log record into a reading dict"""
+    timestamp_us, appliance_id, user_id, is_on, temperature, power = RECORD.unpack(record)
+    return {
+        'appliance_id': appliance_id,
+        'user_id': user_id,
+        'is_on': bool(is_on),
+        'temperature': None if temperature == NO_TEMPERATURE else temperature / 100,
+        'power_consumption': power / 100,
+        'timestamp': EPOCH + timedelta(microseconds=timestamp_us)
+    }
+
+class ReadingRecorder:
+    """Appends every reading passed through the write path to a binary log"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(LOG_MAGIC, LOG_VERSION))
+        self.count = 0
+
+    def write(self, data_list):
+        self.file.write(b''.join(encode_reading(data) for data in data_list))
+        self.count += len(data_list)
+
+    def close(self):
+        self.file.close()
+        print(f"Recorded {self.count} readings to {self.path}")
+
+def read_log(path):
+    """Yield readings from a log grouped into ticks (runs of equal timestamp)"""
+    with open(path, 'rb') as f:
+        magic, version = HEADER.unpack(f.read(HEADER.size))
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            raise ValueError(f"{path} is not a version {LOG_VERSION} reading log")
+
+        batch = []
+        while True:
+            record = f.read(RECORD.size)
+            if len(record) < RECORD.size:
+                break
+            data = decode_reading(record)
+            if batch and data['timestamp'] != batch[-1]['timestamp']:
+                yield batch
+                batch = []
+            batch.append(data)
+        if batch:
+            yield batch
+
+class ReadingReplayer:
+    """Feeds a recorded log back through a simulator's write path"""
+
+    def __init__(self, simulator, path, speed=None):
+        self.simulator = simulator
+        self.path = path
+        self.speed = speed  # None replays as fast as possible
+
+    def run(self):
+        """Replay the log, pacing ticks by recorded gaps divided by speed"""
+        simulator = self.simulator
+        simulator.init_database()
+        simulator.appliance_types = {a['id']: a['type'] for a in simulator.get_all_appliances()}
+
+        started = time.time()
+        readings = stored = 0
+        previous = None
+        for batch in read_log(self.path):
+            timestamp = batch[0]['timestamp']
+            if self.speed and previous is not None:
+                time.sleep(max(0, (timestamp - previous).total_seconds() / self.speed))
+            previous = timestamp
+
+            stored += simulator.ingest_readings(batch)
+            readings += len(batch)
+
+        elapsed = time.time() - started
+        rate = readings / elapsed if elapsed > 0 else 0
+        print(f"Replayed {readings} readings ({stored} stored) in {elapsed:.2f}s ({rate:.0f} readings/s)")
+        return readings
@@ -0,0 +1,230 @@
+import json
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import TICK_INTERVAL, CARBON_KG_PER_KWH
+from job_runner import run_in_chunks
+from rollup_service import BUCKET_FORMAT
+from tariff_service import CURRENCY_SYMBOLS, billing_period, default_tariff_name, load_tariffs
+
+REPORT_VERSION = 1
+BATCH_CHUNK_SIZE = 200
+TOP_APPLIANCES = 5
+
+def previous_period(period_start):
+    return billing_period(period_start - timedelta(days=1))
+
+def load_inputs(conn, low_user_id, high_user_id, now):
+    """Hourly usage, appliance totals, goals and tariff choice for users in [low, high]"""
+    period_start, _ = billing_period(now)
+    prev_start, _ = previous_period(period_start)
+    users = {}
+
+    rows = conn.execute('''
+        SELECT u.id, ut.tariff_name, up.currency, up.energy_goal, up.cost_goal, up.carbon_goal
+        FROM users u
+        LEFT JOIN user_tariffs ut ON ut.user_id = u.id
+        LEFT JOIN user_preferences up ON up.user_id = u.id
+        WHERE u.id BETWEEN ? AND ?
+    ''', (low_user_id, high_user_id)).fetchall()
+    for row in rows:
+        users[row['id']] = {
+            'tariff_name': row['tariff_name'],
+            'currency': row['currency'],
+            'goals': {
+                'energy': row['energy_goal'] or 0,
+                'cost': row['cost_goal'] or 0,
+                'carbon': row['carbon_goal'] or 0
+            },
+            'buckets': [],
+            'power_sums': [],
+            'appliances': []
+        }
+
+    rows = conn.execute('''
+        SELECT user_id, bucket_start, SUM(power_sum) AS power_sum
+        FROM rollup_1h
+        WHERE user_id BETWEEN ? AND ? AND bucket_start >= ? AND bucket_start < ?
+        GROUP BY user_id, bucket_start
+        ORDER BY user_id, bucket_start
+    ''', (low_user_id, high_user_id, prev_start.strftime(BUCKET_FORMAT), now.strftime(BUCKET_FORMAT))).fetchall()
+    for row in rows:
+        user = users.get(row['user_id'])
+        if user is not None:
+            user['buckets'].append(row['bucket_start'])
+            user['power_sums'].append(row['power_sum'])
+
+    rows = conn.execute('''
+        SELECT r.user_id, r.appliance_id, a.name, a.type, SUM(r.power_sum) AS power_sum
+        FROM rollup_1d r
+        JOIN appliances a ON a.id = r.appliance_id
+        WHERE r.user_id BETWEEN ? AND ? AND r.bucket_start >= ?
+        GROUP BY r.user_id, r.appliance_id
+    ''', (low_user_id, high_user_id, period_start.strftime(BUCKET_FORMAT))).fetchall()
+    for row in rows:
+        user = users.get(row['user_id'])
+        if user is not None:
+            user['appliances'].append({
+                'appliance_id': row['appliance_id'],
+                'name': row['name'],
+                'type': row['type'],
+                'energy_kwh': row['power_sum'] * TICK_INTERVAL / 3600000.0
+            })
+
+    return users
+
+def percent_change(current, previous):
+    return round((current - previous) / previous * 100, 1) if previous else None
+
+def build_report(user, tariff, now):
+    """Report document for the billing period containing `now`"""
+    period_start, period_end = billing_period(now)
+    prev_start, _ = previous_period(period_start)
+    period_key = period_start.strftime(BUCKET_FORMAT)
+    # Same elapsed span of the previous period, for a like-for-like comparison
+    prev_cutoff = min(prev_start + (now - period_start), period_start).strftime(BUCKET_FORMAT)
+
+    buckets = np.array(user['buckets'], dtype=object)
+    kwh = np.array(user['power_sums'], dtype=np.float64) * TICK_INTERVAL / 3600000.0
+    hours = np.array([int(bucket[11:13]) for bucket in buckets], dtype=np.int64)
+    current = buckets >= period_key
+    previous = ~current
+    previous_to_date = previous & (buckets < prev_cutoff)
+
+    bill = tariff.bill(kwh[current], hours[current])
+    previous_bill = tariff.bill(kwh[previous], hours[previous])
+    previous_to_date_bill = tariff.bill(kwh[previous_to_date], hours[previous_to_date])
+
+    days = np.array([bucket[:10] for bucket in buckets[current]])
+    day_labels, day_index = np.unique(days, return_inverse=True) if len(days) else (np.array([]), np.array([], dtype=np.int64))
+    daily_kwh = np.bincount(day_index, weights=kwh[current], minlength=len(day_labels))
+
+    total_kwh = bill['energy_kwh']
+    appliances = sorted(user['appliances'], key=lambda item: -item['energy_kwh'])[:TOP_APPLIANCES]
+    for item in appliances:
+        item['share'] = round(item['energy_kwh'] / total_kwh * 100, 1) if total_kwh else 0
+        item['energy_kwh'] = round(item['energy_kwh'], 3)
+
+    # Goals are monthly; project the period total from the elapsed fraction
+    elapsed = max((now - period_start).total_seconds() / (period_end - period_start).total_seconds(), 1e-6)
+    actuals = {
+        'energy': total_kwh,
+        'cost': bill['total'],
+        'carbon': round(total_kwh * CARBON_KG_PER_KWH, 2)
+    }
+    goals = {}
+    for name, goal in user['goals'].items():
+        goal = float(goal)
+        goals[name] = {
+            'goal': goal,
+            'actual': actuals[name],
+            'projected': round(actuals[name] / elapsed, 2),
+            'progress': round(actuals[name] / goal * 100, 1) if goal else None,
+            'on_track': actuals[name] / elapsed <= goal if goal else None
+        }
+
+    return {
+        'version': REPORT_VERSION,
+        'period_start': period_start.isoformat(),
+        'period_end': period_end.isoformat(),
+        'generated_at': now.isoformat(),
+        'tariff': tariff.name,
+        'currency': tariff.currency,
+        'currency_symbol': CURRENCY_SYMBOLS.get(tariff.currency, tariff.currency),
+        'energy_kwh': total_kwh,
+        'cost': bill['total'],
+        'carbon_kg': actuals['carbon'],
+        'daily_kwh': [
+            {'date': label, 'energy_kwh': round(float(value), 3)}
+            for label, value in zip(day_labels, daily_kwh)
+        ],
+        'top_appliances': appliances,
+        'previous_period': {
+            'energy_kwh': previous_bill['energy_kwh'],
+            'cost': previous_bill['total']
+        },
+        'changes': {
+            'energy': percent_change(total_kwh, previous_to_date_bill['energy_kwh']),
+            'cost': percent_change(bill['total'], previous_to_date_bill['total'])
+        },
+        'goals': goals
+    }
+
+def generate_range(conn, low_user_id, high_user_id, now, skip_done=False):
+    """Build and store reports for users in [low, high]; returns {user_id: report}"""
+    tariffs = load_tariffs(conn, now)
+    period_start = billing_period(now)[0]
+    report_date = now.date().isoformat()
+
+    done = set()
+    if skip_done:
+        done = {row[0] for row in conn.execute('''
+            SELECT user_id FROM user_reports
+            WHERE user_id BETWEEN ? AND ? AND period_start = ? AND report_date = ?
+        ''', (low_user_id, high_user_id, period_start.isoformat(), report_date))}
+
+    reports = {}
+    for user_id, user in load_inputs(conn, low_user_id, high_user_id, now).items():
+        if user_id in done:
+            continue
+        tariff = (tariffs.get(user['tariff_name'])
+                  or tariffs.get(default_tariff_name(user['currency'])))
+        reports[user_id] = build_report(user, tariff, now)
+
+    conn.executemany('''
+        INSERT INTO user_reports (user_id, period_start, report_date, report, generated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, period_start) DO UPDATE SET
+            report_date = excluded.report_date,
+            report = excluded.report,
+            generated_at = excluded.generated_at
+    ''', [(user_id, period_start.isoformat(), report_date, json.dumps(report), now.isoformat())
+          for user_id, report in reports.items()])
+    return reports
+
+def get_report(conn, user_id, period_start=None):
+    """Stored report for a user (latest period by default), or None"""
+    if period_start is None:
+        row = conn.execute('''
+            SELECT report FROM user_reports WHERE user_id = ?
+            ORDER BY period_start DESC LIMIT 1
+        ''', (user_id,)).fetchone()
+    else:
+        row = conn.execute('''
+            SELECT report FROM user_reports WHERE user_id = ? AND period_start = ?
+        ''', (user_id, period_start.isoformat())).fetchone()
+    return json.loads(row[0]) if row else None
+
+def generate_user(conn, user_id, now=None):
+    """Build one user's report on demand (before their first nightly run)"""
+    return generate_range(conn, user_id, user_id, now or datetime.now()).get(user_id)
+
+def generate_all(db_path, workers=None, chunk_size=BATCH_CHUNK_SIZE, now=None):
+    """Nightly batch: reports for every user not yet done today, on a process pool.
+
+    Each chunk commits its reports together with their report_date stamps, so
+    rerunning after an interruption only processes the remaining users.
+    """
+    now = now or datetime.now()
+    started = time.time()
+
+    conn = sqlite3.connect(db_path)
+    user_ids = [row[0] for row in conn.execute('''
+        SELECT id FROM users
+        WHERE id NOT IN (
+            SELECT user_id FROM user_reports WHERE period_start = ? AND report_date = ?
+        )
+        ORDER BY id
+    ''', (billing_period(now)[0].isoformat(), now.date().isoformat()))]
+    conn.close()
+
+    generated = run_in_chunks(db_path, generate_range, user_ids, chunk_size, now, workers, skip_done=True)
+
+    print(f"Generated {generated} user reports in {time.time() - started:.2f}s")
+    return generated
+
+if __name__ == '__main__':
+    generate_all('havoc_ecowatt.db')
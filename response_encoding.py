@@ -0,0 +1,69 @@
+import gzip
+import hashlib
+import json
+
+from flask import Response, current_app, request
+
+from config import COMPRESS_MIN_BYTES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def make_etag(*parts):
+    """Opaque ETag value for a response version"""
+    return hashlib.blake2b(json.dumps(parts, default=str).encode('utf-8'), digest_size=12).hexdigest()
+
+def not_modified(etag):
+    """304 response if the client already holds this version, else None"""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    return None
+
+def to_columnar(payload):
+    """Turn top-level lists of uniform dicts into parallel arrays per key"""
+    columnar = {}
+    for key, value in payload.items():
+        if value and isinstance(value, list) and all(isinstance(item, dict) for item in value):
+            keys = value[0].keys()
+            if all(item.keys() == keys for item in value):
+                value = {column: [item[column] for item in value] for column in keys}
+        columnar[key] = value
+    return columnar
+
+def dumps(payload):
+    """JSON bytes matching Flask's jsonify output, via orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=current_app.json.default,
+                            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+                            | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY)
+    return current_app.json.dumps(payload).encode('utf-8')
+
+def json_response(payload, etag=None):
+    """JSON response honouring ?format=columnar and the client's Accept-Encoding"""
+    if request.args.get('format') == 'columnar':
+        payload = to_columnar(payload)
+    body = dumps(payload)
+
+    headers = {'Vary': 'Accept-Encoding'}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            body = brotli.compress(body, quality=4)
+            headers['Content-Encoding'] = 'br'
+        elif accepted['gzip']:
+            body = gzip.compress(body, compresslevel=6)
+            headers['Content-Encoding'] = 'gzip'
+
+    response = Response(body, mimetype='application/json', headers=headers)
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    return response
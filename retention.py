@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+import archive_service
+from config import READING_RETENTION_DAYS
+
+def purge_readings(conn, now):
+    """Archive (when enabled) and delete raw readings older than READING_RETENTION_DAYS; returns rows deleted"""
+    cutoff = now - timedelta(days=READING_RETENTION_DAYS)
+    archived = 0
+    if archive_service.enabled():
+        # Whole days only, so each day's archive file is written once;
+        # archived days are deleted and committed one at a time
+        cutoff = datetime(cutoff.year, cutoff.month, cutoff.day)
+        archived = archive_service.archive_before(conn, cutoff)
+    cursor = conn.execute('DELETE FROM appliance_data WHERE timestamp < ?', (cutoff,))
+    return archived + cursor.rowcount
+
+def purge_expired_auth(conn, now):
+    """Deactivate expired sessions and delete expired password reset and verification tokens"""
+    cursor = conn.cursor()
+    cursor.execute('UPDATE user_sessions SET is_active = 0 WHERE expires_at < ? AND is_active = 1', (now,))
+    changed = cursor.rowcount
+    for table in ('password_reset_tokens', 'email_verification_tokens'):
+        cursor.execute(f'DELETE FROM {table} WHERE expires_at < ?', (now,))
+        changed += cursor.rowcount
+    return changed
@@ -0,0 +1,285 @@
+from datetime import datetime, timedelta
+from config import TICK_INTERVAL, HEARTBEAT_INTERVAL
+import archive_service
+
+# Rollup tiers, coarsest first: (table, bucket size in seconds, retention in days)
+ROLLUP_TIERS = [
+    ('rollup_1d', 86400, None),
+    ('rollup_1h', 3600, 400),
+    ('rollup_1m', 60, 7)
+]
+
+# Output bucketings: name -> (bucket size in seconds, SQL key expression)
+BUCKETS = {
+    'hour': (3600, "strftime('%Y-%m-%d %H:00', {col})"),
+    'hour_of_day': (3600, "strftime('%H', {col})"),
+    'day': (86400, "date({col})"),
+    None: (None, "'total'")
+}
+
+BUCKET_FORMAT = '%Y-%m-%d %H:%M:%S'
+EPOCH = datetime(2000, 1, 1)
+
+# Readings are recorded change-only (deadband), so each stored row holds its
+# value until the next row for the same appliance. Raw aggregates weight every
+# row by that span, capped at the heartbeat interval so simulator downtime is
+# not filled in, and clipped to the requested window.
+READING_SPANS_CTE = '''
+    WITH spans AS (
+        SELECT appliance_id, is_on, power_consumption,
+               julianday(timestamp) AS t_start,
+               MIN(COALESCE(LEAD(julianday(timestamp)) OVER w, julianday(:now)),
+                   julianday(timestamp) + :heartbeat / 86400.0) AS t_end
+        FROM appliance_data
+        WHERE user_id = :user_id AND timestamp >= :lookback AND timestamp < :end
+        WINDOW w AS (PARTITION BY appliance_id ORDER BY timestamp)
+    ),
+    readings AS (
+        SELECT appliance_id, is_on, power_consumption,
+               MAX(t_start, julianday(:start)) AS t_start,
+               (MIN(t_end, julianday(:end)) - MAX(t_start, julianday(:start))) * 86400.0 AS duration_s
+        FROM spans
+        WHERE t_end > julianday(:start)
+    )
+'''
+
+def reading_span_params(user_id, start, end=None, now=None):
+    """Query parameters for READING_SPANS_CTE over [start, end); each
+    appliance's latest reading holds until `now` (the simulator's clock)"""
+    now = now or datetime.now()
+    return {
+        'user_id': user_id,
+        'start': start,
+        'end': end or now,
+        'lookback': start - timedelta(seconds=HEARTBEAT_INTERVAL),
+        'now': now,
+        'heartbeat': HEARTBEAT_INTERVAL,
+        'tick': TICK_INTERVAL
+    }
+
+def floor_time(dt, seconds):
+    """Round a naive local datetime down to a bucket boundary"""
+    offset = (dt - EPOCH).total_seconds()
+    return EPOCH + timedelta(seconds=offset - offset % seconds)
+
+def ceil_time(dt, seconds):
+    """Round a naive local datetime up to a bucket boundary"""
+    floored = floor_time(dt, seconds)
+    return floored if floored == dt else floored + timedelta(seconds=seconds)
+
+class RollupStore:
+    """Incrementally maintained 1-minute, 1-hour and 1-day rollups of readings"""
+
+    def __init__(self):
+        # (appliance_id, minute_start) -> running aggregate for an open minute
+        self.open_minutes = {}
+
+    def add_readings(self, conn, data_list):
+        """Fold new readings into open minutes and flush the minutes that have closed"""
+        if not data_list:
+            return
+
+        for data in data_list:
+            key = (data['appliance_id'], floor_time(data['timestamp'], 60))
+            bucket = self.open_minutes.get(key)
+            power = data['power_consumption']
+            if bucket is None:
+                self.open_minutes[key] = {
+                    'user_id': data['user_id'],
+                    'sample_count': 1,
+                    'power_sum': power,
+                    'power_min': power,
+                    'power_max': power,
+                    'on_count': 1 if data['is_on'] else 0
+                }
+            else:
+                bucket['sample_count'] += 1
+                bucket['power_sum'] += power
+                bucket['power_min'] = min(bucket['power_min'], power)
+                bucket['power_max'] = max(bucket['power_max'], power)
+                bucket['on_count'] += 1 if data['is_on'] else 0
+
+        current_minute = floor_time(max(data['timestamp'] for data in data_list), 60)
+        self.flush(conn, current_minute)
+
+    def flush(self, conn, before=None):
+        """Write minutes that started before `before` (all minutes if None) into every tier"""
+        closed = [key for key in self.open_minutes if before is None or key[1] < before]
+        if not closed:
+            return
+
+        cursor = conn.cursor()
+        for table, seconds, _ in ROLLUP_TIERS:
+            rows = []
+            for appliance_id, minute in closed:
+                bucket = self.open_minutes[(appliance_id, minute)]
+                rows.append((
+                    appliance_id, bucket['user_id'],
+                    floor_time(minute, seconds).strftime(BUCKET_FORMAT),
+                    bucket['sample_count'], bucket['power_sum'],
+                    bucket['power_min'], bucket['power_max'], bucket['on_count']
+                ))
+            cursor.executemany(f'''
+                INSERT INTO {table}
+                (appliance_id, user_id, bucket_start, sample_count, power_sum,
+                 power_min, power_max, on_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (appliance_id, bucket_start) DO UPDATE SET
+                    sample_count = sample_count + excluded.sample_count,
+                    power_sum = power_sum + excluded.power_sum,
+                    power_min = MIN(power_min, excluded.power_min),
+                    power_max = MAX(power_max, excluded.power_max),
+                    on_count = on_count + excluded.on_count
+            ''', rows)
+
+        watermark = before or max(key[1] for key in closed) + timedelta(minutes=1)
+        cursor.execute('''
+            INSERT INTO rollup_state (name, value) VALUES ('watermark', ?)
+            ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)
+        ''', (watermark.strftime(BUCKET_FORMAT),))
+
+        for key in closed:
+            del self.open_minutes[key]
+
+    def cleanup(self, conn, now=None):
+        """Drop rollup rows past each tier's retention"""
+        cursor = conn.cursor()
+        now = now or datetime.now()
+        deleted = 0
+        for table, _, retention_days in ROLLUP_TIERS:
+            if retention_days is None:
+                continue
+            cutoff = now - timedelta(days=retention_days)
+            cursor.execute(f'DELETE FROM {table} WHERE bucket_start < ?',
+                           (cutoff.strftime(BUCKET_FORMAT),))
+            deleted += cursor.rowcount
+        return deleted
+
+def get_watermark(conn):
+    """Time up to which rollups are complete, or None before the first flush"""
+    row = conn.execute("SELECT value FROM rollup_state WHERE name = 'watermark'").fetchone()
+    return datetime.strptime(row[0], BUCKET_FORMAT) if row else None
+
+def plan_query(start, end, bucket, watermark):
+    """Split [start, end) into (table, segment_start, segment_end) pieces.
+
+    Each aligned piece is served from the coarsest tier whose bucket size
+    divides the output bucket; unaligned edges fall through to finer tiers and
+    anything past the watermark (the open minute) is read raw (table None).
+    A tier is skipped for pieces older than its retention, measured back
+    from the watermark, since cleanup has already dropped those rows.
+    """
+    bucket_seconds = BUCKETS[bucket][0]
+    tiers = [(table, seconds, retention_days) for table, seconds, retention_days in ROLLUP_TIERS
+             if bucket_seconds is None or bucket_seconds % seconds == 0]
+    segments = []
+
+    def split(lo, hi, tiers):
+        if lo >= hi:
+            return
+        if not tiers:
+            segments.append((None, lo, hi))
+            return
+        table, seconds, retention_days = tiers[0]
+        if retention_days is not None:
+            kept_from = ceil_time(watermark - timedelta(days=retention_days), seconds)
+            if lo < kept_from:
+                split(lo, min(hi, kept_from), tiers[1:])
+                lo = kept_from
+                if lo >= hi:
+                    return
+        aligned_start, aligned_end = ceil_time(lo, seconds), floor_time(hi, seconds)
+        if aligned_start < aligned_end:
+            split(lo, aligned_start, tiers[1:])
+            segments.append((table, aligned_start, aligned_end))
+            split(aligned_end, hi, tiers[1:])
+        else:
+            split(lo, hi, tiers[1:])
+
+    closed_end = min(end, watermark) if watermark else start
+    split(start, closed_end, tiers)
+    if closed_end < end:
+        segments.append((None, max(start, closed_end), end))
+    return segments
+
+def query_usage(conn, user_id, start, end=None, bucket=None, by_appliance=False, plan=None, now=None):
+    """Aggregate a user's readings over [start, end) into buckets.
+
+    Returns dicts keyed by bucket (and appliance_id when by_appliance) with
+    sample_count, power_sum, power_min, power_max, on_count, avg_power and
+    energy_kwh. Counts are in simulation ticks. `plan` is plan_query's
+    segmentation, computed from the current watermark when not given; `now`
+    is the current (possibly simulated) time, and the default end.
+    """
+    now = now or datetime.now()
+    end = end or now
+    key_expr = BUCKETS[bucket][1]
+    group_cols = 'bucket, appliance_id' if by_appliance else 'bucket'
+    rows = []
+    if plan is None:
+        plan = plan_query(start, end, bucket, get_watermark(conn))
+
+    for table, seg_start, seg_end in plan:
+        if table is None:
+            rows += conn.execute(READING_SPANS_CTE + f'''
+                SELECT {key_expr.format(col='t_start')} AS bucket, appliance_id,
+                       SUM(duration_s) / :tick AS sample_count,
+                       SUM(power_consumption * duration_s) / :tick AS power_sum,
+                       MIN(power_consumption) AS power_min,
+                       MAX(power_consumption) AS power_max,
+                       SUM(CASE WHEN is_on = 1 THEN duration_s ELSE 0 END) / :tick AS on_count
+                FROM readings
+                GROUP BY {group_cols}
+            ''', reading_span_params(user_id, seg_start, seg_end, now)).fetchall()
+            if archive_service.enabled():
+                # Readings past retention live in the archive instead
+                rows += archive_service.aggregate_archived(conn, user_id, seg_start, seg_end,
+                                                           bucket, by_appliance)
+        else:
+            rows += conn.execute(f'''
+                SELECT {key_expr.format(col='bucket_start')} AS bucket, appliance_id,
+                       SUM(sample_count) AS sample_count,
+                       SUM(power_sum) AS power_sum,
+                       MIN(power_min) AS power_min,
+                       MAX(power_max) AS power_max,
+                       SUM(on_count) AS on_count
+                FROM {table}
+                WHERE user_id = ? AND bucket_start >= ? AND bucket_start < ?
+                GROUP BY {group_cols}
+            ''', (user_id, seg_start.strftime(BUCKET_FORMAT),
+                  seg_end.strftime(BUCKET_FORMAT))).fetchall()
+
+    return merge_usage(rows, by_appliance)
+
+def merge_usage(rows, by_appliance=False):
+    """Combine per-segment (bucket, appliance_id, sample_count, power_sum, power_min,
+    power_max, on_count) rows into query_usage's result list"""
+    results = {}
+    for row in rows:
+        key = (row[0], row[1]) if by_appliance else row[0]
+        merged = results.get(key)
+        if merged is None:
+            results[key] = {
+                'bucket': row[0],
+                'appliance_id': row[1] if by_appliance else None,
+                'sample_count': row[2] or 0,
+                'power_sum': row[3] or 0,
+                'power_min': row[4],
+                'power_max': row[5],
+                'on_count': row[6] or 0
+            }
+        else:
+            merged['sample_count'] += row[2] or 0
+            merged['power_sum'] += row[3] or 0
+            merged['power_min'] = min(merged['power_min'], row[4])
+            merged['power_max'] = max(merged['power_max'], row[5])
+            merged['on_count'] += row[6] or 0
+
+    usage = []
+    for key in sorted(results):
+        entry = results[key]
+        count = entry['sample_count']
+        entry['avg_power'] = entry['power_sum'] / count if count else 0
+        entry['energy_kwh'] = entry['power_sum'] * TICK_INTERVAL / 3600000.0
+        usage.append(entry)
+    return usage
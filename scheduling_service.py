@@ -0,0 +1,297 @@
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import TICK_INTERVAL, DEFAULT_PEAK_POWER_W
+from job_runner import run_in_chunks
+from rollup_service import BUCKET_FORMAT, ceil_time
+from tariff_service import billing_period, default_tariff_name, load_tariffs
+
+# Appliances whose runs can be shifted, with default run length, power and
+# daily window (HH:MM, deadline may wrap past midnight)
+DEFERRABLE_DEFAULTS = {
+    'washing_machine': {'duration_minutes': 90, 'power_w': 1250, 'earliest_start': '08:00', 'deadline': '22:00'},
+    'dishwasher': {'duration_minutes': 120, 'power_w': 1800, 'earliest_start': '20:00', 'deadline': '07:00'},
+    'water_heater': {'duration_minutes': 60, 'power_w': 3750, 'earliest_start': '03:00', 'deadline': '07:00'}
+}
+
+SLOT_MINUTES = 15
+HORIZON_SLOTS = 2 * 24 * 60 // SLOT_MINUTES  # two days, so tomorrow's window always fits
+BATCH_CHUNK_SIZE = 2000
+
+def minutes_of_day(hhmm):
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+def job_window(earliest_start, deadline, horizon_start):
+    """First (earliest_slot, deadline_slot) window of a daily HH:MM window in the horizon"""
+    earliest = minutes_of_day(earliest_start)
+    width = (minutes_of_day(deadline) - earliest) % 1440 or 1440
+    since_earliest = (horizon_start.hour * 60 + horizon_start.minute - earliest) % 1440
+    if since_earliest < width:
+        return 0, (width - since_earliest) // SLOT_MINUTES
+    first = -(-(1440 - since_earliest) // SLOT_MINUTES)
+    return first, first + width // SLOT_MINUTES
+
+def load_inputs(conn, low_user_id, high_user_id, now):
+    """Scheduling inputs for every user in [low, high] with set-based queries"""
+    types = list(DEFERRABLE_DEFAULTS)
+    placeholders = ','.join('?' * len(types))
+    inputs = {}
+
+    rows = conn.execute(f'''
+        SELECT a.id, a.user_id, a.name, a.type, a.power_rating,
+               s.duration_minutes, s.earliest_start, s.deadline
+        FROM appliances a
+        LEFT JOIN appliance_schedules s ON s.appliance_id = a.id
+        WHERE a.user_id BETWEEN ? AND ? AND a.is_active = 1 AND a.type IN ({placeholders})
+        ORDER BY a.user_id, a.id
+    ''', (low_user_id, high_user_id, *types)).fetchall()
+    for row in rows:
+        defaults = DEFERRABLE_DEFAULTS[row['type']]
+        user = inputs.setdefault(row['user_id'], {
+            'jobs': [],
+            'baseline': np.zeros(24),
+            'month_kwh': 0.0,
+            'tariff_name': None,
+            'currency': None,
+            'peak_power_w': DEFAULT_PEAK_POWER_W
+        })
+        user['jobs'].append({
+            'appliance_id': row['id'],
+            'name': row['name'],
+            'type': row['type'],
+            'power_w': float(row['power_rating'] or 0) or defaults['power_w'],
+            'duration_minutes': row['duration_minutes'] or defaults['duration_minutes'],
+            'earliest_start': row['earliest_start'] or defaults['earliest_start'],
+            'deadline': row['deadline'] or defaults['deadline']
+        })
+    if not inputs:
+        return inputs
+
+    # Average non-deferrable household load per hour of day over the last week
+    rows = conn.execute(f'''
+        SELECT r.user_id, CAST(strftime('%H', r.bucket_start) AS INTEGER) AS hour,
+               SUM(r.power_sum / r.sample_count) AS power_total,
+               COUNT(DISTINCT date(r.bucket_start)) AS days
+        FROM rollup_1h r
+        JOIN appliances a ON a.id = r.appliance_id
+        WHERE r.user_id BETWEEN ? AND ? AND r.bucket_start >= ?
+        AND a.type NOT IN ({placeholders})
+        GROUP BY r.user_id, hour
+    ''', (low_user_id, high_user_id, (now - timedelta(days=7)).strftime(BUCKET_FORMAT), *types)).fetchall()
+    for row in rows:
+        if row['user_id'] in inputs:
+            inputs[row['user_id']]['baseline'][row['hour']] = row['power_total'] / row['days']
+
+    # Energy so far this billing period decides the marginal slab rate
+    rows = conn.execute('''
+        SELECT user_id, SUM(power_sum) AS power_sum
+        FROM rollup_1d
+        WHERE user_id BETWEEN ? AND ? AND bucket_start >= ?
+        GROUP BY user_id
+    ''', (low_user_id, high_user_id, billing_period(now)[0].strftime(BUCKET_FORMAT))).fetchall()
+    for row in rows:
+        if row['user_id'] in inputs:
+            inputs[row['user_id']]['month_kwh'] = row['power_sum'] * TICK_INTERVAL / 3600000.0
+
+    rows = conn.execute('''
+        SELECT u.id, ut.tariff_name, up.currency, ss.peak_power_w
+        FROM users u
+        LEFT JOIN user_tariffs ut ON ut.user_id = u.id
+        LEFT JOIN user_preferences up ON up.user_id = u.id
+        LEFT JOIN scheduling_settings ss ON ss.user_id = u.id
+        WHERE u.id BETWEEN ? AND ?
+    ''', (low_user_id, high_user_id)).fetchall()
+    for row in rows:
+        user = inputs.get(row['id'])
+        if user is not None:
+            user['tariff_name'] = row['tariff_name']
+            user['currency'] = row['currency']
+            if row['peak_power_w']:
+                user['peak_power_w'] = row['peak_power_w']
+
+    return inputs
+
+def solve_household(user, tariff, horizon_start):
+    """Place each deferrable run in the cheapest start slot that fits.
+
+    Greedy: largest loads first, each at its minimum-cost start among slots
+    that keep the household under its peak limit. The sum of every job's
+    unconstrained minimum is a lower bound on the optimum, so a greedy total
+    equal to it is optimal; `optimal` is only set when that holds and every
+    run met its window and the peak limit.
+    """
+    start_minute = horizon_start.hour * 60 + horizon_start.minute
+    slot_hours = (start_minute + np.arange(HORIZON_SLOTS) * SLOT_MINUTES) // 60 % 24
+    prices = tariff.marginal_rate(user['month_kwh']) * tariff.hour_multipliers[slot_hours]
+    price_sums = np.concatenate(([0.0], np.cumsum(prices)))
+    load = user['baseline'][slot_hours].copy()
+    peak = user['peak_power_w']
+
+    schedule = []
+    total_cost = lower_bound = 0.0
+    violated = False
+    for job in sorted(user['jobs'], key=lambda job: -job['power_w']):
+        slots = max(1, -(-job['duration_minutes'] // SLOT_MINUTES))
+        slot_kwh = job['power_w'] / 1000.0 * SLOT_MINUTES / 60.0
+        earliest, deadline = job_window(job['earliest_start'], job['deadline'], horizon_start)
+        latest = min(deadline, HORIZON_SLOTS) - slots
+        if latest < earliest:
+            # Window shorter than the run: start at the window and overrun it
+            latest = earliest
+            violated = True
+
+        starts = np.arange(earliest, latest + 1)
+        costs = (price_sums[starts + slots] - price_sums[starts]) * slot_kwh
+        over = np.maximum(load + job['power_w'] - peak, 0)
+        over_sums = np.concatenate(([0.0], np.cumsum(over)))
+        overload = over_sums[starts + slots] - over_sums[starts]
+
+        feasible = overload == 0
+        if feasible.any():
+            best = starts[feasible][np.argmin(costs[feasible])]
+        else:
+            best = starts[np.lexsort((costs, overload))[0]]
+        best_index = best - earliest
+        violated |= not feasible[best_index]
+
+        load[best:best + slots] += job['power_w']
+        total_cost += costs[best_index]
+        lower_bound += costs.min()
+        start = horizon_start + timedelta(minutes=int(best) * SLOT_MINUTES)
+        schedule.append({
+            'appliance_id': job['appliance_id'],
+            'name': job['name'],
+            'type': job['type'],
+            'start': start,
+            'end': start + timedelta(minutes=job['duration_minutes']),
+            'estimated_cost': round(float(costs[best_index]), 2),
+            'estimated_savings': round(float(costs[0] - costs[best_index]), 2),
+            'peak_exceeded': not feasible[best_index]
+        })
+
+    schedule.sort(key=lambda item: item['start'])
+    return {
+        'schedule': schedule,
+        'total_cost': round(float(total_cost), 2),
+        'lower_bound': round(float(lower_bound), 2),
+        'optimal': bool(not violated and total_cost - lower_bound <= 1e-9 * max(1.0, lower_bound)),
+        'peak_power_w': peak
+    }
+
+def save_schedules(conn, user_id, result, solved_at):
+    """Store solved start times alongside the appliance's preferences, and the household totals"""
+    conn.execute('''
+        INSERT INTO household_schedules
+        (user_id, total_cost, lower_bound, optimal, currency, peak_power_w, solved_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            total_cost = excluded.total_cost,
+            lower_bound = excluded.lower_bound,
+            optimal = excluded.optimal,
+            currency = excluded.currency,
+            peak_power_w = excluded.peak_power_w,
+            solved_at = excluded.solved_at
+    ''', (user_id, result['total_cost'], result['lower_bound'], result['optimal'],
+          result['currency'], result['peak_power_w'], solved_at.strftime(BUCKET_FORMAT)))
+    conn.executemany('''
+        INSERT INTO appliance_schedules
+        (appliance_id, user_id, scheduled_start, scheduled_end, estimated_cost,
+         estimated_savings, peak_exceeded, solved_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (appliance_id) DO UPDATE SET
+            scheduled_start = excluded.scheduled_start,
+            scheduled_end = excluded.scheduled_end,
+            estimated_cost = excluded.estimated_cost,
+            estimated_savings = excluded.estimated_savings,
+            peak_exceeded = excluded.peak_exceeded,
+            solved_at = excluded.solved_at
+    ''', [
+        (item['appliance_id'], user_id,
+         item['start'].strftime(BUCKET_FORMAT), item['end'].strftime(BUCKET_FORMAT),
+         item['estimated_cost'], item['estimated_savings'], item['peak_exceeded'],
+         solved_at.strftime(BUCKET_FORMAT))
+        for item in result['schedule']
+    ])
+
+def solve_range(conn, low_user_id, high_user_id, now, tariffs=None):
+    """Solve and store schedules for users in [low, high]; returns {user_id: result}"""
+    tariffs = tariffs or load_tariffs(conn, now)
+    horizon_start = ceil_time(now, SLOT_MINUTES * 60)
+    results = {}
+    for user_id, user in load_inputs(conn, low_user_id, high_user_id, now).items():
+        tariff = (tariffs.get(user['tariff_name'])
+                  or tariffs.get(default_tariff_name(user['currency'])))
+        result = solve_household(user, tariff, horizon_start)
+        result['currency'] = tariff.currency
+        save_schedules(conn, user_id, result, now)
+        results[user_id] = result
+    return results
+
+def solve_user(conn, user_id, now=None):
+    """Solve and store one household on request; None without deferrable appliances"""
+    return solve_range(conn, user_id, user_id, now or datetime.now()).get(user_id)
+
+def as_datetime(value):
+    """A stored DATETIME column, whether or not the connection parses declared types"""
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+def load_schedule(conn, user_id):
+    """The household's last stored schedule in solve_household's shape, or None if never solved"""
+    household = conn.execute('SELECT * FROM household_schedules WHERE user_id = ?', (user_id,)).fetchone()
+    if household is None:
+        return None
+    # Rows from an earlier solve belong to appliances since removed or made inactive
+    rows = conn.execute('''
+        SELECT s.*, a.name, a.type
+        FROM appliance_schedules s
+        JOIN household_schedules h ON h.user_id = s.user_id AND h.solved_at = s.solved_at
+        JOIN appliances a ON a.id = s.appliance_id
+        WHERE s.user_id = ? AND a.is_active = 1
+        ORDER BY s.scheduled_start
+    ''', (user_id,)).fetchall()
+    return {
+        'schedule': [
+            {
+                'appliance_id': row['appliance_id'],
+                'name': row['name'],
+                'type': row['type'],
+                'start': as_datetime(row['scheduled_start']),
+                'end': as_datetime(row['scheduled_end']),
+                'estimated_cost': row['estimated_cost'],
+                'estimated_savings': row['estimated_savings'],
+                'peak_exceeded': bool(row['peak_exceeded'])
+            }
+            for row in rows
+        ],
+        'total_cost': household['total_cost'],
+        'lower_bound': household['lower_bound'],
+        'optimal': bool(household['optimal']),
+        'peak_power_w': household['peak_power_w'],
+        'currency': household['currency'],
+        'solved_at': as_datetime(household['solved_at'])
+    }
+
+def solve_all(db_path, workers=None, chunk_size=BATCH_CHUNK_SIZE, now=None):
+    """Batch-solve every household with deferrable appliances on a process pool"""
+    now = now or datetime.now()
+    started = time.time()
+
+    conn = sqlite3.connect(db_path)
+    user_ids = [row[0] for row in conn.execute(f'''
+        SELECT DISTINCT user_id FROM appliances
+        WHERE is_active = 1 AND type IN ({','.join('?' * len(DEFERRABLE_DEFAULTS))})
+        ORDER BY user_id
+    ''', list(DEFERRABLE_DEFAULTS))]
+    conn.close()
+
+    solved = run_in_chunks(db_path, solve_range, user_ids, chunk_size, now, workers)
+
+    print(f"Scheduled {solved} households in {time.time() - started:.2f}s")
+    return solved
+
+if __name__ == '__main__':
+    solve_all('havoc_ecowatt.db')
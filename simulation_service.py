@@ -1,18 +1,113 @@
 import random
 import time
 import threading
-from datetime import datetime, timedelta
+from datetime import datetime
 import sqlite3
 import json
 import os
 from contextlib import contextmanager
+from checkpoint import SnapshotFile, snapshot_path
+from clock import SystemClock, VirtualClock
+from config import (TICK_INTERVAL, HEARTBEAT_INTERVAL, CHECKPOINT_INTERVAL,
+                    READ_REPLICA_PATH, READ_REPLICA_MAX_STALENESS)
+from latest_readings import LatestReadingsTable, table_path
+from usage_buffer import UsageRingBuffer
+from rollup_service import RollupStore
+import data_generations
+import change_log
+import migrations
+import archive_service
+from fleet_stats import FleetStats
+from anomaly_service import AnomalyDetector
+from forecast_service import Forecaster
+from ipc import SimulatorChannel
+from maintenance_service import MaintenanceScheduler, ANALYZE_CHECK_INTERVAL, REPORT_INTERVAL
+from job_runner import JobRunner
+import read_replica
+import retention
+import report_service
+import scheduling_service
+
+# Store datetimes the same way as the web app (ISO 8601 with 'T'), which
+# registers this adapter too; the standalone daemon doesn't import app
+sqlite3.register_adapter(datetime, lambda dt: dt.isoformat())
+
+# A steady appliance holds its level: power varies by up to POWER_NOISE of
+# its run level per tick, and temperature moves TEMP_REVERSION of the way
+# back to its setpoint plus noise of TEMP_NOISE times temp_change_rate, both
+# well inside the deadbands
+POWER_NOISE = 0.02
+TEMP_REVERSION = 0.1
+TEMP_NOISE = 0.2
 
 class IoTSimulator:
-    def __init__(self, db_path='havoc_ecowatt.db'):
+    def __init__(self, db_path='havoc_ecowatt.db', deadband=True, clock=None, seed=None):
         self.db_path = db_path
+        self.clock = clock or SystemClock()
+        
+        # Seeded runs draw from one RNG stream per appliance so they are
+        # reproducible regardless of fleet order; recorder captures readings
+        self.seed = seed
+        self.rngs = {}
+        self.recorder = None
         self.running = False
         self.thread = None
         self.lock_file = 'simulation.lock'
+        self.owns_lock = False
+        self.schema_ready = False  # the database is touched on first use, not at import
+        self.snapshot = SnapshotFile(snapshot_path(db_path))
+        self.tick_count = 0
+        self.overrides = {}  # appliance_id -> forced on/off state
+        
+        # Deadband (change-only) recording state
+        self.deadband = deadband
+        self.heartbeat_interval = HEARTBEAT_INTERVAL
+        self.last_stored = {}      # appliance_id -> last reading written to the database
+        self.last_displayed = {}   # appliance_id -> last reading incremental syncs were told about
+        self.last_readings = {}    # appliance_id -> last reading generated
+        self.appliance_types = {}  # appliance_id -> appliance type
+        self.levels = {}           # appliance_id -> steady power level and temperature setpoint
+        
+        # Appliance registry, refreshed from the change log each tick
+        self.appliances = {}            # appliance_id -> appliance row
+        self.appliance_list = []        # active appliances ordered by user, id
+        self.registry_generation = None # change generation the registry reflects
+        
+        # Live fleet counters, maintained from registry changes and readings
+        self.fleet_stats = FleetStats()
+        
+        # Per-appliance power profiles that flag unusual draw as readings arrive
+        self.anomalies = AnomalyDetector()
+        
+        # 24-hour forecasts per appliance, refreshed from hourly rollups
+        self.forecaster = Forecaster()
+        
+        # 1-minute/1-hour/1-day rollups fed from every generated reading
+        self.rollups = RollupStore()
+        
+        # Latest reading per appliance, published for web workers
+        self.latest_table = LatestReadingsTable(table_path(db_path))
+        
+        # Per-user 24-hour minute buffers behind the dashboard charts
+        self.usage_buffer = UsageRingBuffer()
+        
+        # Commands for web workers, served while running
+        self.channel = SimulatorChannel()
+        self.channel.register('status', self.get_status)
+        self.channel.register('stats', self.get_user_stats)
+        self.channel.register('set_override', self.set_override)
+        self.channel.register('maintenance', lambda: self.maintenance.report())
+        self.channel.register('jobs', lambda: self.jobs.metrics())
+        self.channel.register('anomalies', lambda: self.anomalies.status())
+        self.channel.register('forecasts', lambda: self.forecaster.status())
+        
+        # ANALYZE, incremental vacuum and WAL checkpoints between ticks
+        self.maintenance = MaintenanceScheduler(db_path)
+        
+        # Periodic jobs, each run once per interval across processes
+        self.jobs = JobRunner(db_path, now=lambda: self.clock.now(),
+                              simulated=lambda: isinstance(self.clock, VirtualClock))
+        self.register_jobs()
         
         # Appliance behavior patterns
         self.appliance_patterns = {
@@ -22,7 +117,10 @@ class IoTSimulator:
                 'base_probability': 0.4,
                 'peak_hours': [14, 15, 16, 21, 22, 23],
                 'off_hours': [2, 3, 4, 5, 6],
-                'temp_change_rate': 0.5
+                'temp_change_rate': 0.5,
+                'mean_on_minutes': 45,
+                'power_deadband': 150,
+                'temp_deadband': 1.0
             },
             'refrigerator': {
                 'temp_range': (2, 8),
@@ -30,7 +128,10 @@ class IoTSimulator:
                 'base_probability': 0.9,  # Always on, compressor cycles
                 'peak_hours': [],
                 'off_hours': [],
-                'temp_change_rate': 0.2
+                'temp_change_rate': 0.2,
+                'mean_on_minutes': 20,
+                'power_deadband': 30,
+                'temp_deadband': 0.5
             },
             'washing_machine': {
                 'temp_range': (20, 60),
@@ -38,7 +139,10 @@ class IoTSimulator:
                 'base_probability': 0.05,  # Rarely on
                 'peak_hours': [9, 10, 11, 19, 20],
                 'off_hours': [0, 1, 2, 3, 4, 5, 6],
-                'temp_change_rate': 1.0
+                'temp_change_rate': 1.0,
+                'mean_on_minutes': 60,
+                'power_deadband': 150,
+                'temp_deadband': 2.0
             },
             'water_heater': {
                 'temp_range': (40, 80),
@@ -46,7 +150,10 @@ class IoTSimulator:
                 'base_probability': 0.25,
                 'peak_hours': [6, 7, 8, 18, 19, 20],
                 'off_hours': [1, 2, 3, 4],
-                'temp_change_rate': 0.8
+                'temp_change_rate': 0.8,
+                'mean_on_minutes': 20,
+                'power_deadband': 300,
+                'temp_deadband': 2.0
             },
             'television': {
                 'temp_range': (25, 45),
@@ -54,7 +161,10 @@ class IoTSimulator:
                 'base_probability': 0.3,
                 'peak_hours': [19, 20, 21, 22],
                 'off_hours': [1, 2, 3, 4, 5, 6, 7, 8],
-                'temp_change_rate': 0.3
+                'temp_change_rate': 0.3,
+                'mean_on_minutes': 90,
+                'power_deadband': 40,
+                'temp_deadband': 1.0
             },
             'microwave': {
                 'temp_range': (30, 80),
@@ -62,7 +172,10 @@ class IoTSimulator:
                 'base_probability': 0.08,  # Used briefly
                 'peak_hours': [7, 8, 12, 13, 18, 19],
                 'off_hours': [0, 1, 2, 3, 4, 5, 6],
-                'temp_change_rate': 2.0
+                'temp_change_rate': 2.0,
+                'mean_on_minutes': 3,
+                'power_deadband': 100,
+                'temp_deadband': 3.0
             },
             'dishwasher': {
                 'temp_range': (40, 70),
@@ -70,12 +183,13 @@ class IoTSimulator:
                 'base_probability': 0.1,
                 'peak_hours': [20, 21, 22],
                 'off_hours': [0, 1, 2, 3, 4, 5, 6, 7],
-                'temp_change_rate': 1.5
+                'temp_change_rate': 1.5,
+                'mean_on_minutes': 90,
+                'power_deadband': 200,
+                'temp_deadband': 2.0
             }
         }
         
-        # Initialize database
-        self.init_database()
     
     @contextmanager
     def get_db_connection(self):
@@ -88,66 +202,13 @@ class IoTSimulator:
             conn.close()
     
     def init_database(self):
-        """Initialize database tables if they don't exist"""
-        with self.get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Create appliances table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS appliances (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    name VARCHAR(100) NOT NULL,
-                    type VARCHAR(50) NOT NULL,
-                    power_rating DECIMAL(8,2),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 1,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            # Create appliance_data table for real-time data
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS appliance_data (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    appliance_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    is_on BOOLEAN NOT NULL,
-                    temperature DECIMAL(5,2),
-                    power_consumption DECIMAL(8,2) NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (appliance_id) REFERENCES appliances (id),
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            ''')
-            
-            # Create index for faster queries
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_appliance_data_timestamp 
-                ON appliance_data (appliance_id, timestamp)
-            ''')
-            
-            # Create hourly aggregated data table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS hourly_usage (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    appliance_id INTEGER NOT NULL,
-                    hour_start DATETIME NOT NULL,
-                    avg_power DECIMAL(8,2),
-                    total_energy DECIMAL(10,4),
-                    on_duration_minutes INTEGER,
-                    min_temperature DECIMAL(5,2),
-                    max_temperature DECIMAL(5,2),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(appliance_id, hour_start),
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    FOREIGN KEY (appliance_id) REFERENCES appliances (id)
-                )
-            ''')
-            
-            conn.commit()
-            print("Database tables initialized successfully")
+        """Apply pending schema migrations; runs once per instance, on first use"""
+        if self.schema_ready:
+            return
+        applied = migrations.migrate(self.db_path)
+        if applied:
+            print(f"Database schema migrated ({applied} step(s))")
+        self.schema_ready = True
     
     def get_all_appliances(self):
         """Get all active appliances from all users"""
@@ -161,6 +222,42 @@ class IoTSimulator:
             ''')
             return [dict(row) for row in cursor.fetchall()]
     
+    def refresh_appliances(self):
+        """Active appliances, applying only config changes since the last refresh"""
+        with self.get_db_connection() as conn:
+            generation = change_log.current_generation(conn)
+            if self.registry_generation is None:
+                self.appliances = {row['id']: row for row in self.get_all_appliances()}
+                self.fleet_stats.seed(self.appliances.values())
+                changed = True
+            elif generation != self.registry_generation:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT a.id, a.user_id, a.name, a.type, a.power_rating, a.is_active
+                    FROM appliance_changes c
+                    JOIN appliances a ON a.id = c.appliance_id
+                    WHERE c.config_generation > ?
+                ''', (self.registry_generation,))
+                changed = False
+                for row in cursor.fetchall():
+                    appliance = dict(row)
+                    if appliance.pop('is_active'):
+                        self.appliances[appliance['id']] = appliance
+                        self.fleet_stats.on_updated(appliance)
+                    else:
+                        self.appliances.pop(appliance['id'], None)
+                        self.fleet_stats.on_removed(appliance['id'])
+                        self.anomalies.forget(appliance['id'])
+                    changed = True
+            else:
+                changed = False
+            self.registry_generation = generation
+        
+        if changed:
+            self.appliance_list = sorted(self.appliances.values(), key=lambda a: (a['user_id'], a['id']))
+            self.appliance_types = {a['id']: a['type'] for a in self.appliance_list}
+        return self.appliance_list
+    
     def get_latest_data(self, appliance_id):
         """Get the most recent data for an appliance"""
         with self.get_db_connection() as conn:
@@ -188,37 +285,70 @@ class IoTSimulator:
         else:
             return base_prob
     
+    def get_rng(self, appliance_id):
+        """Random stream for an appliance: seeded per appliance when a seed is set"""
+        if self.seed is None:
+            return random
+        rng = self.rngs.get(appliance_id)
+        if rng is None:
+            rng = random.Random(f"{self.seed}:{appliance_id}")
+            self.rngs[appliance_id] = rng
+        return rng
+    
+    def get_level(self, appliance, pattern, rng, prev_data):
+        """Steady operating point of an appliance: its power level and temperature setpoint"""
+        level = self.levels.get(appliance['id'])
+        if level is None:
+            prev_temp = prev_data['temperature'] if prev_data else None
+            level = {
+                'power': rng.uniform(*pattern.get('power_range', (100, 1000))),
+                'setpoint': prev_temp if prev_temp is not None else rng.uniform(*pattern.get('temp_range', (20, 30))),
+                'run_power': None
+            }
+            self.levels[appliance['id']] = level
+        return level
+    
     def simulate_appliance_data(self, appliance):
         """Generate realistic data for a single appliance"""
         appliance_type = appliance['type']
         pattern = self.appliance_patterns.get(appliance_type, 
                                             self.appliance_patterns['television'])
         
-        current_hour = datetime.now().hour
+        current_time = self.clock.now()
+        current_hour = current_time.hour
+        rng = self.get_rng(appliance['id'])
         
-        # Get previous state from database
-        prev_data = self.get_latest_data(appliance['id'])
+        # Get previous state, falling back to the database on first sight
+        prev_data = self.last_readings.get(appliance['id'])
+        if prev_data is None:
+            prev_data = self.get_latest_data(appliance['id'])
+        level = self.get_level(appliance, pattern, rng, prev_data)
         
-        # Determine if appliance is on/off based on time and patterns
+        # On/off is a two-state chain: runs last mean_on_minutes on average
+        # and the share of time on matches the time-of-day probability
         on_probability = self.get_time_based_probability(appliance_type, current_hour)
-        is_on = random.random() < on_probability
+        turn_off = TICK_INTERVAL / (pattern['mean_on_minutes'] * 60)
+        turn_on = min(1.0, turn_off * on_probability / (1 - on_probability))
+        was_on = bool(prev_data['is_on']) if prev_data else False
+        is_on = rng.random() >= turn_off if was_on else rng.random() < turn_on
+        if appliance['id'] in self.overrides:
+            is_on = self.overrides[appliance['id']]
         
-        # Generate temperature based on appliance type and previous value
+        # Temperature reverts to the appliance's setpoint with small noise
         temp_range = pattern.get('temp_range', (20, 30))
-        if prev_data:
-            # Gradual temperature change
-            prev_temp = prev_data['temperature'] or random.uniform(*temp_range)
-            temp_change = random.uniform(-pattern['temp_change_rate'], 
-                                       pattern['temp_change_rate'])
-            temperature = max(temp_range[0], 
-                            min(temp_range[1], prev_temp + temp_change))
-        else:
-            temperature = random.uniform(*temp_range)
+        prev_temp = prev_data['temperature'] if prev_data else None
+        if prev_temp is None:
+            prev_temp = level['setpoint']
+        noise = pattern['temp_change_rate'] * TEMP_NOISE
+        temperature = prev_temp + TEMP_REVERSION * (level['setpoint'] - prev_temp) + rng.uniform(-noise, noise)
+        temperature = max(temp_range[0], min(temp_range[1], temperature))
         
         # Generate power consumption
         if is_on:
-            power_range = pattern.get('power_range', (100, 1000))
-            base_power = random.uniform(*power_range)
+            # Each run settles at a level near the appliance's own
+            if not was_on or level['run_power'] is None:
+                level['run_power'] = level['power'] * rng.uniform(0.9, 1.1)
+            base_power = level['run_power'] * (1 + rng.uniform(-POWER_NOISE, POWER_NOISE))
             
             # Add variance based on appliance behavior
             if appliance_type in ['air_conditioner', 'water_heater']:
@@ -232,21 +362,19 @@ class IoTSimulator:
                 
                 power_consumption = base_power * (1 + temp_factor * 0.4)
             else:
-                # Random variance for other appliances
-                variance = random.uniform(0.8, 1.2)
-                power_consumption = base_power * variance
+                power_consumption = base_power
         else:
             # Standby power (small amount)
             standby_power = {
-                'air_conditioner': random.uniform(5, 15),
-                'refrigerator': random.uniform(2, 8),
-                'television': random.uniform(1, 5),
-                'washing_machine': random.uniform(1, 3),
-                'dishwasher': random.uniform(1, 3),
-                'microwave': random.uniform(2, 8),
-                'water_heater': random.uniform(3, 10)
+                'air_conditioner': rng.uniform(5, 15),
+                'refrigerator': rng.uniform(2, 8),
+                'television': rng.uniform(1, 5),
+                'washing_machine': rng.uniform(1, 3),
+                'dishwasher': rng.uniform(1, 3),
+                'microwave': rng.uniform(2, 8),
+                'water_heater': rng.uniform(3, 10)
             }
-            power_consumption = standby_power.get(appliance_type, random.uniform(1, 5))
+            power_consumption = standby_power.get(appliance_type, rng.uniform(1, 5))
         
         return {
             'appliance_id': appliance['id'],
@@ -254,7 +382,7 @@ class IoTSimulator:
             'is_on': is_on,
             'temperature': round(temperature, 2),
             'power_consumption': round(power_consumption, 2),
-            'timestamp': datetime.now()
+            'timestamp': current_time
         }
     
     def update_database(self, data_list):
@@ -273,73 +401,214 @@ class IoTSimulator:
                 for data in data_list
             ])
             
+            # Cached API responses for these users are now stale
+            data_generations.bump(conn, [data['user_id'] for data in data_list])
+            
             conn.commit()
     
-    def cleanup_old_data(self):
-        """Remove data older than 30 days to prevent database bloat"""
-        cutoff_date = datetime.now() - timedelta(days=30)
+    def should_store(self, data):
+        """Check whether a reading differs enough from the last stored one to be written"""
+        last = self.last_stored.get(data['appliance_id'])
+        if last is None:
+            return True
+        
+        # State changes and heartbeats are always recorded
+        if (data['timestamp'] - last['timestamp']).total_seconds() >= self.heartbeat_interval:
+            return True
+        return self.differs(data, last)
+    
+    def differs(self, data, last):
+        """Whether a reading is a state change or moved beyond its appliance's deadbands from `last`"""
+        if bool(data['is_on']) != bool(last['is_on']):
+            return True
+        
+        appliance_type = self.appliance_types.get(data['appliance_id'])
+        pattern = self.appliance_patterns.get(appliance_type,
+                                            self.appliance_patterns['television'])
+        if abs(data['power_consumption'] - last['power_consumption']) > pattern['power_deadband']:
+            return True
+        if (data['temperature'] is not None and last['temperature'] is not None
+                and abs(data['temperature'] - last['temperature']) > pattern['temp_deadband']):
+            return True
+        return False
+    
+    def ingest_readings(self, data_list):
+        """Write path for new readings, dropping unchanged ones in deadband mode"""
+        for data in data_list:
+            self.last_readings[data['appliance_id']] = data
+        
+        if self.recorder:
+            self.recorder.write(data_list)
         
+        self.usage_buffer.add_readings(data_list)
+        self.fleet_stats.observe_readings(data_list)
+        anomalies = self.anomalies.observe(data_list)
+        
+        # Incremental syncs hear about an appliance when what they show moves
+        # past its deadbands, whether or not the reading is stored; heartbeat
+        # rows change nothing they display
+        displayed = []
+        for data in data_list:
+            last = self.last_displayed.get(data['appliance_id'])
+            if last is None or self.differs(data, last):
+                displayed.append(data)
+                self.last_displayed[data['appliance_id']] = data
+        
+        # Rollups see every reading so they stay exact in deadband mode
         with self.get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                DELETE FROM appliance_data 
-                WHERE timestamp < ?
-            ''', (cutoff_date,))
+            self.rollups.add_readings(conn, data_list)
+            if displayed:
+                change_log.record_readings(conn, displayed)
+            if anomalies:
+                self.anomalies.record(conn, anomalies)
+            conn.commit()
+        
+        # Live polls wake on this publish, so it follows the commit: whatever
+        # they read next already includes the tick's generation bumps
+        self.latest_table.publish(data_list)
+        
+        if self.deadband:
+            data_list = [data for data in data_list if self.should_store(data)]
+        
+        if data_list:
+            self.update_database(data_list)
+            for data in data_list:
+                self.last_stored[data['appliance_id']] = data
+        
+        return len(data_list)
+    
+    def register_jobs(self):
+        """Declare the simulator's periodic jobs (intervals in simulated seconds)"""
+        self.jobs.register('reading_retention', 3600, self.cleanup_old_data)
+        self.jobs.register('rollup_retention', 3600, self.cleanup_old_rollups)
+        self.jobs.register('auth_cleanup', 3600, self.cleanup_expired_auth)
+        self.jobs.register('fleet_reconcile', 3600, self.reconcile_fleet_stats)
+        self.jobs.register('analyze_check', ANALYZE_CHECK_INTERVAL, self.maintenance.check_statistics)
+        self.jobs.register('maintenance_report', REPORT_INTERVAL, self.maintenance.print_report, catch_up=False)
+        self.jobs.register('reports', 86400,
+                           lambda: report_service.generate_all(self.db_path, now=self.clock.now()))
+        self.jobs.register('schedules', 86400,
+                           lambda: scheduling_service.solve_all(self.db_path, now=self.clock.now()))
+        self.jobs.register('rollup_backfill', 600, lambda: migrations.run_backfill(self.db_path))
+        self.jobs.register('forecasts', 3600, lambda: self.forecaster.refresh_db(self.db_path, now=self.clock.now()))
+        if READ_REPLICA_PATH:
+            # Staleness is a wall-clock bound, whatever the simulation speed
+            self.jobs.register('read_replica', READ_REPLICA_MAX_STALENESS / 2,
+                               lambda: read_replica.refresh(self.db_path, READ_REPLICA_PATH),
+                               clock=datetime.now)
+    
+    def cleanup_old_data(self):
+        """Remove raw readings past retention to prevent database bloat"""
+        with self.get_db_connection() as conn:
+            deleted_count = retention.purge_readings(conn, self.clock.now())
+            conn.commit()
             
-            deleted_count = cursor.rowcount
+            if deleted_count > 0:
+                print(f"{'Archived' if archive_service.enabled() else 'Cleaned up'} {deleted_count} old records")
+                self.maintenance.check_statistics(conn)
+    
+    def cleanup_old_rollups(self):
+        """Drop rollup rows past each tier's retention"""
+        with self.get_db_connection() as conn:
+            deleted_count = self.rollups.cleanup(conn, self.clock.now())
             conn.commit()
             
             if deleted_count > 0:
-                print(f"Cleaned up {deleted_count} old records")
+                print(f"Cleaned up {deleted_count} old rollup rows")
+    
+    def cleanup_expired_auth(self):
+        """Expire old sessions and tokens"""
+        with self.get_db_connection() as conn:
+            retention.purge_expired_auth(conn, datetime.now())
+            conn.commit()
+    
+    def reconcile_fleet_stats(self):
+        with self.get_db_connection() as conn:
+            self.fleet_stats.reconcile(conn)
     
     def get_user_stats(self):
         """Get statistics about active users and appliances"""
-        with self.get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Count active users
-            cursor.execute('''
-                SELECT COUNT(DISTINCT user_id) as user_count
-                FROM appliances
-                WHERE is_active = 1
-            ''')
-            user_count = cursor.fetchone()[0]
-            
-            # Count total appliances
-            cursor.execute('''
-                SELECT COUNT(*) as appliance_count
-                FROM appliances
-                WHERE is_active = 1
-            ''')
-            appliance_count = cursor.fetchone()[0]
-            
-            # Count by appliance type
-            cursor.execute('''
-                SELECT type, COUNT(*) as count
-                FROM appliances
-                WHERE is_active = 1
-                GROUP BY type
-            ''')
-            type_counts = dict(cursor.fetchall())
-            
-            return {
-                'users': user_count,
-                'appliances': appliance_count,
-                'by_type': type_counts
-            }
+        if not self.fleet_stats.seeded:
+            self.init_database()
+            with self.get_db_connection() as conn:
+                self.fleet_stats.reconcile(conn)
+        return self.fleet_stats.snapshot()
+    
+    def set_override(self, appliance_id, is_on):
+        """Force an appliance on or off; None returns it to simulated behavior"""
+        if is_on is None:
+            self.overrides.pop(appliance_id, None)
+        else:
+            self.overrides[appliance_id] = bool(is_on)
+        return self.overrides.get(appliance_id)
+    
+    def get_status(self):
+        """Liveness details for the daemon's command channel"""
+        return {
+            'pid': os.getpid(),
+            'running': self.running,
+            'tick_count': self.tick_count,
+            'simulated_time': self.clock.now().isoformat()
+        }
+    
+    def checkpoint(self):
+        """Snapshot in-memory simulator state for a warm restart"""
+        self.snapshot.write({
+            'tick_count': self.tick_count,
+            'last_readings': self.last_readings,
+            'last_stored': self.last_stored,
+            'overrides': self.overrides,
+            'levels': self.levels,
+            'seed': self.seed,
+            'rng_states': {appliance_id: rng.getstate() for appliance_id, rng in self.rngs.items()},
+            'anomaly_profiles': self.anomalies.state(),
+            'saved_at': self.clock.now()
+        })
+    
+    def restore_checkpoint(self):
+        """Reload state from the last snapshot, if there is one"""
+        try:
+            state = self.snapshot.read()
+        except Exception as e:
+            print(f"Could not read simulation snapshot: {e}")
+            return False
+        if state is None:
+            return False
+        
+        self.tick_count = state['tick_count']
+        self.last_readings = state['last_readings']
+        self.last_stored = state['last_stored']
+        self.overrides = state['overrides']
+        self.levels = state.get('levels', {})
+        if 'anomaly_profiles' in state:
+            self.anomalies.restore(state['anomaly_profiles'])
+        if self.seed is not None and state['seed'] == self.seed:
+            for appliance_id, rng_state in state['rng_states'].items():
+                rng = random.Random()
+                rng.setstate(rng_state)
+                self.rngs[appliance_id] = rng
+        
+        print(f"Restored simulation state from {state['saved_at']} "
+              f"({len(self.last_readings)} appliances, tick {self.tick_count})")
+        return True
     
     def run_simulation(self):
         """Main simulation loop for all users"""
-        cleanup_counter = 0
-        
         while self.running:
+            if self.clock.finished():
+                print(f"Simulation reached end of simulated range at {self.clock.now()}")
+                self.running = False
+                break
+            
             try:
+                tick_started = time.monotonic()
+                
                 # Get all active appliances from ALL users
-                appliances = self.get_all_appliances()
+                appliances = self.refresh_appliances()
                 
                 if not appliances:
                     print("No appliances found, waiting...")
-                    time.sleep(10)
+                    self.clock.sleep(TICK_INTERVAL)
                     continue
                 
                 # Generate data for ALL appliances
@@ -349,26 +618,30 @@ class IoTSimulator:
                     all_data.append(data)
                 
                 # Bulk update database
-                self.update_database(all_data)
+                stored_count = self.ingest_readings(all_data)
                 
-                # Get statistics
-                stats = self.get_user_stats()
+                # Get statistics (once per simulated hour when time is accelerated)
+                if not isinstance(self.clock, VirtualClock) or self.tick_count % 360 == 0:
+                    stats = self.get_user_stats()
+                    
+                    print(f"[{self.clock.now().strftime('%Y-%m-%d %H:%M:%S')}] Updated {len(appliances)} appliances "
+                          f"({stored_count} readings stored) "
+                          f"for {stats['users']} users - Types: {stats['by_type']}")
                 
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] Updated {len(appliances)} appliances "
-                      f"for {stats['users']} users - Types: {stats['by_type']}")
+                self.tick_count += 1
                 
-                # Cleanup old data every hour (360 iterations * 10 seconds)
-                cleanup_counter += 1
-                if cleanup_counter >= 360:
-                    self.cleanup_old_data()
-                    cleanup_counter = 0
+                if self.tick_count % CHECKPOINT_INTERVAL == 0:
+                    self.checkpoint()
                 
-                # Wait 10 seconds before next update
-                time.sleep(10)
+                # Database upkeep in the gap before the next tick
+                self.maintenance.after_tick(tick_started)
+                
+                # Wait 10 seconds (of simulated time) before next update
+                self.clock.sleep(TICK_INTERVAL)
                 
             except Exception as e:
                 print(f"Simulation error: {e}")
-                time.sleep(10)
+                self.clock.sleep(TICK_INTERVAL)
     
     def is_simulation_running(self):
         """Check if simulation is already running via lock file"""
@@ -425,10 +698,24 @@ class IoTSimulator:
         if not self.create_lock_file():
             print("Could not create lock file, simulation may already be running")
             return
+        self.owns_lock = True
+        
+        self.init_database()
+        with self.get_db_connection() as conn:
+            self.maintenance.prepare(conn)
+        
+        # Warm restart: pick up appliance state without per-appliance queries
+        self.restore_checkpoint()
         
         self.running = True
         self.thread = threading.Thread(target=self.run_simulation, daemon=True)
         self.thread.start()
+        self.jobs.start()
+        
+        try:
+            self.channel.start()
+        except OSError as e:
+            print(f"Command channel unavailable: {e}")
         
         stats = self.get_user_stats()
         print(f"IoT Simulation started for {stats['users']} users with {stats['appliances']} appliances")
@@ -436,19 +723,72 @@ class IoTSimulator:
     def stop(self):
         """Stop the simulation service"""
         self.running = False
+        self.channel.stop()
+        self.jobs.stop()
         if self.thread:
             self.thread.join(timeout=5)
-        self.remove_lock_file()
+            self.checkpoint()
+        
+        # Nothing to persist or release in an instance that never ran,
+        # e.g. a web worker that only imported the module
+        if not self.schema_ready:
+            return
+        
+        # Persist partially filled minutes
+        with self.get_db_connection() as conn:
+            self.rollups.flush(conn)
+            conn.commit()
+        
+        if self.owns_lock:
+            self.remove_lock_file()
+            self.owns_lock = False
         print("IoT Simulation stopped")
 
 # Global simulator instance
 simulator = IoTSimulator()
 
 if __name__ == "__main__":
-    # For testing the simulator independently
+    import argparse
+    import signal
+    
+    parser = argparse.ArgumentParser(description='Run the IoT simulator/ingest daemon')
+    parser.add_argument('--start', type=datetime.fromisoformat,
+                        help='Simulate from this date instead of wall-clock time')
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        help='Stop once simulated time reaches this date')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='Simulated seconds per real second (0 = as fast as possible)')
+    parser.add_argument('--seed', type=int,
+                        help='Seed per-appliance random streams for a reproducible run')
+    parser.add_argument('--record', metavar='PATH',
+                        help='Capture every generated reading to a binary log')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='Feed a recorded log through the write path instead of simulating')
+    args = parser.parse_args()
+    
+    if args.replay:
+        from recorder import ReadingReplayer
+        ReadingReplayer(simulator, args.replay, args.speed or None).run()
+        simulator.stop()
+        raise SystemExit(0)
+    
+    if args.start:
+        simulator.clock = VirtualClock(args.start, args.end, args.speed or None)
+    if args.seed is not None:
+        simulator.seed = args.seed
+    if args.record:
+        from recorder import ReadingRecorder
+        simulator.recorder = ReadingRecorder(args.record)
+    
+    # Standalone daemon: web workers (wsgi.py) reach it over SIMULATOR_SOCKET_PATH
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     simulator.start()
     try:
-        while True:
+        while simulator.running:
             time.sleep(1)
     except KeyboardInterrupt:
+        pass
+    finally:
         simulator.stop()
+        if simulator.recorder:
+            simulator.recorder.close()
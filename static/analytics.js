@@ -4,6 +4,10 @@ class AnalyticsManager {
     constructor() {
         this.charts = {};
         this.dateRange = '30d';
+        this.userId = window.sessionData ? window.sessionData.userId : 1;
+        this.currencySymbol = '₹';
+        this.analyticsRequest = null;
+        this.analyticsData = null;
         this.init();
     }
 
@@ -48,7 +52,6 @@ class AnalyticsManager {
         try {
             this.showLoading();
             
-            // Simulate API calls for analytics data
             const [overviewData, consumptionData, applianceData, costData] = await Promise.all([
                 this.fetchOverviewData(),
                 this.fetchConsumptionData(),
@@ -70,68 +73,56 @@ class AnalyticsManager {
         }
     }
 
-    async fetchOverviewData() {
-        // Simulate API call
-        return new Promise(resolve => {
-            setTimeout(() => {
-                resolve({
-                    totalEnergy: 1247,
-                    totalCost: 187.50,
-                    efficiencyScore: 85,
-                    carbonFootprint: 542,
-                    changes: {
-                        energy: -12,
-                        cost: -8,
-                        efficiency: 5,
-                        carbon: -15
+    fetchAnalytics() {
+        // One request per range serves every section of the page
+        if (!this.analyticsRequest || this.analyticsRequest.range !== this.dateRange) {
+            const promise = fetch(`/api/analytics/${this.userId}?range=${this.dateRange}`)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`Analytics request failed (${response.status})`);
                     }
+                    return response.json();
+                })
+                .then(data => {
+                    this.currencySymbol = data.currency_symbol;
+                    this.analyticsData = data;
+                    return data;
                 });
-            }, 500);
-        });
+            promise.catch(() => { this.analyticsRequest = null; });
+            this.analyticsRequest = { range: this.dateRange, promise };
+        }
+        return this.analyticsRequest.promise;
+    }
+
+    async fetchOverviewData() {
+        const data = await this.fetchAnalytics();
+        return {
+            totalEnergy: data.overview.total_energy,
+            totalCost: data.overview.total_cost,
+            efficiencyScore: data.overview.efficiency_score,
+            carbonFootprint: data.overview.carbon_footprint,
+            changes: data.overview.changes
+        };
     }
 
     async fetchConsumptionData() {
-        // Generate sample consumption data
-        const days = this.getDaysInRange();
-        const data = [];
-        
-        for (let i = 0; i < days; i++) {
-            const date = new Date();
-            date.setDate(date.getDate() - (days - 1 - i));
-            data.push({
-                date: date.toISOString().split('T')[0],
-                consumption: Math.random() * 50 + 20 // 20-70 kWh
-            });
-        }
-        
-        return data;
+        const data = await this.fetchAnalytics();
+        return data.consumption;
     }
 
     async fetchApplianceData() {
-        return [
-            { name: 'Air Conditioner', consumption: 35.2, color: '#3b82f6' },
-            { name: 'Refrigerator', consumption: 28.7, color: '#10b981' },
-            { name: 'Water Heater', consumption: 18.3, color: '#f59e0b' },
-            { name: 'Washing Machine', consumption: 12.1, color: '#8b5cf6' },
-            { name: 'Television', consumption: 8.4, color: '#ef4444' },
-            { name: 'Microwave', consumption: 4.8, color: '#06b6d4' }
-        ];
+        const colors = ['#3b82f6', '#10b981', '#f59e0b', '#8b5cf6', '#ef4444', '#06b6d4'];
+        const data = await this.fetchAnalytics();
+        return data.appliances.map((appliance, index) => ({
+            name: appliance.name,
+            consumption: appliance.consumption,
+            color: colors[index % colors.length]
+        }));
     }
 
     async fetchCostData() {
-        const days = Math.min(this.getDaysInRange(), 30);
-        const data = [];
-        
-        for (let i = 0; i < days; i++) {
-            const date = new Date();
-            date.setDate(date.getDate() - (days - 1 - i));
-            data.push({
-                date: date.toISOString().split('T')[0],
-                cost: Math.random() * 15 + 5 // $5-20 per day
-            });
-        }
-        
-        return data;
+        const data = await this.fetchAnalytics();
+        return data.cost;
     }
 
     getDaysInRange() {
@@ -147,7 +138,7 @@ class AnalyticsManager {
 
     updateOverviewCards(data) {
         document.getElementById('totalEnergy').textContent = `${data.totalEnergy.toLocaleString()} kWh`;
-        document.getElementById('totalCost').textContent = `$${data.totalCost.toFixed(2)}`;
+        document.getElementById('totalCost').textContent = `${this.currencySymbol}${data.totalCost.toFixed(2)}`;
         document.getElementById('efficiencyScore').textContent = `${data.efficiencyScore}%`;
         document.getElementById('carbonFootprint').textContent = `${data.carbonFootprint} kg CO₂`;
 
@@ -163,6 +154,11 @@ class AnalyticsManager {
         cards.forEach(card => {
             if (card.classList.contains(type)) {
                 const indicator = card.querySelector('.metric-change');
+                if (change === null || change === undefined) {
+                    indicator.className = 'metric-change';
+                    indicator.innerHTML = 'No data for last period';
+                    return;
+                }
                 const isPositive = (type === 'efficiency' && change > 0) || 
                                  (type !== 'efficiency' && change < 0);
                 
@@ -464,12 +460,21 @@ class AnalyticsManager {
     }
 
     updatePeakUsageChart() {
-        // Peak usage data is relatively static, just update if needed
+        // Sum the average hour-of-day profile into the chart's 3-hour slots
+        const profile = this.analyticsData ? this.analyticsData.hourly_profile : [];
+        const slots = this.charts.peakUsage.data.labels.map((_, slot) =>
+            profile.slice(slot * 3, slot * 3 + 3).reduce((sum, value) => sum + value, 0));
+        this.charts.peakUsage.data.datasets[0].data = slots.map(value => Number(value.toFixed(2)));
         this.charts.peakUsage.update();
     }
 
     updateComparisonChart() {
         const comparisonType = document.getElementById('comparisonType').value;
+        const comparison = this.analyticsData ? this.analyticsData.comparison : null;
+        if (comparison) {
+            this.charts.comparison.data.labels = comparison.current.map((_, index) => `Part ${index + 1}`);
+            this.charts.comparison.data.datasets[0].data = comparison.current;
+        }
         
         // Update chart based on comparison type
         let secondDataset;
@@ -477,7 +482,7 @@ class AnalyticsManager {
             case 'previous':
                 secondDataset = {
                     label: 'Previous Period',
-                    data: [95, 88, 102, 86],
+                    data: comparison ? comparison.previous : [95, 88, 102, 86],
                     backgroundColor: '#e5e7eb'
                 };
                 break;
@@ -491,7 +496,7 @@ class AnalyticsManager {
             case 'target':
                 secondDataset = {
                     label: 'Target Goal',
-                    data: [70, 68, 75, 72],
+                    data: comparison ? comparison.target : [70, 68, 75, 72],
                     backgroundColor: '#ef4444'
                 };
                 break;
@@ -503,71 +508,24 @@ class AnalyticsManager {
 
     updateAnalyticsTable() {
         const tableBody = document.getElementById('analyticsTableBody');
-        const appliances = [
-            {
-                name: 'Living Room AC',
-                type: 'Air Conditioner',
-                energy: 35.2,
-                cost: 52.80,
-                hours: 8.5,
-                efficiency: 82,
-                trend: 'up'
-            },
-            {
-                name: 'Kitchen Fridge',
-                type: 'Refrigerator',
-                energy: 28.7,
-                cost: 43.05,
-                hours: 24,
-                efficiency: 91,
-                trend: 'down'
-            },
-            {
-                name: 'Main Water Heater',
-                type: 'Water Heater',
-                energy: 18.3,
-                cost: 27.45,
-                hours: 4.2,
-                efficiency: 75,
-                trend: 'up'
-            },
-            {
-                name: 'Laundry Washer',
-                type: 'Washing Machine',
-                energy: 12.1,
-                cost: 18.15,
-                hours: 2.1,
-                efficiency: 88,
-                trend: 'down'
-            },
-            {
-                name: 'Master Bedroom TV',
-                type: 'Television',
-                energy: 8.4,
-                cost: 12.60,
-                hours: 6.3,
-                efficiency: 93,
-                trend: 'stable'
-            },
-            {
-                name: 'Kitchen Microwave',
-                type: 'Microwave',
-                energy: 4.8,
-                cost: 7.20,
-                hours: 1.2,
-                efficiency: 89,
-                trend: 'down'
-            }
-        ];
+        const appliances = (this.analyticsData ? this.analyticsData.appliances : []).map(appliance => ({
+            name: appliance.name,
+            type: appliance.type.replace(/_/g, ' ').replace(/\b\w/g, c => c.toUpperCase()),
+            energy: appliance.consumption,
+            cost: appliance.cost,
+            hours: appliance.hours,
+            share: appliance.share,
+            trend: appliance.trend
+        }));
 
         tableBody.innerHTML = appliances.map(appliance => `
             <tr>
                 <td>${appliance.name}</td>
                 <td>${appliance.type}</td>
                 <td>${appliance.energy.toFixed(1)} kWh</td>
-                <td>$${appliance.cost.toFixed(2)}</td>
+                <td>${this.currencySymbol}${appliance.cost.toFixed(2)}</td>
                 <td>${appliance.hours.toFixed(1)}h</td>
-                <td>${appliance.efficiency}%</td>
+                <td>${appliance.share}%</td>
                 <td>
                     <span class="trend-indicator trend-${appliance.trend}">
                         <i class="fas fa-arrow-${appliance.trend === 'up' ? 'up' : appliance.trend === 'down' ? 'down' : 'right'}"></i>
@@ -3,6 +3,7 @@
 class ApplianceManager {
     constructor() {
         this.appliances = [];
+        this.generation = 0;  // change generation the list reflects
         this.selectedAppliance = null;
         // Get user ID from session data passed from backend
         this.userId = window.sessionData ? window.sessionData.userId : 1;
@@ -46,9 +47,15 @@ class ApplianceManager {
     async loadAppliances() {
         try {
             this.showLoading();
-            const response = await fetch(`/api/appliances/${this.userId}`);
+            // Only appliances changed since the last load are sent
+            const response = await fetch(`/api/appliances/${this.userId}?since=${this.generation}`);
             if (response.ok) {
-                this.appliances = await response.json();
+                const changes = await response.json();
+                const byId = new Map(this.generation ? this.appliances.map(a => [a.id, a]) : []);
+                changes.removed.forEach(id => byId.delete(id));
+                changes.appliances.forEach(appliance => byId.set(appliance.id, appliance));
+                this.appliances = [...byId.values()].sort((a, b) => a.name.localeCompare(b.name));
+                this.generation = changes.generation;
                 this.renderAppliances();
             } else {
                 this.showError('Failed to load appliances');
@@ -3,7 +3,10 @@ class EnergyDashboard {
     constructor() {
         // Get user ID from session data passed from backend
         this.currentUserId = window.sessionData ? window.sessionData.userId : 1;
-        this.updateInterval = 10000; // 10 seconds
+        this.updateInterval = 10000; // 10 seconds, one simulation tick
+        this.updateTimer = null;
+        this.dashboardETag = null;   // version of the sections last rendered
+        this.livePolling = false;    // a /api/live long poll loop is running
         this.charts = {};
         this.isUpdating = false;
         
@@ -152,39 +155,79 @@ class EnergyDashboard {
         }
     }
     
-    // Real-time data updates
+    // Real-time data updates: a long poll that the server answers on each
+    // simulation tick. The timer restarts it after a failure and polls with
+    // the last ETag meanwhile, so an unchanged dashboard costs a 304
     startRealTimeUpdates() {
-        this.updateDashboard();
-        this.updateInterval = setInterval(() => {
-            this.updateDashboard();
+        this.pollLive();
+        this.updateTimer = setInterval(() => {
+            if (!this.livePolling) this.pollLive();
         }, this.updateInterval);
         
-        // Pause updates when page is hidden
+        // Pause updates when page is hidden; the loop stops after its current poll
         document.addEventListener('visibilitychange', () => {
-            if (document.hidden) {
-                clearInterval(this.updateInterval);
-            } else {
-                this.startRealTimeUpdates();
-            }
+            if (!document.hidden) this.pollLive();
         });
     }
     
+    async pollLive() {
+        if (this.livePolling || document.hidden) return;
+        this.livePolling = true;
+        let tick = null;
+        let anomaly = null;
+        
+        try {
+            while (!document.hidden) {
+                const query = tick === null ? '' : `?tick=${tick}&anomaly=${anomaly}`;
+                const response = await fetch(`/api/live/${this.currentUserId}${query}`, { cache: 'no-store' });
+                if (!response.ok) throw new Error(`live poll returned ${response.status}`);
+                const data = await response.json();
+                tick = data.tick;
+                anomaly = data.anomaly;
+                if (data.dashboard) this.renderDashboard(data.dashboard);
+                (data.anomalies || []).forEach(event => {
+                    this.showNotification(`${event.appliance_name} is drawing ${Math.round(event.power_consumption)} W ` +
+                                          `(usually ~${Math.round(event.expected_power)} W)`, 'warning');
+                });
+                if (data.retry_after) {
+                    await new Promise(resolve => setTimeout(resolve, data.retry_after * 1000));
+                }
+            }
+        } catch (error) {
+            console.error('Live updates interrupted:', error);
+            this.updateDashboard();
+        } finally {
+            this.livePolling = false;
+        }
+    }
+    
+    renderDashboard(data) {
+        // Update overview metrics
+        this.updateOverviewMetrics(data);
+        
+        // Update appliances list
+        this.updateAppliancesList(data.appliances || []);
+        
+        // Update charts
+        this.updateUsageChart();
+        
+        // Update real-time indicator
+        this.updateRealTimeIndicator();
+    }
+    
     async updateDashboard() {
         if (this.isUpdating) return;
         this.isUpdating = true;
         
         try {
-            // Update overview metrics
-            await this.updateOverviewMetrics();
-            
-            // Update appliances list
-            await this.updateAppliancesList();
-            
-            // Update charts
-            this.updateUsageChart();
-            
-            // Update real-time indicator
-            this.updateRealTimeIndicator();
+            // One round-trip for everything the refresh needs
+            const headers = this.dashboardETag ? { 'If-None-Match': this.dashboardETag } : {};
+            const response = await fetch(`/api/dashboard/${this.currentUserId}?sections=totals,cost,appliances`,
+                                         { headers, cache: 'no-store' });
+            if (response.status === 304) return;
+            const data = await response.json();
+            this.dashboardETag = response.headers.get('ETag');
+            this.renderDashboard(data);
             
         } catch (error) {
             console.error('Failed to update dashboard:', error);
@@ -193,11 +236,8 @@ class EnergyDashboard {
         }
     }
     
-    async updateOverviewMetrics() {
+    updateOverviewMetrics(data) {
         try {
-            const response = await fetch(`/api/dashboard-data/${this.currentUserId}`);
-            const data = await response.json();
-            
             // Update current power
             const currentPower = data.total_power || 0;
             document.getElementById('currentPower').textContent = `${currentPower.toLocaleString()} W`;
@@ -210,20 +250,17 @@ class EnergyDashboard {
             const dailyUsage = (currentPower * 24 / 1000).toFixed(1);
             document.getElementById('dailyUsage').textContent = `${dailyUsage} kWh`;
             
-            // Calculate monthly cost (simplified)
-            const monthlyCost = (dailyUsage * 30 * 5.8).toFixed(0);
-            document.getElementById('monthlyCost').textContent = `₹${monthlyCost}`;
+            // Projected monthly cost under the user's tariff
+            const monthlyCost = (data.estimated_monthly_cost || 0).toFixed(0);
+            document.getElementById('monthlyCost').textContent = `${data.currency_symbol || '₹'}${monthlyCost}`;
             
         } catch (error) {
             console.error('Failed to update overview metrics:', error);
         }
     }
     
-    async updateAppliancesList() {
+    updateAppliancesList(appliances) {
         try {
-            const response = await fetch(`/api/appliances/${this.currentUserId}`);
-            const appliances = await response.json();
-            
             const container = document.getElementById('appliancesList');
             if (!container) return;
             
@@ -387,7 +424,7 @@ class EnergyDashboard {
             if (result.success) {
                 this.closeAddApplianceModal();
                 this.showNotification('Appliance added successfully!', 'success');
-                this.updateAppliancesList();
+                this.updateDashboard();
                 event.target.reset();
             } else {
                 this.showNotification(result.error || 'Failed to add appliance', 'error');
@@ -472,8 +509,7 @@ class EnergyDashboard {
     
     loadInitialData() {
         // Load any initial data that doesn't require real-time updates
-        this.updateOverviewMetrics();
-        this.updateAppliancesList();
+        this.updateDashboard();
     }
     
     showNotification(message, type = 'info') {
@@ -485,7 +521,7 @@ class EnergyDashboard {
             top: 20px;
             right: 20px;
             padding: 1rem 1.5rem;
-            background: ${type === 'success' ? '#10b981' : type === 'error' ? '#ef4444' : '#667eea'};
+            background: ${type === 'success' ? '#10b981' : type === 'error' ? '#ef4444' : type === 'warning' ? '#f59e0b' : '#667eea'};
             color: white;
             border-radius: 8px;
             box-shadow: 0 4px 20px rgba(0, 0, 0, 0.15);
@@ -0,0 +1,197 @@
+import calendar
+import json
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from rollup_service import query_usage
+
+# Tariff definitions live in the tariffs table (seeded by migrations 2 and
+# 10). Slab limits are cumulative kWh within the billing period (None = no
+# upper limit); TOU multipliers scale the slab rate for the listed hours of
+# day. Versions take effect from effective_from, stored the way the sqlite3
+# datetime adapter writes it (ISO 8601 with 'T') so it compares as text
+# against datetime parameters.
+
+# Tariff for users who haven't picked one, by user_preferences.currency;
+# every currency users can choose has one, so bills stay in their currency
+DEFAULT_TARIFF_BY_CURRENCY = {'INR': 'flat_inr', 'USD': 'flat_usd', 'EUR': 'flat_eur', 'GBP': 'flat_gbp'}
+DEFAULT_TARIFF_NAME = 'flat_inr'
+
+CURRENCY_SYMBOLS = {'INR': '₹', 'USD': '$', 'EUR': '€', 'GBP': '£'}
+
+def billing_period(now):
+    """Calendar month containing `now` as (start, end)"""
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    days = calendar.monthrange(now.year, now.month)[1]
+    return start, start + timedelta(days=days)
+
+class Tariff:
+    """One version of a tariff definition"""
+
+    def __init__(self, tariff_id, name, version, currency, definition):
+        self.id = tariff_id
+        self.name = name
+        self.version = version
+        self.currency = currency
+        self.fixed_charge = definition.get('fixed_charge', 0)
+
+        # Cumulative cost at each slab boundary, for piecewise-linear interpolation
+        limits, rates = [0.0], []
+        for limit, rate in definition['slabs']:
+            rates.append(rate)
+            if limit is not None:
+                limits.append(float(limit))
+        self.slab_limits = np.array(limits)
+        self.slab_rates = np.array(rates)
+        self.slab_costs = np.concatenate(([0.0], np.cumsum(np.diff(self.slab_limits) * self.slab_rates[:len(limits) - 1])))
+
+        self.hour_multipliers = np.ones(24)
+        for window in definition.get('tou', []):
+            self.hour_multipliers[window['hours']] = window['multiplier']
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row['id'], row['name'], row['version'], row['currency'], json.loads(row['definition']))
+
+    def cumulative_cost(self, kwh):
+        """Slab cost of the first `kwh` units of the period (vectorized)"""
+        kwh = np.asarray(kwh, dtype=np.float64)
+        tier = np.searchsorted(self.slab_limits, kwh, side='right') - 1
+        return self.slab_costs[tier] + (kwh - self.slab_limits[tier]) * self.slab_rates[tier]
+
+    def marginal_rate(self, kwh):
+        """Slab rate for the next unit after `kwh` units this period"""
+        tier = int(np.searchsorted(self.slab_limits, kwh, side='right')) - 1
+        return float(self.slab_rates[tier])
+
+    def energy_costs(self, kwh, hours):
+        """Cost of each hourly bucket given its kWh and hour of day, in period order"""
+        cumulative = np.cumsum(kwh)
+        slab_costs = np.diff(self.cumulative_cost(cumulative), prepend=0.0)
+        return slab_costs * self.hour_multipliers[hours]
+
+    def bill(self, kwh, hours):
+        """Bill for a period's hourly buckets"""
+        costs = self.energy_costs(kwh, hours)
+        energy_charge = float(costs.sum())
+        return {
+            'energy_kwh': round(float(np.sum(kwh)), 3),
+            'energy_charge': round(energy_charge, 2),
+            'fixed_charge': round(self.fixed_charge, 2),
+            'total': round(energy_charge + self.fixed_charge, 2)
+        }
+
+def load_tariffs(conn, now=None):
+    """Latest effective version of every tariff, by name"""
+    rows = conn.execute('''
+        SELECT * FROM tariffs
+        WHERE effective_from <= ?
+        ORDER BY name, version
+    ''', (now or datetime.now(),)).fetchall()
+    return {row['name']: Tariff.from_row(row) for row in rows}
+
+def default_tariff_name(currency):
+    """Tariff for users who haven't picked one"""
+    return DEFAULT_TARIFF_BY_CURRENCY.get(currency, DEFAULT_TARIFF_NAME)
+
+class TariffEngine:
+    """Bills per user from hourly rollups with cached closed-hour buckets"""
+
+    def __init__(self):
+        # (user_id, tariff_id, period_start) -> closed hourly buckets for the period
+        self.bill_cache = {}
+        self.lock = threading.Lock()
+
+    def get_user_tariff(self, conn, user_id, now=None):
+        """Latest version effective at `now` of the user's tariff (or their currency's default)"""
+        choice = conn.execute('''
+            SELECT
+                (SELECT tariff_name FROM user_tariffs WHERE user_id = ?) AS tariff_name,
+                (SELECT currency FROM user_preferences WHERE user_id = ?) AS currency
+        ''', (user_id, user_id)).fetchone()
+        fallback = default_tariff_name(choice['currency'])
+        tariff_name = choice['tariff_name'] or fallback
+
+        row = conn.execute('''
+            SELECT * FROM tariffs
+            WHERE name IN (?, ?) AND effective_from <= ?
+            ORDER BY name = ? DESC, version DESC
+            LIMIT 1
+        ''', (tariff_name, fallback, now or datetime.now(), tariff_name)).fetchone()
+        return Tariff.from_row(row)
+
+    def _closed_buckets(self, conn, user_id, tariff, period_start, now):
+        """Cached closed hourly buckets for the period, extended up to the current hour"""
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        key = (user_id, tariff.id, period_start)
+        with self.lock:
+            cached = self.bill_cache.get(key)
+            if cached is None:
+                # Drop this user's entries for other tariffs or periods
+                for stale in [k for k in self.bill_cache if k[0] == user_id]:
+                    del self.bill_cache[stale]
+                cached = {'closed_until': period_start, 'kwh': np.zeros(0), 'hours': np.zeros(0, dtype=np.int64)}
+                self.bill_cache[key] = cached
+
+        if cached['closed_until'] < current_hour:
+            usage = query_usage(conn, user_id, cached['closed_until'], current_hour, 'hour', now=now)
+            if usage:
+                kwh = np.array([entry['energy_kwh'] for entry in usage])
+                hours = np.array([int(entry['bucket'][11:13]) for entry in usage])
+                with self.lock:
+                    cached['kwh'] = np.concatenate((cached['kwh'], kwh))
+                    cached['hours'] = np.concatenate((cached['hours'], hours))
+            cached['closed_until'] = current_hour
+        return cached
+
+    def get_bill(self, conn, user_id, now=None):
+        """Bill to date and projected bill for the user's current billing period"""
+        now = now or datetime.now()
+        tariff = self.get_user_tariff(conn, user_id, now)
+        period_start, period_end = billing_period(now)
+        cached = self._closed_buckets(conn, user_id, tariff, period_start, now)
+
+        # Only the open hour is read fresh on every request
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        open_usage = query_usage(conn, user_id, current_hour, now, now=now)
+        open_kwh = open_usage[0]['energy_kwh'] if open_usage else 0.0
+        kwh = np.append(cached['kwh'], open_kwh)
+        hours = np.append(cached['hours'], current_hour.hour)
+
+        # Project the rest of the period from the average profile per hour of day
+        profile_sum = np.bincount(hours, weights=kwh, minlength=24)
+        profile_count = np.bincount(hours, minlength=24)
+        profile = np.divide(profile_sum, profile_count, out=np.zeros(24), where=profile_count > 0)
+        remaining_hours = max(0, int((period_end - current_hour).total_seconds() // 3600) - 1)
+        future_hours = (current_hour.hour + 1 + np.arange(remaining_hours)) % 24
+
+        to_date = tariff.bill(kwh, hours)
+        projected = tariff.bill(np.concatenate((kwh, profile[future_hours])),
+                                np.concatenate((hours, future_hours)))
+
+        return {
+            'tariff': tariff.name,
+            'tariff_version': tariff.version,
+            'currency': tariff.currency,
+            'currency_symbol': CURRENCY_SYMBOLS.get(tariff.currency, tariff.currency),
+            'period_start': period_start.isoformat(),
+            'period_end': period_end.isoformat(),
+            'to_date': to_date,
+            'projected': projected
+        }
+
+    def set_user_tariff(self, conn, user_id, tariff_name):
+        """Assign a tariff to a user; returns False if no such tariff exists in their currency"""
+        if not conn.execute('''
+            SELECT 1 FROM tariffs
+            WHERE name = ? AND currency = COALESCE((SELECT currency FROM user_preferences WHERE user_id = ?), 'INR')
+        ''', (tariff_name, user_id)).fetchone():
+            return False
+        conn.execute('''
+            INSERT INTO user_tariffs (user_id, tariff_name, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                tariff_name = excluded.tariff_name, updated_at = excluded.updated_at
+        ''', (user_id, tariff_name, datetime.now()))
+        return True
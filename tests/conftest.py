@@ -0,0 +1,27 @@
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Datetimes are stored as ISO 8601 with 'T', as the app and daemon do
+sqlite3.register_adapter(datetime, lambda dt: dt.isoformat())
+
+@pytest.fixture
+def db_path(tmp_path):
+    """A fresh database with every migration applied"""
+    import migrations
+
+    path = str(tmp_path / 'test.db')
+    migrations.migrate(path)
+    return path
+
+@pytest.fixture
+def conn(db_path):
+    connection = sqlite3.connect(db_path)
+    connection.row_factory = sqlite3.Row
+    yield connection
+    connection.close()
@@ -0,0 +1,65 @@
+import random
+
+import numpy as np
+import pytest
+
+from anomaly_service import ALL_HOURS, AnomalyDetector
+
+ALPHA = 0.1  # warm-up ends after 1 / ALPHA = 10 readings
+
+def reference(values, alpha):
+    """Welford's running mean and population variance while 1/(n+1) > alpha,
+    then the exponentially weighted mean and variance, written out separately"""
+    mean = m2 = 0.0
+    variance = 0.0
+    for n, x in enumerate(values):
+        if 1.0 / (n + 1) > alpha:
+            delta = x - mean
+            mean += delta / (n + 1)
+            m2 += delta * (x - mean)
+            variance = m2 / (n + 1)
+        else:
+            delta = x - mean
+            mean += alpha * delta
+            variance = (1 - alpha) * (variance + alpha * delta * delta)
+    return mean, variance
+
+def feed(detector, rows, column, values):
+    for value in values:
+        detector._update(np.array(rows), column, np.full(len(rows), value, dtype=np.float64))
+
+def test_warm_up_is_plain_mean_and_variance():
+    detector = AnomalyDetector(alpha=ALPHA)
+    values = [120.0, 80.0, 95.5, 130.0, 101.0, 99.0, 87.25]
+    feed(detector, [0], 5, values)
+    assert detector.count[0, 5] == len(values)
+    assert detector.mean[0, 5] == pytest.approx(np.mean(values))
+    assert detector.var[0, 5] == pytest.approx(np.var(values))
+
+def test_switches_to_ewma_after_warm_up():
+    detector = AnomalyDetector(alpha=ALPHA)
+    rng = random.Random(11)
+    values = [rng.gauss(1000, 50) for _ in range(200)] + [rng.gauss(1500, 20) for _ in range(100)]
+    feed(detector, [0], ALL_HOURS, values)
+    mean, variance = reference(values, ALPHA)
+    assert detector.mean[0, ALL_HOURS] == pytest.approx(mean, rel=1e-9)
+    assert detector.var[0, ALL_HOURS] == pytest.approx(variance, rel=1e-9)
+    # The weighted profile has moved to the new level rather than averaging both
+    assert detector.mean[0, ALL_HOURS] == pytest.approx(1500, abs=25)
+
+def test_slots_update_independently():
+    detector = AnomalyDetector(alpha=ALPHA)
+    rng = random.Random(4)
+    series = {(row, hour): [rng.uniform(10, 2000) for _ in range(rng.randint(3, 40))]
+              for row in range(3) for hour in (0, 7, 23)}
+    # One vectorized call per step across every slot that still has readings
+    for step in range(max(len(values) for values in series.values())):
+        slots = [slot for slot, values in series.items() if len(values) > step]
+        detector._update(np.array([row for row, _ in slots]), np.array([hour for _, hour in slots]),
+                         np.array([series[slot][step] for slot in slots]))
+    for (row, hour), values in series.items():
+        mean, variance = reference(values, ALPHA)
+        assert detector.count[row, hour] == len(values)
+        assert detector.mean[row, hour] == pytest.approx(mean, rel=1e-9)
+        assert detector.var[row, hour] == pytest.approx(variance, rel=1e-9)
+    assert not detector.count[:, 1].any()
@@ -0,0 +1,116 @@
+import os
+import random
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import archive_service
+from rollup_service import READING_SPANS_CTE, merge_usage, reading_span_params
+
+START = datetime(2026, 3, 1, 0, 0, 7)
+
+@pytest.fixture
+def readings(conn):
+    """Three days of deadband readings for two users' appliances"""
+    conn.executemany("INSERT INTO users (id, username, email, password) VALUES (?, ?, ?, 'p')",
+                     [(1, 'u1', 'u1@x.io'), (2, 'u2', 'u2@x.io')])
+    rng = random.Random(7)
+    rows = []
+    for user_id, appliance_id in ((1, 1), (1, 2), (2, 3)):
+        moment = START + timedelta(seconds=rng.uniform(0, 30))
+        while moment < START + timedelta(days=3):
+            rows.append((user_id, appliance_id, rng.random() < 0.5, round(rng.uniform(5, 2000), 2), moment))
+            moment += timedelta(seconds=rng.choice([10, 10, 40, 290, 300, 900]))
+    conn.executemany('''
+        INSERT INTO appliance_data (user_id, appliance_id, is_on, power_consumption, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    return rows
+
+def hot_usage(conn, user_id, start, end, bucket_expr, by_appliance):
+    """The raw path of rollup_service.query_usage over hot rows only"""
+    group_cols = 'bucket, appliance_id' if by_appliance else 'bucket'
+    return merge_usage(conn.execute(READING_SPANS_CTE + f'''
+        SELECT {bucket_expr} AS bucket, appliance_id,
+               SUM(duration_s) / :tick, SUM(power_consumption * duration_s) / :tick,
+               MIN(power_consumption), MAX(power_consumption),
+               SUM(CASE WHEN is_on = 1 THEN duration_s ELSE 0 END) / :tick
+        FROM readings
+        GROUP BY {group_cols}
+    ''', reading_span_params(user_id, start, end)).fetchall(), by_appliance)
+
+BUCKET_EXPRS = {
+    'hour': "strftime('%Y-%m-%d %H:00', t_start)",
+    'hour_of_day': "strftime('%H', t_start)",
+    'day': "date(t_start)",
+    None: "'total'"
+}
+
+@pytest.mark.parametrize('bucket', list(BUCKET_EXPRS))
+@pytest.mark.parametrize('by_appliance', [False, True])
+def test_archived_aggregates_match_reading_spans(conn, readings, tmp_path, bucket, by_appliance):
+    window = (START + timedelta(hours=5, minutes=13), START + timedelta(days=2, hours=19, seconds=5))
+    expected = hot_usage(conn, 1, *window, BUCKET_EXPRS[bucket], by_appliance)
+    assert archive_service.archive_before(conn, datetime(2026, 3, 4), str(tmp_path)) == len(readings)
+    assert conn.execute('SELECT COUNT(*) FROM appliance_data').fetchone()[0] == 0
+
+    archived = merge_usage(archive_service.aggregate_archived(conn, 1, *window, bucket, by_appliance),
+                           by_appliance)
+    assert [(e['bucket'], e['appliance_id']) for e in archived] == \
+           [(e['bucket'], e['appliance_id']) for e in expected]
+    for left, right in zip(expected, archived):
+        for key in ('sample_count', 'power_sum', 'on_count', 'avg_power'):
+            assert right[key] == pytest.approx(left[key], rel=1e-6)
+        assert (right['power_min'], right['power_max']) == (left['power_min'], left['power_max'])
+
+def test_late_readings_get_a_new_file(conn, readings, tmp_path):
+    archive_service.archive_before(conn, datetime(2026, 3, 2), str(tmp_path))
+    first = conn.execute("SELECT path, row_count FROM reading_archives WHERE day = '2026-03-01'").fetchone()
+
+    conn.execute('''
+        INSERT INTO appliance_data (user_id, appliance_id, is_on, power_consumption, timestamp)
+        VALUES (1, 1, 1, 42.0, ?)
+    ''', (datetime(2026, 3, 1, 12, 0, 1),))
+    conn.commit()
+    assert archive_service.archive_day(conn, date(2026, 3, 1), str(tmp_path)) == 1
+    # Uncommitted: other connections still see the old file, which is untouched
+    other = sqlite3.connect(conn.execute('PRAGMA database_list').fetchone()[2])
+    assert other.execute("SELECT path FROM reading_archives WHERE day = '2026-03-01'").fetchone()[0] == first[0]
+    other.close()
+    assert os.path.exists(first[0])
+    conn.rollback()
+    assert conn.execute("SELECT path FROM reading_archives WHERE day = '2026-03-01'").fetchone()[0] == first[0]
+
+    archive_service.archive_before(conn, datetime(2026, 3, 2), str(tmp_path))
+    path, row_count = conn.execute("SELECT path, row_count FROM reading_archives WHERE day = '2026-03-01'").fetchone()
+    assert path != first[0] and path.endswith('.v2.parquet')
+    assert row_count == first[1] + 1
+    assert archive_service.pq.read_table(path).num_rows == row_count
+
+    # The replica may still list the old file, so it outlives the grace period only
+    assert os.path.exists(first[0])
+    assert archive_service.remove_superseded(conn) == 0
+    later = datetime.now() + timedelta(seconds=archive_service.SUPERSEDED_GRACE_SECONDS + 1)
+    assert archive_service.remove_superseded(conn, later) == 1
+    assert not os.path.exists(first[0])
+    assert conn.execute('SELECT COUNT(*) FROM superseded_archives').fetchone()[0] == 0
+
+def test_archive_before_commits_each_day(conn, readings, tmp_path, monkeypatch):
+    archive_day = archive_service.archive_day
+
+    def failing(conn, day, archive_dir):
+        if day == date(2026, 3, 2):
+            raise OSError('disk full')
+        return archive_day(conn, day, archive_dir)
+
+    monkeypatch.setattr(archive_service, 'archive_day', failing)
+    with pytest.raises(OSError):
+        archive_service.archive_before(conn, datetime(2026, 3, 4), str(tmp_path))
+    conn.rollback()
+    assert [row[0] for row in conn.execute('SELECT day FROM reading_archives')] == ['2026-03-01']
+    oldest = conn.execute('SELECT MIN(timestamp) FROM appliance_data').fetchone()[0]
+    assert datetime.fromisoformat(oldest) >= datetime(2026, 3, 2)
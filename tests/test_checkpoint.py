@@ -0,0 +1,36 @@
+import os
+
+import pytest
+
+import checkpoint
+from checkpoint import MIN_SLOT_SIZE, SnapshotFile, snapshot_path
+
+def test_snapshot_path_follows_database(tmp_path):
+    assert snapshot_path(str(tmp_path / 'a.db')) != snapshot_path(str(tmp_path / 'b.db'))
+    assert os.path.dirname(snapshot_path(str(tmp_path / 'a.db'))) == str(tmp_path)
+
+def test_slots_alternate(tmp_path):
+    path = str(tmp_path / 'sim.snapshot')
+    snapshot = SnapshotFile(path)
+    snapshot.write({'tick_count': 1})
+    snapshot.write({'tick_count': 2})
+    assert SnapshotFile(path).read() == {'tick_count': 2}
+
+def test_crash_while_growing_keeps_old_checkpoint(tmp_path, monkeypatch):
+    path = str(tmp_path / 'sim.snapshot')
+    snapshot = SnapshotFile(path)
+    snapshot.write({'tick_count': 1})
+    snapshot.write({'tick_count': 2})
+
+    def crash(src, dst):
+        raise OSError('crashed before rename')
+    monkeypatch.setattr(checkpoint.os, 'replace', crash)
+    with pytest.raises(OSError):
+        snapshot.write({'tick_count': 3, 'blob': os.urandom(MIN_SLOT_SIZE)})
+    assert SnapshotFile(path).read() == {'tick_count': 2}
+
+    monkeypatch.undo()
+    big = {'tick_count': 4, 'blob': os.urandom(MIN_SLOT_SIZE)}
+    snapshot.write(big)
+    assert SnapshotFile(path).read() == big
+    assert not os.path.exists(path + '.tmp')
@@ -0,0 +1,85 @@
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+duckdb = pytest.importorskip('duckdb')
+
+import duckdb_engine
+import migrations
+from duckdb_engine import DuckDBUsage, UsageEngine
+from rollup_service import query_usage
+
+START = datetime(2026, 3, 1, 5, 47)
+
+@pytest.fixture
+def readings(conn):
+    """Two days of readings with rollups backfilled up to the last minute"""
+    conn.execute("INSERT INTO users (id, username, email, password) VALUES (1, 'u', 'u@x.io', 'p')")
+    conn.execute("DELETE FROM rollup_state")
+    rng = random.Random(5)
+    rows = []
+    for appliance_id in (1, 2):
+        moment = START + timedelta(seconds=rng.uniform(0, 30))
+        while moment < START + timedelta(days=2):
+            rows.append((1, appliance_id, rng.random() < 0.5, rng.uniform(5, 2000), moment))
+            moment += timedelta(seconds=rng.choice([10, 10, 40, 290, 300]))
+    conn.executemany('''
+        INSERT INTO appliance_data (user_id, appliance_id, is_on, power_consumption, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+    migrations.backfill_rollups(conn.cursor())
+    conn.commit()
+    return rows
+
+def test_compare_mode_shares_one_plan(db_path, readings, monkeypatch):
+    """Both engines run the plan built from a single watermark read, at the caller's `now`"""
+    engine = UsageEngine(db_path, 'sqlite', compare=True)
+    plans, nows = [], []
+    standin = sqlite3.connect(db_path)
+
+    def sqlite_side(conn, *args):
+        plans.append(args[-2])
+        nows.append(args[-1])
+        return query_usage(conn, *args)
+
+    def duckdb_side(*args):
+        # Stands in for the attached engine, which needs an extension download
+        plans.append(args[-2])
+        nows.append(args[-1])
+        return query_usage(standin, *args)
+
+    monkeypatch.setattr(duckdb_engine, 'query_usage', sqlite_side)
+    monkeypatch.setattr(engine.duckdb, 'query_usage', duckdb_side)
+    monkeypatch.setattr(engine.duckdb, 'watermark', lambda cursor: pytest.fail('watermark read twice'))
+    now = START + timedelta(days=2)
+    engine.query_usage(None, 1, START, now, 'hour', True, now=now)
+    standin.close()
+
+    assert len(plans) == 2 and plans[0] is plans[1]
+    assert nows == [now, now]
+    assert {table for table, _, _ in plans[0]} >= {'rollup_1h', None}
+    assert engine.status()['mismatches'] == 0
+
+def test_attached_duckdb_matches_sqlite(db_path, readings):
+    """The real ATTACH (TYPE sqlite) path, which needs DuckDB's sqlite extension.
+
+    The extension is downloaded on first use, so without network access (and
+    no locally installed copy) this test is skipped rather than faked.
+    """
+    try:
+        DuckDBUsage(db_path).cursor().close()
+    except duckdb.Error as e:
+        pytest.skip(f"DuckDB's sqlite extension is not available offline: {e}")
+
+    engine = UsageEngine(db_path, 'duckdb', compare=True)
+    end = START + timedelta(days=2, minutes=3)
+    for bucket in ('hour', 'hour_of_day', 'day', None):
+        for by_appliance in (False, True):
+            engine.query_usage(None, 1, START + timedelta(minutes=13), end, bucket, by_appliance)
+    status = engine.status()
+    assert status['engine'] == 'duckdb'
+    assert status['duckdb_failures'] == 0
+    assert status['mismatches'] == 0
+    assert status['calls'] == {'sqlite': 8, 'duckdb': 8}
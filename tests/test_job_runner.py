@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+from clock import VirtualClock
+from job_runner import JobRunner
+
+def simulate(db_path, start, days):
+    """Run an hourly job on a virtual clock, polling every five simulated minutes"""
+    clock = VirtualClock(start, start + timedelta(days=days))
+    runner = JobRunner(db_path, now=clock.now, simulated=lambda: True)
+    runs = []
+    runner.register('retention', 3600, lambda: runs.append(clock.now()), jitter=0)
+    while not clock.finished():
+        runner.run_pending()
+        clock.sleep(300)
+    return runs
+
+def wall_runner(db_path):
+    runs = []
+    runner = JobRunner(db_path)
+    runner.register('retention', 3600, lambda: runs.append(datetime.now()), jitter=0)
+    return runner, runs
+
+def test_simulated_run_after_wall_clock_run(db_path):
+    runner, runs = wall_runner(db_path)
+    assert runner.run_pending() == 1
+    # A past-dated simulation still gets its own hourly schedule
+    runs = simulate(db_path, datetime(2025, 1, 1), days=30)
+    assert len(runs) == 30 * 24
+    assert runs[1] - runs[0] == timedelta(hours=1)
+
+def test_wall_clock_run_after_future_simulation(db_path):
+    assert len(simulate(db_path, datetime.now() + timedelta(days=365), days=2)) == 2 * 24
+    # The simulation left no schedule stamps, so the wall-clock job is due at once
+    runner, runs = wall_runner(db_path)
+    assert runner.run_pending() == 1
+    assert runner.run_pending() == 0
+
+def test_simulated_run_waits_for_wall_clock_lease(db_path, conn):
+    conn.execute("INSERT INTO job_runs (name, owner, lease_until) VALUES ('retention', 'other', ?)",
+                 ((datetime.now() + timedelta(minutes=5)).isoformat(sep=' ', timespec='seconds'),))
+    conn.commit()
+    assert simulate(db_path, datetime(2025, 1, 1), days=1) == []
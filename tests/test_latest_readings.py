@@ -0,0 +1,30 @@
+from datetime import datetime
+
+import latest_readings
+from latest_readings import LatestReadingsTable, table_path
+
+def reading(appliance_id, power):
+    return {'appliance_id': appliance_id, 'user_id': 1, 'is_on': True, 'temperature': None,
+            'power_consumption': power, 'timestamp': datetime(2026, 3, 1, 12)}
+
+def test_table_path_is_per_database(tmp_path):
+    assert table_path('a.db', str(tmp_path / 'latest')) != table_path('b.db', str(tmp_path / 'latest'))
+    assert table_path('a.db') == table_path('./a.db')
+
+def test_stale_table_is_unavailable(tmp_path, monkeypatch):
+    path = str(tmp_path / 'latest')
+    writer, reader = LatestReadingsTable(path), LatestReadingsTable(path)
+    assert not reader.available()
+
+    clock = [1000.0]
+    monkeypatch.setattr(latest_readings.time, 'time', lambda: clock[0])
+    writer.publish([reading(3, 120.0), reading(2000, 5.0)])
+    assert reader.available()
+    assert reader.publish_count() == 1
+    assert reader.get(3)['power_consumption'] == 120.0
+    assert reader.get(2000)['power_consumption'] == 5.0
+    assert reader.get(4) is None
+
+    # The simulator stopped: its last table must not be served as live
+    clock[0] += latest_readings.MAX_PUBLISH_AGE + 1
+    assert not reader.available()
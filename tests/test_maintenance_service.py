@@ -0,0 +1,31 @@
+import sqlite3
+import time
+
+from maintenance_service import ANALYZE_MIN_ROWS, ANALYZE_STARVATION_CHECKS, MaintenanceScheduler
+
+def test_starved_queue_forces_one_analyze(db_path):
+    """With no window at all, stale tables still get analyzed one per starvation bound"""
+    conn = sqlite3.connect(db_path)
+    conn.executemany("INSERT INTO users (username, email, password) VALUES (?, ?, 'p')",
+                     [(f'u{n}', f'u{n}@x.io') for n in range(ANALYZE_MIN_ROWS)])
+    conn.execute("CREATE TABLE filler (value INTEGER)")
+    conn.executemany("INSERT INTO filler (value) VALUES (?)", [(n,) for n in range(ANALYZE_MIN_ROWS)])
+    conn.commit()
+    scheduler = MaintenanceScheduler(db_path)
+    expired = time.monotonic() - 1
+
+    for _ in range(ANALYZE_STARVATION_CHECKS):
+        assert scheduler.check_statistics(conn) == 2
+        scheduler.analyze(conn, expired)
+        assert scheduler.forced_analyzes == 0
+    scheduler.check_statistics(conn)
+    scheduler.analyze(conn, expired)
+    assert scheduler.forced_analyzes == 1
+    assert len(scheduler.stale_tables) == 1
+    assert conn.execute('SELECT COUNT(*) FROM maintenance_state').fetchone()[0] == 1
+
+    # The next check starts a fresh count
+    scheduler.check_statistics(conn)
+    scheduler.analyze(conn, expired)
+    assert scheduler.forced_analyzes == 1
+    conn.close()
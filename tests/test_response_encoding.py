@@ -0,0 +1,10 @@
+from response_encoding import to_columnar
+
+def test_uniform_lists_become_columns():
+    payload = {'usage': [{'hour': '01', 'avg_power': 5.0}, {'avg_power': 7.0, 'hour': '02'}], 'total': 3}
+    assert to_columnar(payload) == {'usage': {'hour': ['01', '02'], 'avg_power': [5.0, 7.0]}, 'total': 3}
+
+def test_mixed_keys_are_left_as_rows():
+    # Same number of keys, different names: converting would drop 'cost'
+    rows = [{'hour': '01', 'avg_power': 5.0}, {'hour': '02', 'cost': 0.4}]
+    assert to_columnar({'usage': rows}) == {'usage': rows}
@@ -0,0 +1,154 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import migrations
+from config import HEARTBEAT_INTERVAL, TICK_INTERVAL
+from rollup_service import ROLLUP_TIERS, get_watermark, merge_usage, plan_query, query_usage
+
+WATERMARK = datetime(2026, 3, 15, 12, 34)
+
+def assert_covers(segments, start, end):
+    """Segments are in order, contiguous and cover exactly [start, end)"""
+    assert segments[0][1] == start
+    assert segments[-1][2] == end
+    for (_, _, previous_end), (_, next_start, _) in zip(segments, segments[1:]):
+        assert previous_end == next_start
+
+def retention(table):
+    return next(days for name, _, days in ROLLUP_TIERS if name == table)
+
+@pytest.mark.parametrize('bucket', [None, 'hour', 'hour_of_day', 'day'])
+@pytest.mark.parametrize('days', [0.01, 1, 7.5, 30, 90, 500])
+def test_plan_covers_range(bucket, days):
+    end = WATERMARK + timedelta(minutes=5, seconds=17)
+    start = end - timedelta(days=days, seconds=41)
+    segments = plan_query(start, end, bucket, WATERMARK)
+    assert_covers(segments, start, end)
+    for table, lo, hi in segments:
+        if table is None:
+            continue
+        assert hi <= WATERMARK
+        if retention(table) is not None:
+            assert lo >= WATERMARK - timedelta(days=retention(table))
+
+def test_aligned_days_come_from_daily_tier():
+    segments = plan_query(datetime(2026, 3, 1), datetime(2026, 3, 10), 'day', WATERMARK)
+    assert segments == [('rollup_1d', datetime(2026, 3, 1), datetime(2026, 3, 10))]
+
+def test_open_minute_is_read_raw():
+    segments = plan_query(datetime(2026, 3, 15), datetime(2026, 3, 15, 13), None, WATERMARK)
+    assert segments[-1] == (None, WATERMARK, datetime(2026, 3, 15, 13))
+
+def test_expired_minute_tier_is_skipped():
+    # A 30-day window's unaligned start edge is past rollup_1m's retention
+    start = WATERMARK - timedelta(days=30, minutes=17)
+    segments = plan_query(start, WATERMARK, 'hour', WATERMARK)
+    assert all(table != 'rollup_1m' for table, lo, _ in segments if lo < WATERMARK - timedelta(days=7))
+    assert segments[0] == (None, start, start.replace(minute=0) + timedelta(hours=1))
+
+def test_no_watermark_reads_everything_raw():
+    start, end = datetime(2026, 3, 1), datetime(2026, 3, 2)
+    assert plan_query(start, end, 'hour', None) == [(None, start, end)]
+
+def test_merge_usage_combines_segments():
+    rows = [
+        ('2026-03-01', None, 6, 600.0, 50.0, 150.0, 3),
+        ('2026-03-01', None, 4, 800.0, 100.0, 300.0, 4),
+        ('2026-03-02', None, 2, 20.0, 10.0, 10.0, 0)
+    ]
+    usage = merge_usage(rows)
+    assert [entry['bucket'] for entry in usage] == ['2026-03-01', '2026-03-02']
+    first = usage[0]
+    assert first['sample_count'] == 10
+    assert first['power_sum'] == 1400.0
+    assert (first['power_min'], first['power_max']) == (50.0, 300.0)
+    assert first['on_count'] == 7
+    assert first['avg_power'] == pytest.approx(140.0)
+
+def test_latest_reading_holds_until_now(conn):
+    """The open span ends at the caller's (simulated) now, not the wall clock"""
+    conn.execute("DELETE FROM rollup_state")
+    moment = datetime(2026, 3, 1, 5)
+    conn.execute('''
+        INSERT INTO appliance_data (user_id, appliance_id, is_on, power_consumption, timestamp)
+        VALUES (1, 1, 1, 100.0, ?)
+    ''', (moment,))
+    now = moment + timedelta(seconds=6 * TICK_INTERVAL)
+    usage = query_usage(conn, 1, moment - timedelta(hours=1), now + timedelta(hours=1), now=now)
+    assert usage[0]['sample_count'] == pytest.approx(6)
+    # Without a simulated now the span runs to the wall clock, capped at a heartbeat
+    usage = query_usage(conn, 1, moment - timedelta(hours=1), now + timedelta(hours=1))
+    assert usage[0]['sample_count'] == pytest.approx(HEARTBEAT_INTERVAL / TICK_INTERVAL)
+
+def test_backfill_matches_raw_aggregates(conn, db_path):
+    """Rollups built by the backfill migration give the same answers as raw spans"""
+    conn.execute("INSERT INTO users (id, username, email, password) VALUES (1, 'u', 'u@x.io', 'p')")
+    conn.execute("DELETE FROM rollup_state")
+    rng = random.Random(3)
+    start = datetime(2026, 3, 1, 5, 47)
+    rows = []
+    for appliance_id in (1, 2, 3):
+        moment = start + timedelta(seconds=rng.uniform(0, 30))
+        while moment < start + timedelta(days=2):
+            rows.append((1, appliance_id, rng.random() < 0.5, rng.uniform(5, 2000), moment))
+            # Deadband spacing: ticks, longer gaps and the odd outage
+            moment += timedelta(seconds=rng.choice([10, 10, 40, 290, 300, 900]))
+    conn.executemany('''
+        INSERT INTO appliance_data (user_id, appliance_id, is_on, power_consumption, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    ''', rows)
+
+    window = (start - timedelta(hours=1), start + timedelta(days=2))
+    expected = {bucket: query_usage(conn, 1, *window, bucket, by_appliance=True)
+                for bucket in ('hour', 'day', None)}
+    migrations.backfill_rollups(conn.cursor())
+    conn.commit()
+    assert get_watermark(conn) >= window[1]
+    # Small chunks, so pages split appliances' readings mid-span
+    assert migrations.run_backfill(db_path, chunk_rows=997) == len(rows)
+    assert conn.execute("SELECT COUNT(*) FROM rollup_state WHERE name LIKE 'backfill_%'").fetchone()[0] == 0
+
+    for bucket, raw in expected.items():
+        rolled = {(e['bucket'], e['appliance_id']): e for e in query_usage(conn, 1, *window, bucket, by_appliance=True)}
+        raw = {(e['bucket'], e['appliance_id']): e for e in raw}
+        # Raw spans count towards the bucket they start in, rollups split them
+        # at minute boundaries, so buckets may trade up to one heartbeat
+        slack = 0 if bucket is None else HEARTBEAT_INTERVAL / TICK_INTERVAL
+        empty = {'sample_count': 0, 'on_count': 0}
+        for key in raw.keys() | rolled.keys():
+            left, right = raw.get(key, empty), rolled.get(key, empty)
+            assert right['sample_count'] == pytest.approx(left['sample_count'], rel=1e-6, abs=slack)
+            assert right['on_count'] == pytest.approx(left['on_count'], rel=1e-6, abs=slack)
+            if bucket is None:
+                assert right['power_sum'] == pytest.approx(left['power_sum'], rel=1e-6)
+                assert right['power_max'] == left['power_max']
+
+def test_backfill_resumes_after_interruption(conn, db_path, monkeypatch):
+    conn.execute("DELETE FROM rollup_state")
+    start = datetime(2026, 3, 1)
+    conn.executemany('''
+        INSERT INTO appliance_data (user_id, appliance_id, is_on, power_consumption, timestamp)
+        VALUES (1, ?, 1, 100.0, ?)
+    ''', [(appliance_id, start + timedelta(seconds=10 * n)) for appliance_id in (1, 2) for n in range(500)])
+    migrations.backfill_rollups(conn.cursor())
+    conn.commit()
+
+    page = migrations._backfill_page
+    calls = []
+    def failing(*args):
+        calls.append(1)
+        if len(calls) == 3:
+            raise RuntimeError('interrupted')
+        page(*args)
+    monkeypatch.setattr(migrations, '_backfill_page', failing)
+    with pytest.raises(RuntimeError):
+        migrations.run_backfill(db_path, chunk_rows=300)
+    # The two committed chunks stay and the failed one rolled back: all of
+    # appliance 1 (499 ticks plus a heartbeat for its last reading) and 100 of appliance 2
+    assert conn.execute('SELECT SUM(sample_count) FROM rollup_1d').fetchone()[0] == pytest.approx(529 + 100)
+
+    monkeypatch.setattr(migrations, '_backfill_page', page)
+    assert migrations.run_backfill(db_path, chunk_rows=300) == 400
+    assert conn.execute('SELECT SUM(sample_count) FROM rollup_1d').fetchone()[0] == pytest.approx(2 * 529)
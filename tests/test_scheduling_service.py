@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import numpy as np
+
+from scheduling_service import solve_household
+from tariff_service import Tariff
+
+TARIFF = Tariff(1, 'tou', 1, 'INR', {
+    'slabs': [[None, 4.0]],
+    'tou': [{'hours': [18, 19, 20, 21], 'multiplier': 1.2}, {'hours': [22, 23, 0, 1, 2, 3, 4, 5], 'multiplier': 0.9}]
+})
+
+def household(*jobs, peak=5000, baseline=0.0):
+    return {'jobs': list(jobs), 'baseline': np.full(24, baseline), 'month_kwh': 0.0, 'peak_power_w': peak}
+
+def job(appliance_id, power_w, minutes, earliest, deadline):
+    return {'appliance_id': appliance_id, 'name': f'job {appliance_id}', 'type': 'dishwasher',
+            'power_w': power_w, 'duration_minutes': minutes, 'earliest_start': earliest, 'deadline': deadline}
+
+def test_unconstrained_runs_are_proved_optimal():
+    result = solve_household(household(job(1, 1800, 120, '20:00', '07:00')), TARIFF, datetime(2026, 3, 1, 12))
+    assert result['optimal']
+    # Cheapest hours are the 0.9x night window
+    assert result['schedule'][0]['start'].hour >= 22 or result['schedule'][0]['start'].hour < 6
+
+def test_peak_clash_is_not_reported_optimal():
+    # Two runs that each want the same cheap night slots but can't overlap under the peak
+    result = solve_household(household(job(1, 3000, 60, '22:00', '23:00'), job(2, 3000, 60, '22:00', '23:00'), peak=5000),
+                             TARIFF, datetime(2026, 3, 1, 12))
+    assert any(item['peak_exceeded'] for item in result['schedule'])
+    assert not result['optimal']
+
+def test_overrunning_window_is_not_reported_optimal():
+    # A 60-minute run with only 30 minutes of its window left
+    result = solve_household(household(job(1, 3750, 60, '03:00', '07:00')), TARIFF, datetime(2026, 3, 1, 6, 30))
+    assert result['total_cost'] == result['lower_bound']
+    assert not result['optimal']
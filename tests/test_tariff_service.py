@@ -0,0 +1,74 @@
+import json
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from tariff_service import TariffEngine, load_tariffs
+
+@pytest.fixture
+def tariffs(conn):
+    """Seeded tariffs by name, with their definitions"""
+    definitions = {row['name']: json.loads(row['definition'])
+                   for row in conn.execute('SELECT name, definition FROM tariffs')}
+    return {name: (tariff, definitions[name]) for name, tariff in load_tariffs(conn, datetime(2026, 3, 1)).items()}
+
+def reference_cost(tariff, definition, kwh, hours):
+    """Unit-at-a-time slab walk, the definition energy_costs vectorizes"""
+    limits = [limit for limit, _ in definition['slabs']]
+    rates = [rate for _, rate in definition['slabs']]
+    used, costs = 0.0, []
+    for amount, hour in zip(kwh, hours):
+        cost, left = 0.0, amount
+        while left > 1e-12:
+            tier = next(i for i, limit in enumerate(limits) if limit is None or used < limit)
+            step = left if limits[tier] is None else min(left, limits[tier] - used)
+            cost += step * rates[tier]
+            used += step
+            left -= step
+        costs.append(cost * tariff.hour_multipliers[hour])
+    return costs
+
+def test_flat_rate(tariffs):
+    tariff = tariffs['flat_inr'][0]
+    costs = tariff.energy_costs(np.array([1.0, 2.5, 0.0]), np.array([0, 12, 23]))
+    assert costs == pytest.approx([5.8, 14.5, 0.0])
+
+def test_slabs_and_tou_match_unit_walk(tariffs):
+    tariff, definition = tariffs['domestic_tou_inr']
+    rng = np.random.default_rng(7)
+    kwh = rng.uniform(0, 3, 24 * 31)
+    hours = np.arange(len(kwh)) % 24
+    assert tariff.energy_costs(kwh, hours) == pytest.approx(reference_cost(tariff, definition, kwh, hours))
+
+def test_bucket_crossing_slab_boundary_is_split(tariffs):
+    tariff = tariffs['domestic_tou_inr'][0]
+    # 90 kWh at 3.0, then 20 kWh straddling the 100 kWh boundary at noon
+    costs = tariff.energy_costs(np.array([90.0, 20.0]), np.array([12, 12]))
+    assert costs == pytest.approx([270.0, 10 * 3.0 + 10 * 4.5])
+
+def test_tou_multipliers_apply_per_hour(tariffs):
+    tariff = tariffs['domestic_tou_inr'][0]
+    costs = tariff.energy_costs(np.array([1.0, 1.0, 1.0]), np.array([19, 2, 12]))
+    assert costs == pytest.approx([3.0 * 1.2, 3.0 * 0.9, 3.0])
+
+def test_bill_adds_fixed_charge(tariffs):
+    bill = tariffs['domestic_tou_inr'][0].bill(np.array([10.0]), np.array([12]))
+    assert bill == {'energy_kwh': 10.0, 'energy_charge': 30.0, 'fixed_charge': 50, 'total': 80.0}
+
+@pytest.mark.parametrize('currency, name', [('USD', 'flat_usd'), ('GBP', 'flat_gbp'), (None, 'flat_inr')])
+def test_default_tariff_follows_currency(conn, currency, name):
+    conn.execute("INSERT INTO users (id, username, email, password) VALUES (1, 'u', 'u@x.io', 'p')")
+    conn.execute('INSERT INTO user_preferences (user_id, currency) VALUES (1, ?)', (currency,))
+    tariff = TariffEngine().get_user_tariff(conn, 1, datetime(2026, 3, 1))
+    assert (tariff.name, tariff.currency) == (name, currency or 'INR')
+
+def test_versions_take_effect_at_simulated_time(conn):
+    conn.execute("INSERT INTO users (id, username, email, password) VALUES (1, 'u', 'u@x.io', 'p')")
+    conn.execute('''
+        INSERT INTO tariffs (name, version, currency, definition, effective_from)
+        VALUES ('flat_inr', 2, 'INR', '{"slabs": [[null, 7.0]]}', ?)
+    ''', (datetime(2026, 3, 1),))
+    engine = TariffEngine()
+    assert engine.get_user_tariff(conn, 1, datetime(2026, 2, 28, 23)).version == 1
+    assert engine.get_user_tariff(conn, 1, datetime(2026, 3, 1)).version == 2
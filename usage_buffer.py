@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from config import TICK_INTERVAL, USAGE_BUFFER_BUDGET_BYTES
+from rollup_service import BUCKET_FORMAT, EPOCH
+
+MINUTES = 24 * 60
+
+def minute_index(dt):
+    """Absolute minute number of a naive local datetime"""
+    return int((dt - EPOCH).total_seconds() // 60)
+
+class UserRing:
+    """24 hours of per-minute power sums and sample counts for one user"""
+
+    __slots__ = ('power_sum', 'sample_count', 'minute', 'synced_until')
+
+    def __init__(self):
+        self.power_sum = np.zeros(MINUTES, dtype=np.float64)
+        self.sample_count = np.zeros(MINUTES, dtype=np.int32)
+        self.minute = np.full(MINUTES, -1, dtype=np.int64)  # absolute minute held by each slot
+        self.synced_until = None  # minutes before this were loaded from rollup_1m
+
+    @staticmethod
+    def nbytes():
+        return MINUTES * (8 + 4 + 8)
+
+    def add(self, minute, power, count=1):
+        slot = minute % MINUTES
+        if self.minute[slot] != minute:
+            self.minute[slot] = minute
+            self.power_sum[slot] = 0
+            self.sample_count[slot] = 0
+        self.power_sum[slot] += power
+        self.sample_count[slot] += count
+
+    def set_minutes(self, minutes, power_sums, counts):
+        """Overwrite whole minutes with complete values (idempotent)"""
+        slots = minutes % MINUTES
+        self.minute[slots] = minutes
+        self.power_sum[slots] = power_sums
+        self.sample_count[slots] = counts
+
+    def window(self, now_minute, minutes):
+        """Mask of slots holding one of the last `minutes` minutes"""
+        return (self.minute > now_minute - minutes) & (self.minute <= now_minute)
+
+class UsageRingBuffer:
+    """Per-user 24-hour minute ring buffers for the dashboard charts.
+
+    Fed in-process from the simulator write path; users are loaded from the
+    rollup_1m tier on first access and evicted least-recently-used once the
+    memory budget is reached. In processes that don't run the simulator,
+    closed minutes are caught up from rollup_1m on access.
+    """
+
+    def __init__(self, budget_bytes=USAGE_BUFFER_BUDGET_BYTES):
+        self.max_users = max(1, budget_bytes // UserRing.nbytes())
+        self.rings = OrderedDict()
+        self.lock = threading.Lock()
+        self.last_write = None
+
+    def add_readings(self, data_list):
+        """Accumulate readings for users that are currently loaded"""
+        with self.lock:
+            self.last_write = time.monotonic()
+            for data in data_list:
+                ring = self.rings.get(data['user_id'])
+                if ring is not None:
+                    ring.add(minute_index(data['timestamp']), data['power_consumption'])
+
+    def is_fed(self):
+        """Whether an in-process simulator is writing to this buffer"""
+        return self.last_write is not None and time.monotonic() - self.last_write < 3 * TICK_INTERVAL
+
+    def _sync(self, conn, user_id, ring, now):
+        """Copy closed minutes from rollup_1m into the ring"""
+        start = now - timedelta(minutes=MINUTES)
+        if ring.synced_until is not None:
+            start = max(start, ring.synced_until)
+        rows = conn.execute('''
+            SELECT bucket_start, SUM(sample_count), SUM(power_sum)
+            FROM rollup_1m
+            WHERE user_id = ? AND bucket_start >= ?
+            GROUP BY bucket_start
+        ''', (user_id, start.strftime(BUCKET_FORMAT))).fetchall()
+
+        if rows:
+            minutes = np.array([minute_index(datetime.strptime(row[0], BUCKET_FORMAT)) for row in rows],
+                               dtype=np.int64)
+            counts = np.array([row[1] for row in rows], dtype=np.int32)
+            power_sums = np.array([row[2] for row in rows], dtype=np.float64)
+            ring.set_minutes(minutes, power_sums, counts)
+            ring.synced_until = EPOCH + timedelta(minutes=int(minutes.max()) + 1)
+        elif ring.synced_until is None:
+            ring.synced_until = start
+
+    def get(self, conn, user_id, now=None):
+        """Ring for a user, loading it from the database if needed"""
+        now = now or datetime.now()
+        with self.lock:
+            ring = self.rings.get(user_id)
+            if ring is None:
+                ring = UserRing()
+                self._sync(conn, user_id, ring, now)
+                self.rings[user_id] = ring
+                while len(self.rings) > self.max_users:
+                    self.rings.popitem(last=False)
+            else:
+                self.rings.move_to_end(user_id)
+                if not self.is_fed():
+                    self._sync(conn, user_id, ring, now)
+            return ring
+
+    def warm(self, conn, now=None):
+        """Rebuild rings for recently active users, up to the memory budget"""
+        now = now or datetime.now()
+        rows = conn.execute('''
+            SELECT DISTINCT user_id FROM rollup_1m
+            WHERE bucket_start >= ?
+            LIMIT ?
+        ''', ((now - timedelta(hours=1)).strftime(BUCKET_FORMAT), self.max_users)).fetchall()
+        for row in rows:
+            self.get(conn, row[0], now)
+        return len(rows)
+
+    def hourly_usage(self, conn, user_id, now=None):
+        """Average power per hour of day over the last 24 hours"""
+        now = now or datetime.now()
+        ring = self.get(conn, user_id, now)
+        with self.lock:
+            mask = ring.window(minute_index(now), MINUTES)
+            hours = (ring.minute[mask] // 60) % 24
+            sums = np.bincount(hours, weights=ring.power_sum[mask], minlength=24)
+            counts = np.bincount(hours, weights=ring.sample_count[mask], minlength=24)
+        return [
+            {'hour': f'{hour:02d}', 'avg_power': float(sums[hour] / counts[hour])}
+            for hour in np.flatnonzero(counts)
+        ]
+
+    def last_hour(self, conn, user_id, now=None):
+        """Average power, energy and sample count over the last 60 minutes"""
+        now = now or datetime.now()
+        ring = self.get(conn, user_id, now)
+        with self.lock:
+            mask = ring.window(minute_index(now), 60)
+            power_sum = float(ring.power_sum[mask].sum())
+            count = int(ring.sample_count[mask].sum())
+        return {
+            'avg_power': round(power_sum / count, 2) if count else 0,
+            'energy_kwh': round(power_sum * TICK_INTERVAL / 3600000.0, 4),
+            'data_points': count
+        }
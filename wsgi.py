@@ -0,0 +1,16 @@
+# Web worker entry point for multi-worker WSGI servers. Workers are
+# stateless; the simulator runs once as its own daemon and workers reach it
+# over SIMULATOR_SOCKET_PATH:
+#
+#   python simulation_service.py
+#   gunicorn --workers 4 --threads 16 --preload wsgi:app
+#
+# Live dashboard polls (/api/live) wait up to LIVE_POLL_SECONDS for the next
+# tick, so workers need threads: at most LIVE_MAX_WAITERS of them wait per
+# process and the rest are left for ordinary requests, which return promptly.
+
+from app import app, init_db
+
+# Migrations are idempotent and cross-process safe; with --preload this runs
+# once in the master before workers fork
+init_db()